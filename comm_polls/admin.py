@@ -1,8 +1,108 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Poll, Choice, Vote, Profile, ManagerRequest
+from .models import Poll, Choice, Vote, Profile, ManagerRequest, RequestProfile
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils.functional import cached_property
 from django.utils.html import format_html
+from .bitmaps import invalidate as invalidate_bitmaps
+from .purge import hide_polls
+from .opening import forget_choice_lists
+
+# --- Filters and pagination for large tables ---
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    A list filter rendered as a text box. Unlike a related-field filter it
+    never loads the full list of polls or users to render its options.
+    """
+    template = 'admin/comm_polls/input_filter.html'
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        # A non-empty lookups() is required for the filter to be shown;
+        # the single option is never rendered.
+        return (('', ''),)
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = (
+            (key, value)
+            for key, value in changelist.get_filters_params().items()
+            if key != self.parameter_name
+        )
+        yield all_choice
+
+
+class PollFilter(InputFilter):
+    title = 'poll'
+    parameter_name = 'poll'
+    placeholder = 'Poll id or name prefix'
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(poll_id=value)
+        return queryset.filter(poll__name__istartswith=value)
+
+
+class VoterFilter(InputFilter):
+    title = 'voter'
+    parameter_name = 'voter'
+    placeholder = 'Username or user id'
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(voter_id=value)
+        return queryset.filter(voter__username=value)
+
+
+class CreatorFilter(InputFilter):
+    title = 'creator'
+    parameter_name = 'creator'
+    placeholder = 'Username'
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        return queryset.filter(created_by__username=value) if value else queryset
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    On PostgreSQL, unfiltered changelists of big tables use the planner's
+    row estimate (pg_class.reltuples) instead of an exact COUNT(*), which
+    has to scan the whole table. Filtered lists and small tables stay exact.
+    """
+    estimate_above = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_above:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 # --- Inline and Custom User Admin ---
 
@@ -19,7 +119,7 @@ class ProfileInline(admin.StackedInline):
     def avatar_preview(self, obj):
         """Displays the avatar image in the admin."""
         if obj.avatar:
-            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px;" />', obj.avatar.url)
+            return format_html('<img src="{}" style="max-height: 100px; max-width: 100px;" />', obj.avatar_url)
         return "No Image"
     avatar_preview.short_description = 'Avatar Preview'
 
@@ -34,24 +134,138 @@ class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 1
 @admin.register(Poll)
-class PollAdmin(admin.ModelAdmin):
-    list_display = ("name", "created_by", "created_at", "start_date", "end_date")
+class PollAdmin(LargeTableAdmin):
+    list_display = ("name", "created_by", "created_at", "start_date", "end_date", "kind")
     inlines = [ChoiceInline]
-    list_filter = ('created_by', 'start_date', 'end_date')
+    list_filter = (CreatorFilter, 'start_date', 'end_date', 'kind')
+    list_select_related = ('created_by',)
     search_fields = ('name', 'description')
+    autocomplete_fields = ('created_by',)
+
+    # Deleting goes through comm_polls.purge so large polls are hidden at once
+    # and their votes removed in chunks, instead of being collected in memory.
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        return [str(obj) for obj in objs], {self.opts.verbose_name_plural: len(objs)}, set(), []
+
+    def save_related(self, request, form, formsets, change):
+        # Inline choice edits and deletions land after the poll's own save.
+        super().save_related(request, form, formsets, change)
+        forget_choice_lists([form.instance.pk])
+
+    def delete_model(self, request, obj):
+        hide_polls([obj])
+
+    def delete_queryset(self, request, queryset):
+        hide_polls(list(queryset))
 
 @admin.register(Choice)
-class ChoiceAdmin(admin.ModelAdmin):
+class ChoiceAdmin(LargeTableAdmin):
     list_display = ("name", "poll", "votes_count")
-    list_filter = ('poll',)
+    list_filter = (PollFilter,)
+    list_select_related = ('poll',)
+    search_fields = ('name', 'poll__name')
+    autocomplete_fields = ('poll',)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        forget_choice_lists([obj.poll_id])
+
+    def delete_queryset(self, request, queryset):
+        poll_ids = set(queryset.values_list('poll_id', flat=True))
+        super().delete_queryset(request, queryset)
+        forget_choice_lists(poll_ids)
 
 @admin.register(Vote)
-class VoteAdmin(admin.ModelAdmin):
+class VoteAdmin(LargeTableAdmin):
     list_display = ("voter", "poll", "choice", "voted_at")
-    list_filter = ('poll', 'voter')
+    list_filter = (PollFilter, VoterFilter)
+    list_select_related = ('voter', 'poll', 'choice')
+    autocomplete_fields = ('poll', 'choice', 'voter')
+
+    # Cached voter bitmaps only learn about votes cast through the vote view,
+    # so drop them whenever an admin edits or removes ballots.
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        poll_ids = {obj.poll_id}
+        if change and form.initial.get('poll'):
+            poll_ids.add(form.initial['poll'])
+        invalidate_bitmaps(poll_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_bitmaps([obj.poll_id])
+
+    def delete_queryset(self, request, queryset):
+        poll_ids = set(queryset.values_list('poll_id', flat=True))
+        super().delete_queryset(request, queryset)
+        invalidate_bitmaps(poll_ids)
 
 @admin.register(ManagerRequest)
 class ManagerRequestAdmin(admin.ModelAdmin):
     list_display = ('user', 'status', 'requested_at')
     list_filter = ('status',)
     search_fields = ('user__username',)
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'url_name', 'status_code', 'duration_ms',
+                    'query_count', 'query_ms', 'samples', 'user', 'download')
+    list_filter = ('method', 'status_code')
+    list_select_related = ('user',)
+    search_fields = ('url_name', 'path')
+    readonly_fields = ('download', 'hottest_stacks')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/folded/', self.admin_site.admin_view(self.folded_view),
+                 name='comm_polls_requestprofile_folded'),
+        ] + super().get_urls()
+
+    def folded_view(self, request, pk):
+        profile = self.get_object(request, str(pk))
+        if profile is None or not self.has_view_permission(request, profile):
+            raise Http404
+        return FileResponse(profile.folded.open('rb'), as_attachment=True,
+                            filename=profile.folded.name.rsplit('/', 1)[-1], content_type='text/plain')
+
+    def download(self, obj):
+        url = reverse('admin:comm_polls_requestprofile_folded', args=[obj.pk])
+        return format_html('<a href="{}">folded stacks</a>', url)
+    download.short_description = 'Flame graph data'
+
+    def hottest_stacks(self, obj):
+        """The ten most sampled stacks, innermost frames only."""
+        try:
+            with obj.folded.open('r') as fh:
+                text = fh.read()
+        except OSError:
+            return 'The profile file is missing.'
+        stacks = []
+        for line in text.splitlines():
+            stack, _, count = line.rpartition(' ')
+            # Skip blank or hand-edited lines rather than fail the page.
+            if stack and count.isdigit():
+                stacks.append((stack, int(count)))
+            if len(stacks) == 10:
+                break
+        return format_html(
+            '<pre>{}</pre>',
+            '\n'.join(f"{count:>6}  {' <- '.join(stack.split(';')[::-1][:4])}" for stack, count in stacks),
+        )
+    hottest_stacks.short_description = 'Hottest stacks'
+
+    def delete_model(self, request, obj):
+        obj.folded.delete(save=False)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.folded.delete(save=False)
+        super().delete_queryset(request, queryset)
@@ -0,0 +1,228 @@
+"""
+Cross-poll analytics on columnar NumPy arrays.
+
+Ballots are read in chunks of voter ids, each loaded straight into int64
+columns (voter, poll, choice) and mapped to dense poll and choice indexes
+with searchsorted, so memory stays bounded by the chunk size plus a few
+arrays per poll and per choice, whatever the size of Vote. Every statistic
+is built from per-chunk pieces that simply add up:
+
+* votes per poll and per choice, with np.bincount;
+* voter overlap between polls, as X.T @ X of the chunk's sparse
+  voter x poll incidence matrix. Chunks split the voters, never one
+  voter's ballots, so the partial products sum to the full matrix;
+* distinct voters, since no voter appears in two chunks.
+
+Turnout (voters / active users), margin of victory and Wilson score
+intervals on choice shares are then computed once for all polls with
+vectorised operations. Archived ballots (see archive.py) are counted one
+archive at a time; their voters are not reloaded for the overlap, which
+therefore covers live ballots only.
+
+Needs scipy (requirements-analytics.txt).
+"""
+import csv
+import os
+from dataclasses import dataclass
+from datetime import timedelta
+from itertools import chain
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db.models import Max, Min
+from django.utils import timezone
+from scipy import sparse
+
+from .models import Choice, Poll, PollVoteArchive, Vote
+
+# 95% two-sided normal quantile.
+Z_95 = 1.959963984540054
+
+
+@dataclass
+class Report:
+    poll_ids: np.ndarray
+    poll_names: list
+    poll_votes: np.ndarray
+    choice_ids: np.ndarray
+    choice_poll: np.ndarray  # dense poll index of each choice
+    choice_names: list
+    choice_votes: np.ndarray
+    overlap: sparse.csr_matrix  # shared live voters, upper triangle
+    voters: int
+    active_users: int
+    archived_votes: int
+
+    def turnout(self):
+        return self.poll_votes / self.active_users if self.active_users else np.full(len(self.poll_ids), np.nan)
+
+    def shares(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.choice_votes / self.poll_votes[self.choice_poll]
+
+    def wilson_intervals(self, z=Z_95):
+        """(low, high) score interval of every choice's share of its poll."""
+        n = self.poll_votes[self.choice_poll].astype(float)
+        p = self.shares()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            denominator = 1 + z ** 2 / n
+            centre = (p + z ** 2 / (2 * n)) / denominator
+            half = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+        return centre - half, centre + half
+
+    def winners(self):
+        """Per poll: index of the leading choice (-1 if none) and its margin over the runner-up, in shares."""
+        poll_count = len(self.poll_ids)
+        winner = np.full(poll_count, -1)
+        margin = np.full(poll_count, np.nan)
+        if not len(self.choice_ids):
+            return winner, margin
+        # Choices grouped by poll, most votes first.
+        order = np.lexsort((-self.choice_votes, self.choice_poll))
+        polls = self.choice_poll[order]
+        firsts = np.flatnonzero(np.r_[True, polls[1:] != polls[:-1]])
+        seconds = firsts + 1
+        has_second = seconds < len(order)
+        has_second[has_second] = polls[seconds[has_second]] == polls[firsts[has_second]]
+
+        leading = self.choice_votes[order[firsts]]
+        runner_up = np.zeros_like(leading)
+        runner_up[has_second] = self.choice_votes[order[seconds[has_second]]]
+        totals = self.poll_votes[polls[firsts]]
+        winner[polls[firsts]] = np.where(totals > 0, order[firsts], -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margin[polls[firsts]] = (leading - runner_up) / totals
+        return winner, margin
+
+    def top_overlaps(self, limit):
+        """[(poll index a, poll index b, shared voters, jaccard)], most shared voters first."""
+        pairs = self.overlap.tocoo()
+        order = np.argsort(-pairs.data, kind='stable')[:limit]
+        rows, cols, shared = pairs.row[order], pairs.col[order], pairs.data[order]
+        union = self.poll_votes[rows] + self.poll_votes[cols] - shared
+        return list(zip(rows.tolist(), cols.tolist(), shared.tolist(), (shared / union).tolist()))
+
+
+def _index(sorted_ids, ids):
+    """Dense positions of `ids` in `sorted_ids`, and a mask of the ids that were found."""
+    positions = np.searchsorted(sorted_ids, ids)
+    positions[positions == len(sorted_ids)] = 0
+    found = sorted_ids[positions] == ids if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+    return positions, found
+
+
+def _voter_ranges(chunk_size):
+    """[lo, hi) voter id ranges expected to hold about chunk_size ballots each."""
+    bounds = Vote.objects.aggregate(low=Min('voter_id'), high=Max('voter_id'))
+    if bounds['low'] is None:
+        return
+    span = bounds['high'] - bounds['low'] + 1
+    width = max(1, chunk_size * span // max(1, Vote.objects.count()))
+    for low in range(bounds['low'], bounds['high'] + 1, width):
+        yield low, low + width
+
+
+def _load_chunk(low, high):
+    """Ballots of voters in [low, high) as an (n, 3) int64 array of voter, poll, choice."""
+    rows = (
+        Vote.objects.filter(voter_id__gte=low, voter_id__lt=high)
+        .values_list('voter_id', 'poll_id', 'choice_id')
+        .order_by()
+        .iterator(chunk_size=10000)
+    )
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 3)
+
+
+def build_report(chunk_size=1_000_000, active_days=None, progress=None):
+    """Scan every ballot once and return a Report of all visible polls."""
+    polls = list(Poll.objects.order_by('id').values_list('id', 'name'))
+    poll_ids = np.array([poll_id for poll_id, _ in polls], dtype=np.int64)
+    choices = list(Choice.objects.filter(poll__in=Poll.objects.all()).order_by('id').values_list('id', 'poll_id', 'name'))
+    choice_ids = np.array([choice_id for choice_id, _, _ in choices], dtype=np.int64)
+    choice_poll, _ = _index(poll_ids, np.array([poll_id for _, poll_id, _ in choices], dtype=np.int64))
+
+    poll_count, choice_count = len(poll_ids), len(choice_ids)
+    poll_votes = np.zeros(poll_count, dtype=np.int64)
+    choice_votes = np.zeros(choice_count, dtype=np.int64)
+    overlap = sparse.csr_matrix((poll_count, poll_count), dtype=np.int64)
+    voters = 0
+
+    for low, high in _voter_ranges(chunk_size):
+        ballots = _load_chunk(low, high)
+        if not len(ballots):
+            continue
+        polls_at, found = _index(poll_ids, ballots[:, 1])  # hidden polls drop out here
+        ballots, polls_at = ballots[found], polls_at[found]
+        choices_at, found = _index(choice_ids, ballots[:, 2])
+        poll_votes += np.bincount(polls_at, minlength=poll_count)
+        choice_votes += np.bincount(choices_at[found], minlength=choice_count)
+
+        chunk_voters, rows = np.unique(ballots[:, 0], return_inverse=True)
+        voters += len(chunk_voters)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, polls_at)), shape=(len(chunk_voters), poll_count)
+        )
+        overlap = overlap + sparse.triu(incidence.T @ incidence, k=1, format='csr')
+        if progress:
+            progress(high, len(ballots))
+
+    archived_votes = 0
+    archives = PollVoteArchive.objects.filter(poll__in=Poll.objects.all()).only('poll_id', 'choices')
+    for archive in archives.iterator(chunk_size=1):
+        archived = np.frombuffer(bytes(archive.choices), dtype='<i8')
+        choices_at, found = _index(choice_ids, archived)
+        choice_votes += np.bincount(choices_at[found], minlength=choice_count)
+        poll_votes[_index(poll_ids, np.array([archive.poll_id]))[0]] += len(archived)
+        archived_votes += len(archived)
+
+    users = User.objects.filter(is_active=True)
+    if active_days:
+        users = users.filter(last_login__gte=timezone.now() - timedelta(days=active_days))
+
+    return Report(
+        poll_ids=poll_ids,
+        poll_names=[name for _, name in polls],
+        poll_votes=poll_votes,
+        choice_ids=choice_ids,
+        choice_poll=choice_poll,
+        choice_names=[name for _, _, name in choices],
+        choice_votes=choice_votes,
+        overlap=overlap,
+        voters=voters,
+        active_users=users.count(),
+        archived_votes=archived_votes,
+    )
+
+
+def write_report(report, directory, overlap_limit=1000):
+    """Write polls.csv, choices.csv and overlap.csv into `directory`; returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    turnout = report.turnout()
+    winner, margin = report.winners()
+    shares = report.shares()
+    low, high = report.wilson_intervals()
+
+    def cell(value):
+        return '' if np.isnan(value) else f'{value:.6f}'
+
+    paths = [os.path.join(directory, name) for name in ('polls.csv', 'choices.csv', 'overlap.csv')]
+    with open(paths[0], 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['poll_id', 'name', 'votes', 'turnout', 'leading_choice_id', 'margin'])
+        for i, poll_id in enumerate(report.poll_ids.tolist()):
+            leading = report.choice_ids[winner[i]] if winner[i] >= 0 else ''
+            writer.writerow([poll_id, report.poll_names[i], report.poll_votes[i], cell(turnout[i]), leading, cell(margin[i])])
+    with open(paths[1], 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['choice_id', 'poll_id', 'name', 'votes', 'share', 'share_low_95', 'share_high_95'])
+        for i, choice_id in enumerate(report.choice_ids.tolist()):
+            writer.writerow([
+                choice_id, report.poll_ids[report.choice_poll[i]], report.choice_names[i], report.choice_votes[i],
+                cell(shares[i]), cell(low[i]), cell(high[i]),
+            ])
+    with open(paths[2], 'w', newline='') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(['poll_a', 'poll_b', 'shared_voters', 'jaccard'])
+        for a, b, shared, jaccard in report.top_overlaps(overlap_limit):
+            writer.writerow([report.poll_ids[a], report.poll_ids[b], shared, f'{jaccard:.6f}'])
+    return paths
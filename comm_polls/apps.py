@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CommPollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'comm_polls'
+
+    def ready(self):
+        from . import signals  # noqa: F401
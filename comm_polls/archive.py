@@ -0,0 +1,143 @@
+"""
+Archival of ballots for long-ended polls.
+
+Votes of polls that ended more than N days ago are packed into one
+PollVoteArchive row per poll and removed from Vote, so the hot table and
+its (poll, voter) and foreign key indexes only hold live ballots. A small
+UserVoteArchive row per voter keeps "what did I vote for" lookups to a
+single row read. Readers use the helpers below instead of Vote directly.
+"""
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Choice, Poll, PollVoteArchive, UserVoteArchive, Vote
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def pack(values):
+    """Pack ints into little-endian int64 bytes."""
+    packed = array('q', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(data):
+    """Inverse of pack()."""
+    values = array('q')
+    values.frombytes(bytes(data or b''))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def archivable_polls(older_than_days):
+    """
+    Polls that ended more than `older_than_days` ago and are not archived yet.
+    Ranked polls stay in Vote: the archive has no room for their rankings.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return (
+        Poll.objects.filter(end_date__lt=cutoff, vote_archive__isnull=True)
+        .exclude(kind=Poll.RANKED)
+        .order_by('id')
+    )
+
+
+def _merge_user_index(user_ballots):
+    """Append {user_id: [(poll_id, choice_id), ...]} to the per-user archive rows."""
+    existing = UserVoteArchive.objects.in_bulk(list(user_ballots), field_name='user_id')
+    to_create, to_update = [], []
+    for user_id, ballots in user_ballots.items():
+        row = existing.get(user_id)
+        polls = unpack(row.polls) if row else array('q')
+        choices = unpack(row.choices) if row else array('q')
+        polls.extend(poll_id for poll_id, _ in ballots)
+        choices.extend(choice_id for _, choice_id in ballots)
+        if row:
+            row.polls, row.choices = pack(polls), pack(choices)
+            to_update.append(row)
+        else:
+            to_create.append(UserVoteArchive(user_id=user_id, polls=pack(polls), choices=pack(choices)))
+    UserVoteArchive.objects.bulk_create(to_create, batch_size=1000)
+    UserVoteArchive.objects.bulk_update(to_update, ['polls', 'choices'], batch_size=1000)
+
+
+def archive_polls(poll_ids):
+    """Move the ballots of `poll_ids` into the archive tables in one transaction."""
+    with transaction.atomic():
+        rows = (
+            Vote.objects.filter(poll_id__in=poll_ids)
+            .order_by('poll_id', 'voter_id')
+            .values_list('poll_id', 'voter_id', 'choice_id', 'voted_at')
+            .iterator(chunk_size=10000)
+        )
+        per_poll = {poll_id: ([], [], []) for poll_id in poll_ids}
+        user_ballots = {}
+        for poll_id, voter_id, choice_id, voted_at in rows:
+            voters, choices, times = per_poll[poll_id]
+            voters.append(voter_id)
+            choices.append(choice_id)
+            times.append(to_micros(voted_at))
+            user_ballots.setdefault(voter_id, []).append((poll_id, choice_id))
+
+        PollVoteArchive.objects.bulk_create([
+            PollVoteArchive(
+                poll_id=poll_id, vote_count=len(voters),
+                voters=pack(voters), choices=pack(choices), voted_at=pack(times),
+            )
+            for poll_id, (voters, choices, times) in per_poll.items()
+        ])
+        _merge_user_index(user_ballots)
+        deleted, _ = Vote.objects.filter(poll_id__in=poll_ids).delete()
+    return deleted
+
+
+def poll_ballots(poll):
+    """Yield (voter_id, choice_id, voted_at) for a poll, hot or archived."""
+    archive = PollVoteArchive.objects.filter(poll=poll).first()
+    if archive is None:
+        yield from Vote.objects.filter(poll=poll).values_list('voter_id', 'choice_id', 'voted_at').iterator()
+        return
+    for voter_id, choice_id, micros in zip(unpack(archive.voters), unpack(archive.choices), unpack(archive.voted_at)):
+        yield voter_id, choice_id, from_micros(micros)
+
+
+def archived_choice_ids(user):
+    """Return {poll_id: choice_id} of the user's archived ballots."""
+    row = UserVoteArchive.objects.filter(user=user).values_list('polls', 'choices').first()
+    if row is None:
+        return {}
+    return dict(zip(unpack(row[0]), unpack(row[1])))
+
+
+def archived_votes(user, poll_ids=None):
+    """
+    Unsaved Vote instances for the user's archived ballots, shaped like the
+    rows my_votes and results read from Vote.
+    """
+    ballots = archived_choice_ids(user)
+    if poll_ids is not None:
+        ballots = {poll_id: ballots[poll_id] for poll_id in poll_ids if poll_id in ballots}
+    if not ballots:
+        return []
+    polls = Poll.objects.in_bulk(list(ballots))
+    choices = Choice.objects.in_bulk(list(ballots.values()))
+    return [
+        Vote(poll=polls[poll_id], choice=choices[choice_id], voter=user)
+        for poll_id, choice_id in ballots.items()
+        if poll_id in polls and choice_id in choices
+    ]
@@ -0,0 +1,152 @@
+"""
+Avatars in an object store, so web containers need no shared media volume.
+
+With AVATAR_STORAGE = "local" (the default) uploads stay in MEDIA_ROOT and
+are served from /media/. With "remote", the request still writes the upload
+to MEDIA_ROOT, which is quick; once the transaction commits, a background
+thread copies the file to AVATAR_REMOTE_STORAGE (django-storages' S3Storage
+by default, for AWS or any S3-compatible service), sets
+Profile.avatar_remote and removes the local copy. Until then the avatar is
+served from /media/ by the host that took the upload. A failed upload is
+tried AVATAR_UPLOAD_ATTEMPTS times in all, then left for the migrate_avatars
+command, which also moves the avatars stored before the switch and which
+docker compose's scheduler service runs every ten minutes. Replacing or
+clearing a remote avatar deletes the old object once the save commits.
+
+Remote URLs, signed or public depending on the storage options, are
+cached per user for AVATAR_URL_CACHE_TIMEOUT seconds, which must stay
+below the signature lifetime. Saving a profile drops the cached URL.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .backends import forget_users
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+_storages = {}
+
+
+def uses_remote_storage():
+    return getattr(settings, 'AVATAR_STORAGE', 'local') == 'remote'
+
+
+def remote_storage():
+    """The AVATAR_REMOTE_STORAGE instance, built once per configuration."""
+    config = settings.AVATAR_REMOTE_STORAGE
+    key = repr(config)
+    if key not in _storages:
+        _storages[key] = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+    return _storages[key]
+
+
+def local_storage():
+    return Profile._meta.get_field('avatar').storage
+
+
+def url_key(user_id):
+    return f'avatar_url:{user_id}'
+
+
+def forget_avatar_urls(user_ids):
+    cache.delete_many([url_key(user_id) for user_id in user_ids])
+
+
+def avatar_url(profile):
+    """Where browsers load the profile's avatar from; None without one."""
+    if not profile.avatar:
+        return None
+    if not profile.avatar_remote:
+        return profile.avatar.url
+    url = cache.get(url_key(profile.user_id))
+    metrics.inc('commpolls_cache_requests_total', cache='avatar_url', result='miss' if url is None else 'hit')
+    if url is None:
+        url = remote_storage().url(profile.avatar.name)
+        cache.set(url_key(profile.user_id), url, getattr(settings, 'AVATAR_URL_CACHE_TIMEOUT', 3000))
+    return url
+
+
+def offload_avatar(profile_id, name):
+    """
+    Copy a profile's local avatar file `name` to the remote storage and point
+    the profile at it. Returns False if the file is gone or the profile has
+    another avatar by now.
+    """
+    local = local_storage()
+    try:
+        handle = local.open(name, 'rb')
+    except FileNotFoundError:
+        return False  # moved by another process, or never written
+    with handle:
+        stored = remote_storage().save(name, handle)
+    profiles = Profile.objects.filter(pk=profile_id, avatar=name, avatar_remote=False)
+    user_id = profiles.values_list('user_id', flat=True).first()
+    # update() rather than save(): no signals, so no new upload is scheduled.
+    if user_id is None or not profiles.update(avatar=stored, avatar_remote=True):
+        remote_storage().delete(stored)
+        return False
+    local.delete(name)
+    forget_users([user_id])
+    forget_avatar_urls([user_id])
+    return True
+
+
+def schedule_offload(profile_id, name):
+    if getattr(settings, 'AVATAR_UPLOAD_IN_BACKGROUND', True):
+        threading.Thread(target=_offload_in_background, args=(profile_id, name), daemon=True).start()
+    else:
+        offload_avatar(profile_id, name)
+
+
+def _offload_in_background(profile_id, name):
+    attempts = getattr(settings, 'AVATAR_UPLOAD_ATTEMPTS', 3)
+    try:
+        for attempt in range(1, attempts + 1):
+            try:
+                offload_avatar(profile_id, name)
+                return
+            except Exception:
+                # migrate_avatars picks up whatever is left over.
+                logger.exception("Background upload of avatar %s failed (attempt %d of %d)", name, attempt, attempts)
+                if attempt < attempts:
+                    time.sleep(2 ** attempt)
+    finally:
+        close_old_connections()
+
+
+def delete_remote_avatar(name):
+    """Remove a replaced avatar from the remote storage; failures are only logged."""
+    try:
+        remote_storage().delete(name)
+    except Exception:
+        logger.exception("Deleting replaced avatar %s failed", name)
+
+
+def schedule_remote_delete(name):
+    if getattr(settings, 'AVATAR_UPLOAD_IN_BACKGROUND', True):
+        threading.Thread(target=delete_remote_avatar, args=(name,), daemon=True).start()
+    else:
+        delete_remote_avatar(name)
+
+
+def offload_avatars(progress=None):
+    """Move every avatar still in local storage; returns {'moved': n, 'skipped': n}."""
+    summary = {'moved': 0, 'skipped': 0}
+    pending = (
+        Profile.objects.filter(avatar_remote=False).exclude(avatar='').exclude(avatar__isnull=True)
+        .order_by('pk').values_list('pk', 'avatar')
+    )
+    for profile_id, name in pending.iterator(chunk_size=1000):
+        moved = offload_avatar(profile_id, name)
+        summary['moved' if moved else 'skipped'] += 1
+        if progress:
+            progress(name, moved)
+    return summary
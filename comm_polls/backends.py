@@ -0,0 +1,69 @@
+"""
+Authentication backend with a short-lived cache of the request user.
+
+AuthenticationMiddleware resolves request.user on every authenticated
+request. When the default cache is shared by all workers (CACHE_IS_SHARED),
+the User row, its profile and whether the user is a manager are kept in it
+for AUTH_USER_CACHE_TIMEOUT seconds, so an ordinary page view runs no auth
+queries at all. A per-process cache could not be cleared on the other
+workers, so without one the user is loaded on every request. The receivers in
+comm_polls/signals.py drop the entry whenever the user, their profile or
+their groups change and on logout; a password change saves the user, which
+also clears it, so other sessions fail the session hash check at once.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from . import metrics
+
+UserModel = get_user_model()
+
+MANAGERS_GROUP = 'Managers'
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def forget_users(user_ids):
+    """Drop the cached copies of these users."""
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+def is_manager(user):
+    """True for superusers and members of the Managers group."""
+    if not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    if not hasattr(user, '_is_manager'):
+        user._is_manager = user.groups.filter(name=MANAGERS_GROUP).exists()
+    return user._is_manager
+
+
+class ProfileModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's profile in the same query and serves
+    repeat lookups of the same user from the shared cache.
+    """
+    def get_user(self, user_id):
+        if not getattr(settings, 'CACHE_IS_SHARED', False):
+            user = self._load_user(user_id)
+        else:
+            key = user_cache_key(user_id)
+            user = cache.get(key)
+            metrics.inc('commpolls_cache_requests_total', cache='auth_user', result='miss' if user is None else 'hit')
+            if user is None:
+                user = self._load_user(user_id)
+                if user is not None:
+                    is_manager(user)
+                    cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60))
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    def _load_user(self, user_id):
+        try:
+            return UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
@@ -0,0 +1,174 @@
+"""
+Per-poll voter bitmaps for "has this user voted" checks.
+
+Each poll's voter ids are kept in a roaring-style bitmap: ids are split by
+their high 16 bits into containers that are sorted uint16 arrays while
+small and 8 KiB bitmaps once they pass 4096 members. Bitmaps live in the
+Django cache, are rebuilt lazily from Vote and updated after every
+successful vote. One worker rebuilds a missing bitmap under a cache.add()
+lock; the others answer from the database meanwhile. Polls whose bitmap
+would exceed VOTER_BITMAP_MAX_BYTES are not cached and callers fall back to
+the database; that verdict is kept for VOTER_BITMAP_TOO_LARGE_TIMEOUT, as
+a poll's voters only grow.
+
+A cached bitmap may miss a vote: record_votes() reads, changes and writes
+back the whole bitmap, so two workers updating it at the same moment can
+lose one ballot, and without a shared cache each worker has its own copy.
+That rewrite is also why the budget is small: every vote moves up to
+VOTER_BITMAP_MAX_BYTES (64 KiB, some 30 000 sparse voters) to and from
+the cache, and larger polls are served by the unique index instead.
+A negative answer is therefore only a hint, used to skip work on the vote
+page; the vote itself is settled by the (poll, voter) unique constraint,
+and pages that show a user's ballot read it from Vote. Positive answers
+are exact.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .models import Vote
+
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 8192
+TOO_LARGE = 'too-large'
+
+
+class VoterBitmap:
+    """A compressed set of non-negative integer ids."""
+
+    def __init__(self, ids=()):
+        self.containers = {}
+        self.cardinality = 0
+        for member in ids:
+            self.add(member)
+
+    def add(self, member):
+        high, low = member >> 16, member & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array('H', [low])
+        elif isinstance(container, array):
+            index = bisect_left(container, low)
+            if index < len(container) and container[index] == low:
+                return
+            container.insert(index, low)
+            if len(container) > ARRAY_LIMIT:
+                bits = bytearray(BITMAP_BYTES)
+                for value in container:
+                    bits[value >> 3] |= 1 << (value & 7)
+                self.containers[high] = bits
+        else:
+            mask = 1 << (low & 7)
+            if container[low >> 3] & mask:
+                return
+            container[low >> 3] |= mask
+        self.cardinality += 1
+
+    def __contains__(self, member):
+        container = self.containers.get(member >> 16)
+        if container is None:
+            return False
+        low = member & 0xFFFF
+        if isinstance(container, array):
+            index = bisect_left(container, low)
+            return index < len(container) and container[index] == low
+        return bool(container[low >> 3] & (1 << (low & 7)))
+
+    def __len__(self):
+        return self.cardinality
+
+    @property
+    def nbytes(self):
+        """Approximate payload size of the containers."""
+        return sum(
+            len(c) * c.itemsize if isinstance(c, array) else BITMAP_BYTES
+            for c in self.containers.values()
+        )
+
+
+def _cache_key(poll_id):
+    return f'voter_bitmap:{poll_id}'
+
+
+def _max_bytes():
+    return getattr(settings, 'VOTER_BITMAP_MAX_BYTES', 64 * 1024)
+
+
+def _store(poll_id, bitmap):
+    """Cache `bitmap`, or TOO_LARGE for the longer timeout if it is over budget."""
+    if bitmap.nbytes > _max_bytes():
+        cache.set(_cache_key(poll_id), TOO_LARGE, getattr(settings, 'VOTER_BITMAP_TOO_LARGE_TIMEOUT', 24 * 3600))
+    else:
+        cache.set(_cache_key(poll_id), bitmap, getattr(settings, 'VOTER_BITMAP_TIMEOUT', 300))
+
+
+def build_bitmap(poll_id):
+    """Rebuild a poll's bitmap from Vote and cache it if it fits the budget."""
+    ids = Vote.objects.filter(poll_id=poll_id).order_by('voter_id').values_list('voter_id', flat=True)
+    bitmap = VoterBitmap(ids.iterator(chunk_size=10000))
+    _store(poll_id, bitmap)
+    return bitmap
+
+
+def get_bitmap(poll_id):
+    """
+    Return the cached bitmap, rebuilding it on a miss, or None if it is over
+    budget or another worker is rebuilding it.
+    """
+    key = _cache_key(poll_id)
+    bitmap = cache.get(key)
+    metrics.inc('commpolls_cache_requests_total', cache='voter_bitmap', result='miss' if bitmap is None else 'hit')
+    if bitmap is None:
+        if not cache.add(f'{key}:building', True, getattr(settings, 'VOTER_BITMAP_BUILD_LOCK_TIMEOUT', 60)):
+            return None
+        try:
+            bitmap = build_bitmap(poll_id)
+        finally:
+            cache.delete(f'{key}:building')
+        if bitmap.nbytes > _max_bytes():
+            return None
+    return None if bitmap == TOO_LARGE else bitmap
+
+
+def has_voted(poll_id, user_id):
+    """True if the user has a ballot on the poll (see module docstring for misses)."""
+    bitmap = get_bitmap(poll_id)
+    if bitmap is None:
+        return Vote.objects.filter(poll_id=poll_id, voter_id=user_id).exists()
+    return user_id in bitmap
+
+
+def record_vote(poll_id, user_id):
+    """Add a freshly stored ballot to the cached bitmap, if one is cached."""
+    record_votes(poll_id, [user_id])
+
+
+def record_votes(poll_id, user_ids):
+    """Add several freshly stored ballots of one poll with a single cache round trip."""
+    key = _cache_key(poll_id)
+    bitmap = cache.get(key)
+    if isinstance(bitmap, VoterBitmap):
+        for user_id in user_ids:
+            bitmap.add(user_id)
+        _store(poll_id, bitmap)
+
+
+def invalidate(poll_ids):
+    """Drop cached bitmaps after ballots were removed outside the vote path."""
+    cache.delete_many([_cache_key(poll_id) for poll_id in poll_ids])
+
+
+def bitmap_stats(poll_ids):
+    """Return [(poll_id, voters, bytes)] for polls with a cached bitmap."""
+    cached = cache.get_many([_cache_key(poll_id) for poll_id in poll_ids])
+    stats = []
+    for poll_id in poll_ids:
+        bitmap = cached.get(_cache_key(poll_id))
+        if isinstance(bitmap, VoterBitmap):
+            stats.append((poll_id, len(bitmap), bitmap.nbytes))
+        elif bitmap == TOO_LARGE:
+            stats.append((poll_id, None, None))
+    return stats
@@ -0,0 +1,219 @@
+"""
+Batch write paths for kiosks and provisioning scripts.
+
+Everything a batch needs is loaded with one query per model, validated in
+Python, and written in bulk inside a single transaction.
+"""
+from collections import Counter, defaultdict
+
+from django import forms
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import bitmaps
+from .counters import apply_counter_deltas, chunked
+from .forms import ChoiceForm, PollForm, validate_choice_names
+from .models import Choice, Poll, PollVoteArchive, Vote
+from .opening import forget_choice_lists
+from .pollcache import forget_polls
+from .rollups import recount_late_votes
+
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+CREATED = 'created'
+INVALID = 'invalid'
+
+
+def _parse_ballot(ballot, now):
+    """Return (poll_id, choice_id, voter_id, cast_at) or raise ValueError."""
+    if not isinstance(ballot, dict):
+        raise ValueError('Ballot must be an object.')
+    try:
+        poll_id, choice_id, voter_id = int(ballot['poll']), int(ballot['choice']), int(ballot['voter'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('poll, choice and voter must be integer ids.')
+    cast_at = now
+    if ballot.get('cast_at'):
+        cast_at = parse_datetime(str(ballot['cast_at']))
+        if cast_at is None or timezone.is_naive(cast_at):
+            raise ValueError('cast_at must be an ISO 8601 timestamp with a UTC offset.')
+    return poll_id, choice_id, voter_id, cast_at
+
+
+def submit_ballots(ballots):
+    """
+    Validate and store a batch of ballots.
+
+    Each ballot is a dict with poll, choice and voter ids and an optional
+    cast_at timestamp, which is what gets checked against the poll window
+    (offline devices replay ballots after the fact). Returns one
+    {"status": ..., "error": ...} dict per input ballot, in order.
+
+    Duplicates are detected against existing votes and earlier ballots of
+    the same batch. A voter can still vote on the site between that check
+    and the insert: such ballots are skipped by the insert and reported as
+    duplicates, and only the rows actually written move the counters.
+    Votes are stored with voted_at = cast_at.
+    """
+    now = timezone.now()
+    results = [None] * len(ballots)
+    parsed = {}
+    for index, ballot in enumerate(ballots):
+        try:
+            parsed[index] = _parse_ballot(ballot, now)
+        except ValueError as exc:
+            results[index] = {'status': REJECTED, 'error': str(exc)}
+
+    poll_ids = {p for p, _, _, _ in parsed.values()}
+    voter_ids = {v for _, _, v, _ in parsed.values()}
+    polls = Poll.objects.in_bulk(poll_ids)
+    # Counts of archived polls are read from the archive; new rows would be missed.
+    archived = set(PollVoteArchive.objects.filter(poll_id__in=poll_ids).values_list('poll_id', flat=True))
+    choice_polls = dict(
+        Choice.objects.filter(id__in={c for _, c, _, _ in parsed.values()}).values_list('id', 'poll_id')
+    )
+    voters = set(User.objects.filter(id__in=voter_ids, is_active=True).values_list('id', flat=True))
+    taken = set(
+        Vote.objects.filter(poll_id__in=poll_ids, voter_id__in=voter_ids).values_list('poll_id', 'voter_id')
+    )
+
+    pending = {}
+    for index, (poll_id, choice_id, voter_id, cast_at) in parsed.items():
+        poll = polls.get(poll_id)
+        error = None
+        if poll is None:
+            error = 'Unknown poll.'
+        elif poll_id in archived:
+            error = 'The votes of this poll have been archived.'
+        elif poll.is_ranked:
+            # A ballot without a ranking would count as a one-choice ranking.
+            error = 'Ranked polls need a ranking.'
+        elif choice_polls.get(choice_id) != poll_id:
+            error = 'Choice does not belong to this poll.'
+        elif voter_id not in voters:
+            error = 'Unknown or inactive voter.'
+        elif cast_at > now or not poll.start_date <= cast_at <= poll.end_date:
+            error = 'Ballot was cast outside the voting window.'
+        if error:
+            results[index] = {'status': REJECTED, 'error': error}
+            continue
+        if (poll_id, voter_id) in taken:
+            results[index] = {'status': DUPLICATE}
+            continue
+        taken.add((poll_id, voter_id))
+        pending[index] = (poll_id, choice_id, voter_id, cast_at)
+
+    deltas = Counter()
+    new_voters = defaultdict(list)
+    with transaction.atomic():
+        written = _insert_ballots(list(pending.values()))
+        for index, (poll_id, choice_id, voter_id, _) in pending.items():
+            if (poll_id, voter_id) not in written:
+                results[index] = {'status': DUPLICATE}
+                continue
+            deltas[choice_id] += 1
+            new_voters[poll_id].append(voter_id)
+            results[index] = {'status': ACCEPTED}
+        apply_counter_deltas(deltas)
+    for poll_id, user_ids in new_voters.items():
+        bitmaps.record_votes(poll_id, user_ids)
+    recount_late_votes([(poll_id, cast_at) for poll_id, _, voter_id, cast_at in pending.values()
+                        if (poll_id, voter_id) in written])
+    return results
+
+
+def _insert_ballots(rows):
+    """
+    INSERT (poll_id, choice_id, voter_id, voted_at) tuples, skipping those
+    that collide with an existing vote. Returns the (poll_id, voter_id)
+    pairs actually written: bulk_create(ignore_conflicts=True) cannot tell
+    them apart, INSERT ... ON CONFLICT DO NOTHING RETURNING can (PostgreSQL,
+    SQLite 3.35+).
+    """
+    if not rows:
+        return set()
+    quote = connection.ops.quote_name
+    columns = ('poll_id', 'choice_id', 'voter_id', 'voted_at')
+    fields = [Vote._meta.get_field(column) for column in columns]
+    per_statement = min(1000, connection.ops.bulk_batch_size(fields, rows) or len(rows))
+    adapt = connection.ops.adapt_datetimefield_value
+    prefix = f"INSERT INTO {quote(Vote._meta.db_table)} ({', '.join(quote(column) for column in columns)}) VALUES "
+    suffix = f" ON CONFLICT DO NOTHING RETURNING {quote('poll_id')}, {quote('voter_id')}"
+    written = set()
+    with connection.cursor() as cursor:
+        for batch in chunked(rows, per_statement):
+            params = []
+            for poll_id, choice_id, voter_id, voted_at in batch:
+                params += (poll_id, choice_id, voter_id, adapt(voted_at))
+            cursor.execute(prefix + ', '.join(['(%s, %s, %s, %s)'] * len(batch)) + suffix, params)
+            written.update(cursor.fetchall())
+    return written
+
+
+def validate_poll(item):
+    """
+    Validate one {name, description, start_date, end_date, choices} item
+    with the same rules as create_poll. Returns (poll, choice_names, errors).
+    """
+    if not isinstance(item, dict):
+        return None, [], {'__all__': ['Poll must be an object.']}
+
+    poll_form = PollForm(data=item)
+    errors = {} if poll_form.is_valid() else {
+        field: [str(message) for message in messages] for field, messages in poll_form.errors.items()
+    }
+
+    names = item.get('choices')
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        errors['choices'] = ['Expected a list of choice names.']
+        return None, [], errors
+    names = [name.strip() for name in names if name.strip()]
+    try:
+        validate_choice_names(names)
+    except forms.ValidationError as exc:
+        errors['choices'] = exc.messages
+    for name in names:
+        choice_form = ChoiceForm(data={'name': name})
+        if not choice_form.is_valid():
+            errors.setdefault('choices', []).extend(choice_form.errors['name'])
+
+    if errors:
+        return None, [], errors
+    return poll_form.save(commit=False), names, {}
+
+
+def create_polls(items, owner):
+    """
+    Validate a batch of polls and write the valid ones with two bulk_create
+    calls (polls, then all their choices). Returns one result dict per item.
+    Callers decide the transaction scope.
+    """
+    results = []
+    valid = []
+    for item in items:
+        poll, names, errors = validate_poll(item)
+        if errors:
+            results.append({'status': INVALID, 'errors': errors})
+            continue
+        poll.created_by = owner
+        valid.append((poll, names))
+        results.append({'status': CREATED})
+
+    with transaction.atomic():
+        polls = Poll.objects.bulk_create([poll for poll, _ in valid])
+        Choice.objects.bulk_create([
+            Choice(poll=poll, name=name) for poll, names in valid for name in names
+        ], batch_size=1000)
+    # bulk_create skips post_save, so clear what the signals would have.
+    bitmaps.invalidate([poll.pk for poll in polls])
+    forget_choice_lists([poll.pk for poll in polls])
+    forget_polls([poll.pk for poll in polls])
+
+    created = iter(polls)
+    for result in results:
+        if result['status'] == CREATED:
+            result['id'] = next(created).pk
+    return results
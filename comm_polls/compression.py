@@ -0,0 +1,292 @@
+"""
+Brotli/gzip compression of responses, with compressed bodies cached.
+
+CompressionMiddleware picks the encoding from Accept-Encoding (Brotli when
+the client takes it, else gzip) and compresses text-like 200 responses of
+at least COMPRESSION_MIN_BYTES. Streaming responses are compressed chunk by
+chunk and flushed after each one, so they keep streaming.
+
+The same bytes are often sent thousands of times: the counts of an ended
+poll, a dashboard's batch of tallies that has not moved. Compressed bodies
+of shareable responses (not personal, see below, and at most
+COMPRESSION_CACHE_MAX_BYTES) are kept in the default cache under a hash of
+the uncompressed body, so each distinct body is compressed once.
+Responses a view marks public with a max-age, and that vary on nothing but
+Accept-Encoding, are also remembered by URL for that long, as their headers
+and body hash; later requests for the URL are answered from the cache
+before the session, the user or the view are loaded. forget_page() drops
+such an entry early, which only reaches every worker through a shared
+cache, so pages are remembered by URL only when CACHE_IS_SHARED. Compressed
+bodies are keyed by content and need no dropping.
+
+A response for one session can hold secrets (the CSRF token, personal
+data) next to text an attacker chose, and BREACH reads such secrets from
+the compressed lengths; the masking of the CSRF token protects only the
+token. Personal responses (not GET, setting a cookie, private, no-store or
+varying on Cookie) are therefore gzipped with a random file name of up to
+COMPRESSION_PADDING_BYTES in the header, as Django's GZipMiddleware does,
+and never cached compressed. Brotli has no field to pad, so they are never
+sent as Brotli.
+"""
+import gzip
+import hashlib
+import io
+import secrets
+import zlib
+
+import brotli
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_max_age, patch_vary_headers
+from django.utils.text import compress_string
+
+from . import metrics
+
+ENCODINGS = ('br', 'gzip')  # preferred first
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+IDENTITY = 'identity'
+# Set per response, never replayed from a cached page.
+UNCACHED_HEADERS = {'content-length', 'content-encoding'}
+
+
+def negotiate(accept_encoding, encodings=ENCODINGS):
+    """'br', 'gzip' or None (send as is) for an Accept-Encoding header."""
+    weights = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _padding():
+    return getattr(settings, 'COMPRESSION_PADDING_BYTES', 100)
+
+
+def compress(body, encoding, pad=False):
+    """Compress `body`; `pad` (gzip only) adds a random-length file name."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+    if pad:
+        return compress_string(body, max_random_bytes=_padding())
+    return gzip.compress(body, compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+
+
+class StreamCompressor:
+    """Compress a body piece by piece; every piece is flushed."""
+
+    def __init__(self, encoding, pad=False):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+        else:
+            self.buffer = io.BytesIO()
+            self.compressor = gzip.GzipFile(
+                filename='a' * secrets.randbelow(_padding()) if pad else '', mode='wb',
+                compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), fileobj=self.buffer, mtime=0,
+            )
+
+    def chunk(self, data):
+        if self.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.flush()
+        self.compressor.write(data)
+        self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return self._written()
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        self.compressor.close()
+        return self._written()
+
+    def _written(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+def _compress_stream(chunks, encoding, pad):
+    stream = StreamCompressor(encoding, pad)
+    for data in chunks:
+        out = stream.chunk(data)
+        if out:
+            yield out
+    yield stream.finish()
+
+
+async def _compress_async_stream(chunks, encoding, pad):
+    stream = StreamCompressor(encoding, pad)
+    async for data in chunks:
+        out = stream.chunk(data)
+        if out:
+            yield out
+    yield stream.finish()
+
+
+def body_key(encoding, digest):
+    return f'compressed:{encoding}:{digest}'
+
+
+def page_key(path):
+    return f'compressed_page:{hashlib.md5(path.encode(), usedforsecurity=False).hexdigest()}'
+
+
+def forget_page(path):
+    cache.delete(page_key(path))
+
+
+def _pages_by_url():
+    return getattr(settings, 'CACHE_IS_SHARED', False)
+
+
+def _digest(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _cache_control(response):
+    return {token.strip().split('=')[0].lower() for token in response.get('Cache-Control', '').split(',')}
+
+
+def _compressible(response):
+    return (
+        response.status_code == 200
+        and not response.has_header('Content-Encoding')
+        and response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def _vary(response):
+    return {value.strip().lower() for value in response.get('Vary', '').split(',') if value.strip()}
+
+
+def _personal(request, response):
+    """Whether the response may hold one session's secrets (see above)."""
+    return bool(
+        request.method != 'GET'
+        or response.cookies
+        or _cache_control(response) & {'private', 'no-store'}
+        or 'cookie' in _vary(response)
+    )
+
+
+def _shareable(request, response):
+    return (
+        not _personal(request, response)
+        and len(response.content) <= getattr(settings, 'COMPRESSION_CACHE_MAX_BYTES', 256 * 1024)
+    )
+
+
+def _public_max_age(response):
+    """Seconds the response may be served to anyone by URL, or 0."""
+    if 'public' not in _cache_control(response) or _vary(response) - {'accept-encoding'}:
+        return 0
+    return get_max_age(response) or 0
+
+
+def _compressed_body(body, encoding, digest):
+    """Compressed bytes of `body` through the cache, when `digest` is given."""
+    if digest is None:
+        return compress(body, encoding)
+    key = body_key(encoding, digest)
+    compressed = cache.get(key)
+    metrics.inc('commpolls_cache_requests_total', cache='compressed_body', result='miss' if compressed is None else 'hit')
+    if compressed is None:
+        compressed = compress(body, encoding)
+        cache.set(key, compressed, getattr(settings, 'COMPRESSION_CACHE_TIMEOUT', 3600))
+    return compressed
+
+
+def _set_encoding(response, encoding, length=None):
+    response['Content-Encoding'] = encoding
+    if length is None:
+        del response['Content-Length']
+    else:
+        response['Content-Length'] = str(length)
+    # The bytes differ from the uncompressed ones, so the validator is weak.
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = f'W/{etag}'
+
+
+def compress_response(request, response, encoding):
+    """Compress `response` with `encoding` (None: leave it as is) where worthwhile."""
+    if not _compressible(response):
+        return response
+    personal = _personal(request, response)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if personal and encoding == 'br':
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''), ('gzip',))
+
+    if response.streaming:
+        if encoding:
+            if response.is_async:
+                response.streaming_content = _compress_async_stream(response.streaming_content, encoding, personal)
+            else:
+                response.streaming_content = _compress_stream(response.streaming_content, encoding, personal)
+            _set_encoding(response, encoding)
+        return response
+
+    body = response.content
+    digest = _digest(body) if _shareable(request, response) else None
+    if digest is not None:
+        max_age = _public_max_age(response) if _pages_by_url() else 0
+        if max_age:
+            timeout = getattr(settings, 'COMPRESSION_CACHE_TIMEOUT', 3600)
+            cache.set(body_key(IDENTITY, digest), body, max(timeout, max_age))
+            cache.set(page_key(request.get_full_path()), {
+                'digest': digest,
+                'size': len(body),
+                'headers': [(name, value) for name, value in response.items() if name.lower() not in UNCACHED_HEADERS],
+            }, max_age)
+
+    if encoding is None or len(body) < getattr(settings, 'COMPRESSION_MIN_BYTES', 512):
+        return response
+    compressed = compress(body, encoding, pad=True) if personal else _compressed_body(body, encoding, digest)
+    if len(compressed) >= len(body):
+        return response
+    response.content = compressed
+    _set_encoding(response, encoding, len(compressed))
+    return response
+
+
+def cached_page(request, encoding):
+    """The response remembered for this URL, or None."""
+    if not _pages_by_url():
+        return None
+    entry = cache.get(page_key(request.get_full_path()))
+    metrics.inc('commpolls_cache_requests_total', cache='compressed_page', result='miss' if entry is None else 'hit')
+    if entry is None:
+        return None
+    compress_it = encoding and entry['size'] >= getattr(settings, 'COMPRESSION_MIN_BYTES', 512)
+    body = cache.get(body_key(encoding, entry['digest'])) if compress_it else None
+    if body is None:
+        body = cache.get(body_key(IDENTITY, entry['digest']))
+        if body is None:
+            return None
+        if compress_it:
+            compressed = _compressed_body(body, encoding, entry['digest'])
+            body, compress_it = (compressed, True) if len(compressed) < len(body) else (body, False)
+
+    response = HttpResponse(body)
+    for name, value in entry['headers']:
+        response[name] = value
+    if compress_it:
+        _set_encoding(response, encoding, len(body))
+    else:
+        response['Content-Length'] = str(len(body))
+    return response
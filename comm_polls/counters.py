@@ -0,0 +1,105 @@
+"""
+Reconciliation of the denormalized Choice.votes_count counters.
+
+Counters are recomputed from Vote with one grouped aggregate per chunk of
+polls. Drift is applied as an additive delta (votes_count = votes_count + d)
+so votes cast while a chunk is being checked are never overwritten, and
+each chunk commits on its own to keep row locks short on busy polls.
+
+Incremental runs start RECONCILE_GRACE_SECONDS before the stored watermark,
+so a vote whose transaction committed after an earlier run had passed its
+voted_at is still checked.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Value, When
+
+from .models import Choice, Poll, Vote, Watermark
+
+RECONCILE_WATERMARK = 'reconcile_votes'
+
+
+def chunked(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def apply_counter_deltas(deltas):
+    """Add {choice_id: delta} to votes_count with a single UPDATE."""
+    deltas = {choice_id: delta for choice_id, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    increment = Case(
+        *[When(pk=choice_id, then=Value(delta)) for choice_id, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return Choice.objects.filter(pk__in=deltas).update(votes_count=F('votes_count') + increment)
+
+
+def find_drift(poll_ids):
+    """
+    Return [(choice_id, poll_id, stored, actual)] for choices of `poll_ids`
+    whose counter disagrees with the number of Vote rows.
+    """
+    rows = (
+        Choice.objects.filter(poll_id__in=poll_ids)
+        .annotate(actual=Count('choice_votes'))
+        .exclude(votes_count=F('actual'))
+        .values_list('id', 'poll_id', 'votes_count', 'actual')
+    )
+    return list(rows)
+
+
+def polls_to_check(since=None, until=None):
+    """Poll ids to reconcile: all polls, or only those with votes in (since, until]."""
+    if since is None:
+        # Archived polls keep their counters but no longer have Vote rows.
+        polls = Poll.objects.filter(vote_archive__isnull=True)
+        return polls.order_by('id').values_list('id', flat=True).iterator()
+    votes = Vote.objects.filter(voted_at__gt=since)
+    if until is not None:
+        votes = votes.filter(voted_at__lte=until)
+    return sorted(set(votes.values_list('poll_id', flat=True).distinct()))
+
+
+def reconcile_vote_counts(chunk_size=500, incremental=False, dry_run=False):
+    """
+    Recompute votes_count for all polls, or only for polls that received
+    votes since the stored watermark when `incremental` is set.
+
+    Returns a summary dict; `drift` lists every mismatch that was found.
+    """
+    watermark = Watermark.objects.filter(name=RECONCILE_WATERMARK).first()
+    since = None
+    if incremental and watermark:
+        since = watermark.value - timedelta(seconds=getattr(settings, 'RECONCILE_GRACE_SECONDS', 120))
+    # Fix the upper bound up front so votes arriving during the run are
+    # picked up by the next incremental pass instead of being skipped.
+    until = Vote.objects.aggregate(latest=Max('voted_at'))['latest']
+
+    summary = {'polls': 0, 'choices_fixed': 0, 'drift': [], 'since': since, 'until': until}
+    for chunk in chunked(polls_to_check(since, until), chunk_size):
+        summary['polls'] += len(chunk)
+        drift = find_drift(chunk)
+        summary['drift'].extend(drift)
+        if drift and not dry_run:
+            with transaction.atomic():
+                summary['choices_fixed'] += apply_counter_deltas(
+                    {choice_id: actual - stored for choice_id, _, stored, actual in drift}
+                )
+
+    if not dry_run and until is not None:
+        Watermark.objects.update_or_create(
+            name=RECONCILE_WATERMARK, defaults={'value': until}
+        )
+    return summary
@@ -0,0 +1,224 @@
+"""
+Streaming dump and restore of the whole dataset.
+
+dumpdata/loaddata build every object in memory and loaddata saves one row
+at a time, firing post_save for each user. Instead, each table is read in
+primary key order through a server-side cursor (one REPEATABLE READ
+transaction on PostgreSQL, so the tables agree with each other) and written
+as gzip-compressed JSON Lines files of at most `chunk_size` rows, one JSON
+array of field values per line. manifest.json, written last, lists the
+tables, their fields and their files; a dump without it is incomplete.
+
+Restore bulk-inserts each file in its own transaction with explicit
+primary keys. bulk_create sends no signals, so no profiles are created
+for restored users and no cache is touched row by row. Finished files are
+recorded in a progress file, and a rerun after an interruption skips
+them; inserts ignore rows that already exist, so a file whose commit was
+not recorded is simply loaded again. At the end the primary key sequences
+are reset, the default cache is cleared and the progress file removed.
+
+Derived data is not dumped: rebuild the vote rollups with
+fold_vote_rollups --full. Group memberships are restored by group name.
+"""
+import base64
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .counters import chunked
+from .models import Choice, ManagerRequest, Poll, PollVoteArchive, Profile, UserVoteArchive, Vote
+
+FORMAT = 1
+MANIFEST = 'manifest.json'
+PROGRESS = 'restore-progress.json'
+
+
+class RestoreError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Table:
+    name: str
+    model: type
+    fields: tuple
+    manager: str = 'objects'
+
+    def queryset(self):
+        return getattr(self.model, self.manager).all()
+
+
+# In restore order: every table comes after the ones it references.
+TABLES = [
+    Table('users', User, ('id', 'password', 'last_login', 'is_superuser', 'username', 'first_name',
+                          'last_name', 'email', 'is_staff', 'is_active', 'date_joined')),
+    # Restored by group name, which is all the app relies on.
+    Table('user_groups', User.groups.through, ('id', 'user_id', 'group__name')),
+    Table('profiles', Profile, ('id', 'user_id', 'avatar', 'avatar_remote')),
+    Table('manager_requests', ManagerRequest, ('id', 'user_id', 'status', 'requested_at')),
+    # Hidden polls too, with their rows; purge_deleted_polls finishes them.
+    Table('polls', Poll, ('id', 'name', 'description', 'created_by_id', 'created_at', 'start_date',
+                          'end_date', 'deleted_at', 'kind'), manager='all_objects'),
+    Table('choices', Choice, ('id', 'poll_id', 'name', 'votes_count')),
+    Table('votes', Vote, ('id', 'poll_id', 'choice_id', 'voter_id', 'voted_at', 'ranking')),
+    Table('poll_vote_archives', PollVoteArchive, ('id', 'poll_id', 'vote_count', 'voters', 'choices',
+                                                  'voted_at', 'archived_at')),
+    Table('user_vote_archives', UserVoteArchive, ('id', 'user_id', 'polls', 'choices')),
+]
+TABLES_BY_NAME = {table.name: table for table in TABLES}
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"Cannot dump {type(value).__name__}")
+
+
+def _write_json(path, data):
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as handle:
+        json.dump(data, handle, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def _dump_table(table, directory, chunk_size, progress):
+    rows = table.queryset().order_by('pk').values_list(*table.fields).iterator(chunk_size=10000)
+    files = []
+    for number, chunk in enumerate(chunked(rows, chunk_size)):
+        name = f'{table.name}-{number:05d}.jsonl.gz'
+        with gzip.open(os.path.join(directory, name), 'wt', encoding='utf-8', compresslevel=6) as handle:
+            for row in chunk:
+                handle.write(json.dumps(row, default=_encode, separators=(',', ':')))
+                handle.write('\n')
+        files.append({'name': name, 'rows': len(chunk)})
+        if progress:
+            progress(table.name, name, len(chunk))
+    return {'name': table.name, 'fields': list(table.fields), 'rows': sum(f['rows'] for f in files), 'files': files}
+
+
+def dump(directory, chunk_size=100000, progress=None):
+    """Write every table into `directory`; returns the manifest."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'format': FORMAT, 'created_at': timezone.now().isoformat(), 'tables': []}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        for table in TABLES:
+            manifest['tables'].append(_dump_table(table, directory, chunk_size, progress))
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+    return manifest
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as handle:
+            manifest = json.load(handle)
+    except FileNotFoundError:
+        raise RestoreError(f"No {MANIFEST} in {directory}: the dump is missing or did not finish.")
+    if manifest.get('format') != FORMAT:
+        raise RestoreError(f"Unsupported dump format {manifest.get('format')!r}.")
+    return manifest
+
+
+@contextmanager
+def keeping_timestamps(model_classes):
+    """Let bulk_create store the given auto_now_add values instead of the current time."""
+    fields = [
+        field for model in model_classes for field in model._meta.concrete_fields
+        if isinstance(field, models.DateField) and field.auto_now_add
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _rows(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as handle:
+        for line in handle:
+            yield json.loads(line)
+
+
+def _instances(table, fields, rows, groups):
+    def group_id(name):
+        if name not in groups:
+            groups[name] = Group.objects.get_or_create(name=name)[0].pk
+        return groups[name]
+
+    model = table.model
+    converters = []
+    for name in fields:
+        if name == 'group__name':
+            converters.append(('group_id', group_id))
+        else:
+            converters.append((name, model._meta.get_field(name).to_python))
+    return [model(**{name: convert(value) for (name, convert), value in zip(converters, row)}) for row in rows]
+
+
+def restore(directory, batch_size=5000, progress_path=None, progress=None):
+    """
+    Load a dump into an empty database, or finish an interrupted restore
+    recorded in `progress_path`. Returns {table name: rows inserted}.
+    """
+    manifest = read_manifest(directory)
+    progress_path = progress_path or os.path.join(directory, PROGRESS)
+    done = set()
+    if os.path.exists(progress_path):
+        with open(progress_path, encoding='utf-8') as handle:
+            done = set(json.load(handle)['files'])
+    else:
+        occupied = [table.name for table in TABLES if table.queryset().exists()]
+        if occupied:
+            raise RestoreError(f"Restore needs empty tables; these have rows: {', '.join(occupied)}.")
+
+    inserted = {}
+    groups = {}
+    with keeping_timestamps([table.model for table in TABLES]):
+        for table_manifest in manifest['tables']:
+            table = TABLES_BY_NAME[table_manifest['name']]
+            inserted[table.name] = 0
+            for file in table_manifest['files']:
+                if file['name'] in done:
+                    continue
+                with transaction.atomic():
+                    for rows in chunked(_rows(os.path.join(directory, file['name'])), batch_size):
+                        table.model.objects.bulk_create(
+                            _instances(table, table_manifest['fields'], rows, groups), ignore_conflicts=True,
+                        )
+                inserted[table.name] += file['rows']
+                done.add(file['name'])
+                _write_json(progress_path, {'files': sorted(done)})
+                if progress:
+                    progress(table.name, file['name'], file['rows'])
+
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [table.model for table in TABLES] + [Group]):
+            cursor.execute(sql)
+    cache.clear()
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return inserted
+
+
+def row_count_mismatches(manifest):
+    """[(table name, rows in the dump, rows in the database)] for every table that differs."""
+    mismatches = []
+    for table_manifest in manifest['tables']:
+        actual = TABLES_BY_NAME[table_manifest['name']].queryset().count()
+        if actual != table_manifest['rows']:
+            mismatches.append((table_manifest['name'], table_manifest['rows'], actual))
+    return mismatches
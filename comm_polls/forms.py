@@ -4,6 +4,18 @@ from django.contrib.auth.forms import UserCreationForm
 from .models import Profile, Poll, Choice
 from django.forms import inlineformset_factory
 
+
+def save_avatar(user, avatar):
+    """Write the profile only when a new avatar was uploaded."""
+    if not avatar:
+        return
+    try:
+        profile = user.profile
+    except Profile.DoesNotExist:
+        profile = Profile(user=user)
+    profile.avatar = avatar
+    profile.save()
+
 class SignUpForm(UserCreationForm):
     email = forms.EmailField(required=True, label='Email')
     avatar = forms.ImageField(required=False)
@@ -23,11 +35,7 @@ class SignUpForm(UserCreationForm):
         user = super().save(commit=False)
         if commit:
             user.save()
-            profile, created = Profile.objects.get_or_create(user=user)
-            avatar = self.cleaned_data.get('avatar')
-            if avatar:
-                profile.avatar = avatar
-                profile.save()
+            save_avatar(user, self.cleaned_data.get('avatar'))
         return user
 
 
@@ -42,18 +50,17 @@ class UserUpdateForm(forms.ModelForm):
         user = super().save(commit=False)
         if commit:
             user.save()
-            profile, created = Profile.objects.get_or_create(user=user)
-            avatar = self.cleaned_data.get('avatar')
-            if avatar:
-                profile.avatar = avatar
-                profile.save()
+            save_avatar(user, self.cleaned_data.get('avatar'))
         return user
 
 
 class PollForm(forms.ModelForm):
+    # Optional so API and import payloads without it keep creating single-choice polls.
+    kind = forms.ChoiceField(choices=Poll.KIND_CHOICES, required=False, label='Voting')
+
     class Meta:
         model = Poll
-        fields = ['name', 'description', 'start_date', 'end_date']
+        fields = ['name', 'description', 'start_date', 'end_date', 'kind']
         widgets = {
             'name': forms.TextInput(attrs={'placeholder': 'e.g., Favorite Programming Language?'}),
             'description': forms.Textarea(
@@ -63,6 +70,9 @@ class PollForm(forms.ModelForm):
             'end_date': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
         }
 
+    def clean_kind(self):
+        return self.cleaned_data['kind'] or Poll.SINGLE
+
 
 class ChoiceForm(forms.ModelForm):
     name = forms.CharField(
@@ -76,6 +86,15 @@ class ChoiceForm(forms.ModelForm):
         fields = ['name']
 
 
+def validate_choice_names(names):
+    """Shared rule for every poll creation path: at least two named choices."""
+    filled = [name for name in names if name and name.strip()]
+    if len(filled) < 2:
+        raise forms.ValidationError(
+            'You must provide at least two choices with a name.'
+        )
+
+
 class BaseChoiceFormSet(forms.BaseInlineFormSet):
     def clean(self):
         super().clean()
@@ -83,18 +102,11 @@ class BaseChoiceFormSet(forms.BaseInlineFormSet):
             return
 
         # Count only forms that have a non-empty 'name' field and are not deleted
-        filled_forms = 0
-        for form in self.forms:
-            if hasattr(form, 'cleaned_data'):
-                name = form.cleaned_data.get('name', '').strip()
-                delete = form.cleaned_data.get('DELETE', False)
-                if name and not delete:
-                    filled_forms += 1
-
-        if filled_forms < 2:
-            raise forms.ValidationError(
-                'You must provide at least two choices with a name.'
-            )
+        validate_choice_names(
+            form.cleaned_data.get('name', '')
+            for form in self.forms
+            if hasattr(form, 'cleaned_data') and not form.cleaned_data.get('DELETE', False)
+        )
 
 
 # Inline formset for choices related to a poll
@@ -0,0 +1,101 @@
+"""
+Password hashers that run inside a bounded hashing pool.
+
+Each hash costs hundreds of milliseconds of CPU, so a burst of sign-ups or
+logins can occupy every worker thread at once. Hashing happens on the
+request thread (it has to wait for the result anyway), but only
+PASSWORD_HASHING_WORKERS hashes run at a time per process and at most
+PASSWORD_HASHING_QUEUE more may wait for a slot. Past that, or after
+waiting PASSWORD_HASHING_TIMEOUT seconds, HashingBusy is raised and
+HashingBusyMiddleware answers 503 with a Retry-After header instead of
+letting the backlog grow.
+
+The pool is per process, so by default it is sized from the gunicorn
+layout: a process hashes on its share of the CPUs (at least one slot and
+fewer than its WEB_THREADS), and the queue leaves one thread free for
+requests that do not hash.
+
+The hashers keep the algorithm names of Django's own, so existing hashes
+verify unchanged and Django re-hashes with the first entry of
+PASSWORD_HASHERS on the next successful login.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+class HashingPool:
+    def __init__(self, workers, queue, timeout):
+        self.config = (workers, queue, timeout)
+        self.timeout = timeout
+        self._running = threading.BoundedSemaphore(workers)
+        self._admitted = threading.BoundedSemaphore(workers + queue)
+
+    @contextmanager
+    def slot(self):
+        # PBKDF2's verify() calls encode(); the nested call reuses the slot.
+        if getattr(_local, 'holding', False):
+            yield
+            return
+        if not self._admitted.acquire(blocking=False):
+            raise HashingBusy
+        try:
+            if not self._running.acquire(timeout=self.timeout):
+                raise HashingBusy
+            _local.holding = True
+            try:
+                yield
+            finally:
+                _local.holding = False
+                self._running.release()
+        finally:
+            self._admitted.release()
+
+
+def pool_size():
+    """(workers, queue) of this process's pool."""
+    threads = getattr(settings, 'WEB_THREADS', 1)
+    cpus = getattr(settings, 'CPU_COUNT', 1) // max(1, getattr(settings, 'WEB_PROCESSES', 1))
+    workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or max(1, min(cpus, threads - 1))
+    queue = getattr(settings, 'PASSWORD_HASHING_QUEUE', None)
+    if queue is None:
+        queue = max(0, threads - workers - 1)
+    return workers, queue
+
+
+def get_pool():
+    """The process-wide pool, rebuilt if its settings changed."""
+    global _pool
+    config = (*pool_size(), getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 5))
+    with _pool_lock:
+        if _pool is None or _pool.config != config:
+            _pool = HashingPool(*config)
+        return _pool
+
+
+class BoundedHasherMixin:
+    def encode(self, password, salt, *args, **kwargs):
+        with get_pool().slot():
+            return super().encode(password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        with get_pool().slot():
+            return super().verify(password, encoded)
+
+
+class BoundedPBKDF2PasswordHasher(BoundedHasherMixin, PBKDF2PasswordHasher):
+    pass
+
+
+class BoundedArgon2PasswordHasher(BoundedHasherMixin, Argon2PasswordHasher):
+    pass
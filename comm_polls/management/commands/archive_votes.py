@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from comm_polls.archive import archivable_polls, archive_polls
+from comm_polls.counters import chunked
+
+
+class Command(BaseCommand):
+    help = "Move votes of polls that ended more than --days ago into the packed archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Archive polls ended more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=20, help='Polls archived per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the polls that would be archived.')
+
+    def handle(self, *args, **options):
+        poll_ids = list(archivable_polls(options['days']).values_list('id', flat=True))
+        if options['dry_run']:
+            self.stdout.write(f"{len(poll_ids)} polls would be archived: {poll_ids}")
+            return
+
+        moved = 0
+        for chunk in chunked(poll_ids, options['batch_size']):
+            moved += archive_polls(chunk)
+            self.stdout.write(f"  archived polls {chunk[0]}..{chunk[-1]}")
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} votes from {len(poll_ids)} polls."))
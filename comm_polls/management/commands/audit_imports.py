@@ -0,0 +1,58 @@
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker imports before it can serve its first request: the WSGI
+# application (django.setup()) and the URLconf, which pulls in the views.
+BOOT = (
+    "import os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings'); "
+    "from config.wsgi import application; "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \| *(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Import the application the way a worker does, under python -X importtime, "
+        "and report the slowest top-level packages and modules."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=15, help='Rows per table.')
+
+    def handle(self, *args, **options):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT],
+            capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Importing the application failed:\n{result.stderr[-2000:]}")
+
+        modules = []
+        for line in result.stderr.splitlines():
+            match = LINE.match(line)
+            if match:
+                self_us, name = match.groups()
+                modules.append((name, int(self_us)))
+        if not modules:
+            raise CommandError("No import timings were reported.")
+
+        packages = defaultdict(lambda: [0, 0])
+        for name, self_us in modules:
+            package = packages[name.split('.')[0]]
+            package[0] += self_us
+            package[1] += 1
+        total = sum(self_us for _, self_us in modules)
+
+        self.stdout.write(f"{len(modules)} modules imported in {total / 1000:.0f} ms\n")
+        self.stdout.write(f"{'package':<32} {'ms':>8} {'share':>6} {'modules':>8}")
+        for name, (self_us, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:options['limit']]:
+            self.stdout.write(f"{name:<32} {self_us / 1000:>8.1f} {self_us / total:>6.1%} {count:>8}")
+
+        self.stdout.write(f"\n{'module (self time)':<48} {'ms':>8}")
+        for name, self_us in sorted(modules, key=lambda module: -module[1])[:options['limit']]:
+            self.stdout.write(f"{name:<48} {self_us / 1000:>8.1f}")
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+
+from comm_polls.hashers import HashingBusy
+
+HASHERS = {
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'bounded-pbkdf2': 'comm_polls.hashers.BoundedPBKDF2PasswordHasher',
+    'bounded-argon2': 'comm_polls.hashers.BoundedArgon2PasswordHasher',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure password checks (the CPU cost of a login) per second and per core "
+        "for the stock PBKDF2 hasher and the bounded hashers in comm_polls.hashers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hasher', action='append', choices=sorted(HASHERS),
+                            help='Hasher to measure; repeat for several (default: all available).')
+        parser.add_argument('--threads', type=int, default=os.cpu_count() or 1,
+                            help='Concurrent login threads (default: CPU count).')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        if threads < 1:
+            raise CommandError('--threads must be at least 1.')
+        cores = min(threads, os.cpu_count() or 1)
+        for name in options['hasher'] or list(HASHERS):
+            hasher = import_string(HASHERS[name])()
+            try:
+                if hasher.library:
+                    hasher._load_library()
+            except ValueError as exc:
+                if options['hasher']:
+                    raise CommandError(str(exc))
+                self.stdout.write(f"{name}: skipped ({exc})")
+                continue
+            checks, rejected, elapsed = self.run(hasher, threads, options['seconds'])
+            rate = checks / elapsed
+            self.stdout.write(
+                f"{name}: {checks} logins in {elapsed:.1f}s, {rate:.1f}/s, "
+                f"{rate / cores:.1f}/s per core, {rejected} rejected as busy"
+            )
+
+    def run(self, hasher, threads, seconds):
+        password = get_random_string(16)
+        encoded = hasher.encode(password, hasher.salt())
+        counts = [[0, 0] for _ in range(threads)]
+        start = time.perf_counter()
+        deadline = start + seconds
+
+        def login(count):
+            # At least one check per thread, so short runs still report.
+            while True:
+                try:
+                    if not hasher.verify(password, encoded):
+                        raise RuntimeError('Password check failed.')
+                    count[0] += 1
+                except HashingBusy:
+                    count[1] += 1
+                if time.perf_counter() >= deadline:
+                    return
+
+        workers = [threading.Thread(target=login, args=(count,)) for count in counts]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return sum(c for c, _ in counts), sum(r for _, r in counts), time.perf_counter() - start
@@ -0,0 +1,90 @@
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the application server repeatedly and report the time from process "
+        "start until the first request is served."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('gunicorn', 'runserver'), default='gunicorn',
+                            help='gunicorn with gunicorn.conf.py (default) or manage.py runserver --noreload.')
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--path', default='/accounts/login/', help='URL requested until it answers.')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for each start.')
+        parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                            help='Extra environment for the server, e.g. GUNICORN_PRELOAD=False.')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.setdefault('ALLOWED_HOSTS', '127.0.0.1')
+        for item in options['env']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"--env expects NAME=VALUE, got {item!r}.")
+            env[name] = value
+
+        timings = []
+        for run in range(1, options['runs'] + 1):
+            seconds, status = self.start_once(options['server'], options['path'], options['timeout'], env)
+            timings.append(seconds)
+            self.stdout.write(f"run {run}: first response ({status}) after {seconds * 1000:.0f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['server']}: median {statistics.median(timings) * 1000:.0f} ms, "
+            f"best {min(timings) * 1000:.0f} ms over {len(timings)} runs"
+        ))
+
+    def start_once(self, server, path, timeout, env):
+        port = _free_port()
+        if server == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                       '--bind', f'127.0.0.1:{port}', 'config.wsgi:application']
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+        url = f'http://127.0.0.1:{port}{path}'
+
+        # A file rather than a pipe, so a chatty server never blocks on a full buffer.
+        log = tempfile.TemporaryFile()
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=log)
+        try:
+            while time.perf_counter() - start < timeout:
+                if process.poll() is not None:
+                    log.seek(0)
+                    raise CommandError(f"The server exited early:\n{log.read().decode()[-2000:]}")
+                try:
+                    with urllib.request.urlopen(url, timeout=timeout) as response:
+                        return time.perf_counter() - start, response.status
+                except urllib.error.HTTPError as exc:
+                    # Any answer means a worker is serving; the status is reported.
+                    return time.perf_counter() - start, exc.code
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.02)
+            raise CommandError(f"No response from {url} within {timeout:.0f}s.")
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            log.close()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from comm_polls.dumps import dump
+
+
+class Command(BaseCommand):
+    help = (
+        "Dump users, profiles, polls, choices, votes and archived ballots into a directory "
+        "of gzip-compressed JSON Lines chunks, for restore_dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Created if missing.')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows per file.')
+
+    def handle(self, *args, **options):
+        def progress(table, name, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {name}: {rows} rows")
+
+        manifest = dump(options['directory'], options['chunk_size'], progress)
+        for table in manifest['tables']:
+            self.stdout.write(f"{table['name']}: {table['rows']} rows in {len(table['files'])} files")
+        self.stdout.write(self.style.SUCCESS(f"Dumped into {options['directory']}."))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from comm_polls.rollups import fold_vote_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold new votes into the per-minute, hour and day vote rollups shown on "
+        "the manage poll page. Run every minute from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recount every Vote row instead of starting from the stored watermark.',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Buckets written per statement.')
+
+    def handle(self, *args, **options):
+        summary = fold_vote_rollups(full=options['full'], chunk_size=options['chunk_size'])
+        if summary['since']:
+            self.stdout.write(f"Votes since {summary['since'].isoformat()}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {summary['buckets']} minute buckets of {summary['polls']} polls, "
+            f"pruned {summary['pruned']} old minute buckets."
+        ))
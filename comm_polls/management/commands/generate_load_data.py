@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from comm_polls.synthetic import generate
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic users, polls and a power-law spread of votes with bulk inserts, "
+        "deterministically for a given --seed. Meant for local and staging databases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--polls', type=int, default=1000)
+        parser.add_argument('--votes', type=int, default=1000000,
+                            help='Target number of votes; polls cannot get more votes than there are users.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponent of the poll popularity law.')
+        parser.add_argument('--prefix', default='load', help='Username prefix of the generated users.')
+        parser.add_argument('--password', default=None,
+                            help='Password of every generated user (default: unusable, no logins).')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows per INSERT and per commit.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(stored):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {stored} votes after {time.perf_counter() - started:.0f}s")
+
+        try:
+            summary = generate(
+                options['users'], options['polls'], options['votes'], seed=options['seed'],
+                zipf=options['zipf'], prefix=options['prefix'], password=options['password'],
+                chunk_size=options['chunk_size'], progress=progress,
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['users']} users, {summary['polls']} polls, {summary['choices']} choices "
+            f"and {summary['votes']} votes in {elapsed:.1f}s ({summary['votes'] / max(elapsed, 1e-9):.0f} votes/s)."
+        ))
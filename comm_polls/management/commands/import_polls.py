@@ -0,0 +1,75 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from comm_polls.bulk import CREATED, INVALID, create_polls, validate_poll
+
+
+class Command(BaseCommand):
+    help = (
+        "Import polls from a JSON Lines file, one "
+        '{"name", "description", "start_date", "end_date", "choices": [...]} object per line. '
+        "The file is streamed in batches and written in a single transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSON Lines file, or '-' for stdin.")
+        parser.add_argument('--owner', required=True, help='Username recorded as the creator of every poll.')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, write nothing.')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['owner']!r}.")
+
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        created = invalid = 0
+        with stream, transaction.atomic():
+            batch = []
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((line_number, json.loads(line)))
+                except ValueError as exc:
+                    invalid += 1
+                    self.report(line_number, {'__all__': [f'Invalid JSON: {exc}']})
+                    continue
+                if len(batch) >= options['batch_size']:
+                    created, invalid = self.flush(batch, owner, options['dry_run'], created, invalid)
+                    batch = []
+            created, invalid = self.flush(batch, owner, options['dry_run'], created, invalid)
+
+        verb = 'Validated' if options['dry_run'] else 'Created'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {created} polls."))
+        if invalid:
+            raise CommandError(f"{invalid} polls were invalid and skipped.")
+
+    def flush(self, batch, owner, dry_run, created, invalid):
+        if not batch:
+            return created, invalid
+        items = [item for _, item in batch]
+        if dry_run:
+            results = [
+                {'status': INVALID, 'errors': errors} if errors else {'status': CREATED}
+                for _, _, errors in map(validate_poll, items)
+            ]
+        else:
+            results = create_polls(items, owner)
+        for (line_number, _), result in zip(batch, results):
+            if result['status'] == CREATED:
+                created += 1
+            else:
+                invalid += 1
+                self.report(line_number, result['errors'])
+        return created, invalid
+
+    def report(self, line_number, errors):
+        for field, messages in errors.items():
+            for message in messages:
+                self.stderr.write(f"line {line_number}: {field}: {message}")
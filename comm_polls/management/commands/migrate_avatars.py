@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from comm_polls.avatars import offload_avatars, uses_remote_storage
+
+
+class Command(BaseCommand):
+    help = "Move avatars still stored in MEDIA_ROOT to the remote avatar storage."
+
+    def handle(self, *args, **options):
+        if not uses_remote_storage():
+            raise CommandError('Set AVATAR_STORAGE=remote (and the AVATAR_S3_* settings) first.')
+
+        def progress(name, moved):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{'Moved' if moved else 'Skipped'} {name}")
+
+        summary = offload_avatars(progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {summary['moved']} avatars; skipped {summary['skipped']} (missing file or replaced meanwhile)."
+        ))
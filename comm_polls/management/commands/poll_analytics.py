@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Report turnout, margins of victory, confidence intervals on choice shares and "
+        "voter overlap across all polls, as CSV files. Needs requirements-analytics.txt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='analytics-report', help='Directory for the CSV files.')
+        parser.add_argument('--chunk-size', type=int, default=1_000_000,
+                            help='Approximate ballots loaded into memory at once.')
+        parser.add_argument('--active-days', type=int, default=None,
+                            help='Count only users who logged in within this many days as active.')
+        parser.add_argument('--overlap-limit', type=int, default=1000, help='Poll pairs listed in overlap.csv.')
+
+    def handle(self, *args, **options):
+        try:
+            from comm_polls.analytics import build_report, write_report
+        except ImportError as exc:
+            raise CommandError(f"{exc}. Install requirements-analytics.txt to run the analytics.")
+
+        def progress(voter_id, ballots):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  voters below {voter_id}: {ballots} ballots")
+
+        report = build_report(options['chunk_size'], options['active_days'], progress)
+        paths = write_report(report, options['output'], options['overlap_limit'])
+        live = int(report.poll_votes.sum()) - report.archived_votes
+        self.stdout.write(
+            f"{len(report.poll_ids)} polls, {len(report.choice_ids)} choices, {live} live and "
+            f"{report.archived_votes} archived ballots, {report.voters} live voters, "
+            f"{report.active_users} active users"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {', '.join(paths)}"))
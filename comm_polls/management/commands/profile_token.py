@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from comm_polls.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Print a signed token that profiles any request sent with an "
+        "'X-Profile-Token: <token>' header, for callers without a staff session."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
+        self.stderr.write(f"Valid for {settings.REQUEST_PROFILE_TOKEN_MAX_AGE} seconds.")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from comm_polls.purge import purge_deleted_polls
+
+
+class Command(BaseCommand):
+    help = "Remove polls marked as deleted, with their votes and choices, in bounded chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None, help='Rows removed per DELETE statement.')
+
+    def handle(self, *args, **options):
+        poll_ids, deleted = purge_deleted_polls(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {len(poll_ids)} polls ({deleted} rows)."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from comm_polls.counters import reconcile_vote_counts
+
+
+class Command(BaseCommand):
+    help = "Recompute Choice.votes_count from the stored Vote rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only re-check polls with votes newer than the stored voted_at watermark.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drift without changing any counter or the watermark.',
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Polls per grouped aggregate.')
+
+    def handle(self, *args, **options):
+        summary = reconcile_vote_counts(
+            chunk_size=options['chunk_size'],
+            incremental=options['incremental'],
+            dry_run=options['dry_run'],
+        )
+
+        if summary['since']:
+            self.stdout.write(f"Votes since {summary['since'].isoformat()}")
+        for choice_id, poll_id, stored, actual in summary['drift']:
+            self.stdout.write(f"  poll {poll_id} choice {choice_id}: stored {stored}, actual {actual}")
+
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        fixed = len(summary['drift']) if options['dry_run'] else summary['choices_fixed']
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {summary['polls']} polls, {verb} {fixed} choice counters."
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from comm_polls.counters import reconcile_vote_counts
+from comm_polls.dumps import RestoreError, read_manifest, restore, row_count_mismatches
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load a dump_dataset directory into an empty database, then check row counts "
+        "and vote counters. Rerun the same command to resume an interrupted restore."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT.')
+        parser.add_argument('--progress-file', default=None,
+                            help='Where finished files are recorded (default: restore-progress.json in the dump).')
+        parser.add_argument('--fix-counters', action='store_true',
+                            help='Correct any Choice.votes_count that disagrees with the restored votes.')
+
+    def handle(self, *args, **options):
+        def progress(table, name, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {name}: {rows} rows")
+
+        try:
+            manifest = read_manifest(options['directory'])
+            inserted = restore(options['directory'], options['batch_size'], options['progress_file'], progress)
+        except RestoreError as exc:
+            raise CommandError(str(exc))
+        for table, rows in inserted.items():
+            self.stdout.write(f"{table}: {rows} rows loaded")
+
+        mismatches = row_count_mismatches(manifest)
+        for table, expected, actual in mismatches:
+            self.stderr.write(f"{table}: {expected} rows in the dump, {actual} in the database")
+
+        summary = reconcile_vote_counts(dry_run=not options['fix_counters'])
+        for choice_id, poll_id, stored, actual in summary['drift']:
+            self.stderr.write(f"poll {poll_id} choice {choice_id}: votes_count {stored}, votes {actual}")
+        verb = 'fixed' if options['fix_counters'] else 'found'
+        self.stdout.write(f"Checked {summary['polls']} polls, {verb} {len(summary['drift'])} counter mismatches.")
+
+        if mismatches:
+            raise CommandError("The restored row counts do not match the dump.")
+        self.stdout.write(self.style.SUCCESS(
+            "Restore complete. Rebuild the vote rollups with fold_vote_rollups --full."
+        ))
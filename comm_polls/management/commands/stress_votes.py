@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from comm_polls.stress import check_vote_counters, fire_votes, prepare_stress_poll
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire concurrent votes at a running server and verify that "
+        "Choice.votes_count still matches the stored Vote rows. The server "
+        "must use the same database as this command (SQLite or PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the live server.')
+        parser.add_argument('--voters', type=int, default=2000)
+        parser.add_argument('--choices', type=int, default=4)
+        parser.add_argument('--workers', type=int, default=32)
+        parser.add_argument(
+            '--mode', choices=['thread', 'process', 'both'], default='both',
+            help='Submit from a thread pool, a process pool, or one after the other.',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=2,
+            help='Times each voter submits; values above 1 race duplicate submissions.',
+        )
+
+    def handle(self, *args, **options):
+        modes = ['thread', 'process'] if options['mode'] == 'both' else [options['mode']]
+        failed = False
+
+        for mode in modes:
+            poll, jobs = prepare_stress_poll(options['voters'], choices=options['choices'])
+            self.stdout.write(f"[{mode}] {len(jobs)} voters x{options['repeat']} on poll {poll.id}")
+
+            statuses, elapsed = fire_votes(
+                options['url'], poll.id, jobs,
+                workers=options['workers'], mode=mode, repeat=options['repeat'],
+            )
+            report = check_vote_counters(polls=[poll])
+            rate = report['stored'] / elapsed if elapsed else 0.0
+
+            self.stdout.write(f"  responses: {dict(sorted(statuses.items()))}")
+            self.stdout.write(f"  stored votes: {report['stored']}, counted votes: {report['counted']}")
+            self.stdout.write(f"  sustained: {rate:.1f} votes/s over {elapsed:.2f}s")
+
+            if report['ok'] and report['stored'] == len(jobs):
+                self.stdout.write(self.style.SUCCESS('  counters consistent'))
+            else:
+                failed = True
+                self.stdout.write(self.style.ERROR(
+                    f"  inconsistent: drifted polls {report['drifted_polls']}, "
+                    f"duplicate ballots {report['duplicates'][:10]}"
+                ))
+
+        if failed:
+            raise CommandError('Vote counters did not survive concurrent load.')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from comm_polls.bitmaps import bitmap_stats, build_bitmap
+from comm_polls.models import Poll
+
+
+class Command(BaseCommand):
+    help = "Report the memory used by cached voter bitmaps, optionally warming them first."
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int, help='Polls to report (default: active polls).')
+        parser.add_argument('--warm', action='store_true', help='Rebuild the bitmaps from Vote before reporting.')
+
+    def handle(self, *args, **options):
+        poll_ids = options['poll_ids']
+        if not poll_ids:
+            now = timezone.now()
+            poll_ids = list(
+                Poll.objects.filter(start_date__lte=now, end_date__gte=now).values_list('id', flat=True)
+            )
+        if options['warm']:
+            for poll_id in poll_ids:
+                build_bitmap(poll_id)
+
+        total = 0
+        for poll_id, voters, nbytes in bitmap_stats(poll_ids):
+            if nbytes is None:
+                self.stdout.write(f"poll {poll_id}: over budget, served from the database")
+                continue
+            total += nbytes
+            self.stdout.write(f"poll {poll_id}: {voters} voters, {nbytes} bytes")
+        self.stdout.write(self.style.SUCCESS(f"{total} bytes cached across {len(poll_ids)} polls."))
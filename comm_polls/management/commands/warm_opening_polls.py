@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from comm_polls.opening import polls_opening_within, warm_poll
+
+
+class Command(BaseCommand):
+    help = (
+        "Cache the vote form and voter bitmap of polls opening soon. "
+        "Run every minute or two from cron ahead of big announcements."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--within', type=int, default=600, help='Seconds ahead to look (default 600).')
+
+    def handle(self, *args, **options):
+        polls = list(polls_opening_within(options['within']))
+        for poll in polls:
+            warm_poll(poll)
+            self.stdout.write(f"poll {poll.pk}: warmed, opens {poll.start_date.isoformat()}")
+        self.stdout.write(self.style.SUCCESS(f"Warmed {len(polls)} polls."))
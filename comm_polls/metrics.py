@@ -0,0 +1,237 @@
+"""
+Application metrics in the Prometheus text exposition format.
+
+Every gunicorn worker keeps its counters and histograms in memory and
+writes them to METRICS_DIR/<pid>.json, at most once per
+METRICS_FLUSH_INTERVAL seconds and at exit (written to a temporary file and
+renamed, so readers never see half a file). The /metrics view adds up the
+files of all workers. Files of workers that have exited are folded into
+retired.json and deleted, under an flock held for the whole scrape so each
+file is counted once; counters keep growing across worker restarts while
+the directory holds one file per live worker. Prometheus treats the drop
+caused by a reused pid as a reset.
+Gauges such as active polls are computed from the database at scrape time.
+"""
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'commpolls_http_request_duration_seconds': ('histogram', 'Request latency by URL name.'),
+    'commpolls_votes_total': ('counter', 'Ballots by outcome and entry point.'),
+    'commpolls_db_queries_total': ('counter', 'Database queries run by requests, by URL name.'),
+    'commpolls_db_query_duration_seconds_total': ('counter', 'Time spent in database queries, by URL name.'),
+    'commpolls_cache_requests_total': ('counter', 'Application cache lookups by cache and result.'),
+    'commpolls_cache_hit_ratio': ('gauge', 'Share of application cache lookups that hit.'),
+    'commpolls_admissions_total': ('counter', 'Vote page renders admitted at once or sent to the waiting room.'),
+    'commpolls_rate_limited_total': ('counter', 'Requests refused with 429 by the rate limiter, by URL name.'),
+    'commpolls_active_polls': ('gauge', 'Polls currently open for voting.'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_state = {'dirty': False, 'flushed_at': 0.0}
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'commpolls-metrics')
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+        _state['dirty'] = True
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        # One slot per bucket plus +Inf, then the running sum.
+        series = _histograms.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 2))
+        series[bisect_left(LATENCY_BUCKETS, value)] += 1
+        series[-1] += value
+        _state['dirty'] = True
+
+
+def _dump(counters, histograms):
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), series] for (name, labels), series in histograms.items()],
+    }
+
+
+def flush(force=False):
+    """Write this process's metrics to its file if they changed recently."""
+    now = time.monotonic()
+    with _lock:
+        if not _state['dirty'] or (
+            not force and now - _state['flushed_at'] < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+        ):
+            return
+        data = _dump(_counters, _histograms)
+        _state['dirty'] = False
+        _state['flushed_at'] = now
+    directory = metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w') as fh:
+        json.dump(data, fh)
+    os.replace(f'{path}.tmp', path)
+
+
+atexit.register(flush, force=True)
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(counters, histograms, data):
+    for name, labels, value in data['counters']:
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, series in data['histograms']:
+        total = histograms.setdefault(_key(name, labels), [0] * len(series))
+        for index, value in enumerate(series):
+            total[index] += value
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, run by another user
+    return True
+
+
+def retire_dead_workers(directory):
+    """Fold the files of exited workers into retired.json and delete them.
+
+    The caller holds the lock on retire.lock.
+    """
+    dead = [
+        filename for filename in os.listdir(directory)
+        if filename.endswith('.json') and filename[:-5].isdigit() and not _alive(int(filename[:-5]))
+    ]
+    if not dead:
+        return
+    path = os.path.join(directory, 'retired.json')
+    counters, histograms = {}, {}
+    for data in [_read(path)] + [_read(os.path.join(directory, filename)) for filename in dead]:
+        if data is not None:
+            _add(counters, histograms, data)
+    with open(f'{path}.tmp', 'w') as fh:
+        json.dump(_dump(counters, histograms), fh)
+    os.replace(f'{path}.tmp', path)
+    for filename in dead:
+        os.remove(os.path.join(directory, filename))
+
+
+def collect():
+    """Sum the counters and histograms written by every worker."""
+    flush(force=True)
+    counters, histograms = {}, {}
+    directory = metrics_dir()
+    if not os.path.isdir(directory):
+        return counters, histograms
+    with open(os.path.join(directory, 'retire.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retire_dead_workers(directory)
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                data = _read(os.path.join(directory, filename))
+                if data is not None:
+                    _add(counters, histograms, data)
+    return counters, histograms
+    retire_dead_workers(directory)
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            data = _read(os.path.join(directory, filename))
+            if data is not None:
+                _add(counters, histograms, data)
+    return counters, histograms
+
+
+def _series(name, labels, value):
+    label_text = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels
+    )
+    return f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}'
+
+
+def render(gauges=()):
+    """
+    Return the exposition text for all workers. gauges is an iterable of
+    (name, labels dict, value) computed by the caller at scrape time.
+    """
+    counters, histograms = collect()
+    samples = {}
+    for (name, labels), value in sorted(counters.items()):
+        samples.setdefault(name, []).append(_series(name, labels, value))
+    for (name, labels), series in sorted(histograms.items()):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), series):
+            cumulative += count
+            lines.append(_series(f'{name}_bucket', labels + (('le', str(bound)),), cumulative))
+        lines.append(_series(f'{name}_sum', labels, series[-1]))
+        lines.append(_series(f'{name}_count', labels, cumulative))
+
+    cache_lookups = {}
+    for (name, labels), value in counters.items():
+        if name == 'commpolls_cache_requests_total':
+            labels = dict(labels)
+            hits, total = cache_lookups.get(labels['cache'], (0, 0))
+            cache_lookups[labels['cache']] = (hits + value * (labels['result'] == 'hit'), total + value)
+    for cache_name, (hits, total) in sorted(cache_lookups.items()):
+        samples.setdefault('commpolls_cache_hit_ratio', []).append(
+            _series('commpolls_cache_hit_ratio', (('cache', cache_name),), hits / total)
+        )
+    for name, labels, value in gauges:
+        samples.setdefault(name, []).append(_series(name, tuple(sorted(labels.items())), value))
+
+    out = []
+    for name, lines in samples.items():
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        out.append(f'# HELP {name} {help_text}')
+        out.append(f'# TYPE {name} {kind}')
+        out.extend(lines)
+    return '\n'.join(out) + '\n'
+
+
+class QueryTimer:
+    """connection.execute_wrapper hook counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
@@ -0,0 +1,86 @@
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+from . import compression, metrics, profiling
+from .hashers import HashingBusy
+
+
+class HashingBusyMiddleware:
+    """Turn a full password hashing pool into a 503 the client can retry."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, HashingBusy):
+            return None
+        response = HttpResponse(
+            "Too many sign-ins are being processed right now. Please try again in a moment.",
+            status=503,
+            content_type='text/plain',
+        )
+        response['Retry-After'] = str(getattr(settings, 'PASSWORD_HASHING_RETRY_AFTER', 2))
+        return response
+
+
+class CompressionMiddleware:
+    """Brotli/gzip responses and serve public ones by URL (see comm_polls/compression.py)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if request.method == 'GET':
+            response = compression.cached_page(request, encoding)
+            if response is not None:
+                return response
+        return compression.compress_response(request, self.get_response(request), encoding)
+
+
+class MetricsMiddleware:
+    """Record latency and database work per URL name (see comm_polls/metrics.py)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = metrics.QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.observe('commpolls_http_request_duration_seconds', elapsed, view=view, method=request.method)
+        metrics.inc('commpolls_db_queries_total', queries.count, view=view)
+        metrics.inc('commpolls_db_query_duration_seconds_total', queries.seconds, view=view)
+        metrics.flush()
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile requests that ask for it (see comm_polls/profiling.py). Needs request.user."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (profiling.QUERY_FLAG in request.GET or profiling.HEADER in request.META) and self.allowed(request):
+            return profiling.profile_request(self.get_response, request)
+        return self.get_response(request)
+
+    def allowed(self, request):
+        if request.GET.get(profiling.QUERY_FLAG) and request.user.is_staff:
+            return True
+        token = request.META.get(profiling.HEADER)
+        return bool(token) and profiling.token_is_valid(
+            token, getattr(settings, 'REQUEST_PROFILE_TOKEN_MAX_AGE', 3600)
+        )
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.25 on 2026-10-19 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comm_polls', '0010_alter_profile_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='voted_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.25 on 2026-10-19 13:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('comm_polls', '0011_vote_voted_at_index_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserVoteArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('polls', models.BinaryField(default=bytes)),
+                ('choices', models.BinaryField(default=bytes)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='vote_archive', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PollVoteArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vote_count', models.IntegerField(default=0)),
+                ('voters', models.BinaryField()),
+                ('choices', models.BinaryField()),
+                ('voted_at', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='vote_archive', to='comm_polls.poll')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.25 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comm_polls', '0012_vote_archives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.25 on 2026-10-19 14:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comm_polls', '0014_request_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_rollups', to='comm_polls.poll')),
+            ],
+            options={
+                'unique_together': {('poll', 'resolution', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-19 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comm_polls', '0015_vote_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='kind',
+            field=models.CharField(choices=[('single', 'Single choice'), ('ranked', 'Ranked choice')], default='single', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='ranking',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
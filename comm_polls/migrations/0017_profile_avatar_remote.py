@@ -0,0 +1,18 @@
+# Generated by Django 4.2.25 on 2026-10-19 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comm_polls', '0016_ranked_polls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_remote',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,16 +1,34 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver 
 from django.utils import timezone
 
+class VisiblePollManager(models.Manager):
+    """Hides polls that were deleted and are waiting for their votes to be purged."""
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Poll(models.Model):
+    SINGLE, RANKED = 'single', 'ranked'
+    KIND_CHOICES = [(SINGLE, 'Single choice'), (RANKED, 'Ranked choice')]
+
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="created_polls")
     created_at = models.DateTimeField(auto_now_add=True)
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    kind = models.CharField(max_length=6, choices=KIND_CHOICES, default=SINGLE)
+
+    objects = VisiblePollManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.name
@@ -31,10 +49,18 @@ class Poll(models.Model):
         """Returns True if poll end date passed"""
         return timezone.now() > self.end_date
 
+    @property
+    def is_ranked(self):
+        """Returns True if voters rank the choices (see comm_polls/ranked.py)"""
+        return self.kind == self.RANKED
+
     @property
     def total_votes(self):
-        """Returns the total number of votes for this poll."""
-        return self.poll_votes.count()
+        """Returns the total number of votes for this poll, archived ones included."""
+        count = self.poll_votes.count()
+        if not count and self.has_ended:
+            count = PollVoteArchive.objects.filter(poll=self).values_list('vote_count', flat=True).first() or 0
+        return count
 
 
 class Choice(models.Model):
@@ -50,7 +76,10 @@ class Vote(models.Model):
     poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name="poll_votes")
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name="choice_votes")
     voter = models.ForeignKey(User, on_delete=models.CASCADE, related_name="user_votes")
-    voted_at = models.DateTimeField(auto_now_add=True)
+    voted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Ranked polls only: choice ids in order of preference, packed as
+    # little-endian int64. `choice` is the first preference.
+    ranking = models.BinaryField(null=True, blank=True)
 
     class Meta:
         unique_together = ("poll", "voter")
@@ -59,6 +88,104 @@ class Vote(models.Model):
         return f"{self.voter} voted on {self.poll}"
 
 
+class PollVoteArchive(models.Model):
+    """
+    Ballots of a long-ended poll, moved out of Vote into packed arrays.
+
+    voters, choices and voted_at are aligned little-endian int64 arrays
+    (voted_at in epoch microseconds), sorted by voter id.
+    """
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, related_name="vote_archive")
+    vote_count = models.IntegerField(default=0)
+    voters = models.BinaryField()
+    choices = models.BinaryField()
+    voted_at = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived votes of {self.poll}"
+
+
+class UserVoteArchive(models.Model):
+    """Per-user index of archived ballots: aligned int64 poll and choice ids."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="vote_archive")
+    polls = models.BinaryField(default=bytes)
+    choices = models.BinaryField(default=bytes)
+
+    def __str__(self):
+        return f"Archived votes of {self.user}"
+
+
+class Watermark(models.Model):
+    """Last processed position of an incremental background job."""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+
+class VoteRollup(models.Model):
+    """Votes a poll received in one minute, hour or day (see comm_polls/rollups.py)."""
+    MINUTE, HOUR, DAY = 'minute', 'hour', 'day'
+    RESOLUTION_CHOICES = [(MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day')]
+
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name="vote_rollups")
+    resolution = models.CharField(max_length=6, choices=RESOLUTION_CHOICES)
+    # Start of the bucket, in UTC.
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("poll", "resolution", "bucket")
+
+    def __str__(self):
+        return f"{self.poll} {self.resolution} {self.bucket:%Y-%m-%d %H:%M}: {self.count}"
+
+
+class RequestProfileStorage(FileSystemStorage):
+    """
+    Profiles stay on local disk under REQUEST_PROFILE_DIR, outside MEDIA_ROOT,
+    and are only served through the admin. The directory is read on each use
+    rather than fixed when the model is loaded.
+    """
+    @property
+    def base_location(self):
+        return settings.REQUEST_PROFILE_DIR
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+def request_profile_storage():
+    return RequestProfileStorage()
+
+
+class RequestProfile(models.Model):
+    """A single request run under the sampling profiler (see comm_polls/profiling.py)."""
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='request_profiles')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2000)
+    url_name = models.CharField(max_length=200, blank=True, db_index=True)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_ms = models.FloatField()
+    samples = models.PositiveIntegerField()
+    # Folded stacks ("frame;frame;frame count" per line), as read by
+    # flamegraph.pl, speedscope and inferno.
+    folded = models.FileField(storage=request_profile_storage, upload_to='%Y/%m/%d/')
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.url_name or self.path} ({self.duration_ms:.0f} ms)"
+
+
 class ManagerRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -76,12 +203,20 @@ class ManagerRequest(models.Model):
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # Set once the avatar was moved to the remote storage (see comm_polls/avatars.py).
+    avatar_remote = models.BooleanField(default=False, editable=False)
 
     def __str__(self):
         return f"{self.user.username}'s profile"
 
+    @property
+    def avatar_url(self):
+        from .avatars import avatar_url
+        return avatar_url(self)
+
 @receiver(post_save, sender=User)
-def manage_user_profile(sender, instance, created, **kwargs):
-    if created:
+def create_user_profile(sender, instance, created, raw=False, **kwargs):
+    """Create the profile once, with the user. Later user saves (e.g. last_login) leave it alone."""
+    if created and not raw:
         Profile.objects.create(user=instance)
-    instance.profile.save()
+
@@ -0,0 +1,126 @@
+"""
+Poll openings.
+
+A scheduled poll draws every countdown viewer to its vote page in the same
+second. Three things soften that spike:
+
+* countdown.js waits a random 0..POLL_OPENING_JITTER_MS before leaving the
+  countdown, spreading the burst over a few seconds;
+* the poll's choice list is rendered once and kept in the cache; it is
+  warmed, together with the voter bitmap, by countdown views in the last
+  POLL_OPENING_WARM_SECONDS and by the warm_opening_polls command;
+* admission_controlled lets at most VOTE_ADMISSION_SLOTS vote pages render
+  at once per process (by default one less than its WEB_THREADS, so pages
+  queue while a thread stays free for ballots). Further requests queue for
+  up to VOTE_ADMISSION_WAIT seconds, then get a waiting room page that
+  retries on its own after a randomised Retry-After, instead of an error.
+"""
+import random
+import threading
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import bitmaps, metrics
+from .models import Poll
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def choice_list_key(poll_id):
+    return f'vote_choices:{poll_id}'
+
+
+def get_choice_list(poll):
+    """The rendered choices of a poll's vote form, from the cache when possible."""
+    html = cache.get(choice_list_key(poll.pk))
+    metrics.inc('commpolls_cache_requests_total', cache='vote_choices', result='miss' if html is None else 'hit')
+    if html is None:
+        template = 'comm_polls/_ranking_list.html' if poll.is_ranked else 'comm_polls/_choice_list.html'
+        html = render_to_string(template, {'choices': poll.choices.order_by('pk')})
+        # Kept until the poll closes, within a day; edits to choices drop it.
+        remaining = (poll.end_date - timezone.now()).total_seconds()
+        cache.set(choice_list_key(poll.pk), html, max(60, min(remaining, 24 * 3600)))
+    return html
+
+
+def forget_choice_lists(poll_ids):
+    cache.delete_many([choice_list_key(poll_id) for poll_id in poll_ids])
+
+
+def warm_poll(poll):
+    """Prepare what the vote page of a poll about to open needs."""
+    get_choice_list(poll)
+    bitmaps.get_bitmap(poll.pk)
+
+
+def opens_soon(poll):
+    until_start = (poll.start_date - timezone.now()).total_seconds()
+    return 0 < until_start <= getattr(settings, 'POLL_OPENING_WARM_SECONDS', 300)
+
+
+def polls_opening_within(seconds):
+    now = timezone.now()
+    return Poll.objects.filter(start_date__gt=now, start_date__lte=now + timedelta(seconds=seconds))
+
+
+class AdmissionGate:
+    def __init__(self, slots):
+        self.slots = slots
+        self._semaphore = threading.BoundedSemaphore(slots)
+
+    def acquire(self, timeout):
+        return self._semaphore.acquire(timeout=timeout)
+
+    def release(self):
+        self._semaphore.release()
+
+
+def admission_slots():
+    return getattr(settings, 'VOTE_ADMISSION_SLOTS', None) or max(1, getattr(settings, 'WEB_THREADS', 1) - 1)
+
+
+def get_gate():
+    global _gate
+    slots = admission_slots()
+    with _gate_lock:
+        if _gate is None or _gate.slots != slots:
+            _gate = AdmissionGate(slots)
+        return _gate
+
+
+def waiting_room(request):
+    retry_after = random.randint(1, getattr(settings, 'VOTE_ADMISSION_RETRY_MAX', 5))
+    response = render(request, 'comm_polls/waiting_room.html', {
+        'retry_after': retry_after,
+        'retry_url': request.get_full_path(),
+    }, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_controlled(view):
+    """
+    Queue vote page renders beyond VOTE_ADMISSION_SLOTS. Ballot submissions
+    (POST) are never held back, so a chosen answer is not lost.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+        gate = get_gate()
+        if not gate.acquire(getattr(settings, 'VOTE_ADMISSION_WAIT', 2)):
+            metrics.inc('commpolls_admissions_total', result='deferred')
+            return waiting_room(request)
+        metrics.inc('commpolls_admissions_total', result='admitted')
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            gate.release()
+    return wrapper
@@ -0,0 +1,60 @@
+"""
+Read-through cache of poll rows for the poll pages.
+
+The vote, results, countdown, manage and results API views all start by
+loading their Poll, whose name, window and owner rarely change. The row is
+kept in the cache for POLL_CACHE_TIMEOUT seconds and dropped whenever a
+poll is saved or deleted (signals.py) or hidden (purge.hide_polls), so a
+closed or edited poll is seen by the next request. That only holds for a
+cache every worker shares (CACHE_IS_SHARED): a per-process cache is only
+cleared in the process that made the change, so there rows are kept for
+POLL_CACHE_LOCAL_TIMEOUT seconds, just long enough to absorb a burst on
+one poll. is_active, has_started and has_ended are computed from the
+cached dates at each call, so they stay exact while the row is cached.
+
+Hidden polls are never cached, and missing ids are not remembered: a 404
+costs its query every time.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from . import metrics
+from .models import Poll
+
+
+def poll_key(poll_id):
+    return f'poll:{poll_id}'
+
+
+def _timeout():
+    if getattr(settings, 'CACHE_IS_SHARED', False):
+        return getattr(settings, 'POLL_CACHE_TIMEOUT', 300)
+    return getattr(settings, 'POLL_CACHE_LOCAL_TIMEOUT', 5)
+
+
+def get_poll(poll_id):
+    """The visible poll with this id, from the cache when possible, else None."""
+    try:
+        poll_id = int(poll_id)
+    except (TypeError, ValueError):
+        return None
+    poll = cache.get(poll_key(poll_id))
+    metrics.inc('commpolls_cache_requests_total', cache='poll', result='miss' if poll is None else 'hit')
+    if poll is None:
+        poll = Poll.objects.filter(pk=poll_id).first()
+        if poll is not None:
+            cache.set(poll_key(poll_id), poll, _timeout())
+    return poll
+
+
+def get_poll_or_404(poll_id, created_by=None):
+    """get_object_or_404(Poll, id=poll_id[, created_by=...]) through the cache."""
+    poll = get_poll(poll_id)
+    if poll is None or (created_by is not None and poll.created_by_id != created_by.pk):
+        raise Http404('No Poll matches the given query.')
+    return poll
+
+
+def forget_polls(poll_ids):
+    cache.delete_many([poll_key(poll_id) for poll_id in poll_ids])
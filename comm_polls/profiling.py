@@ -0,0 +1,120 @@
+"""
+On-demand sampling profiler for single requests.
+
+A request is profiled when a staff user adds ?_profile=1 to the URL, or when
+it carries an X-Profile-Token header made by the profile_token command
+(for curl and scripts that have no staff session). A background thread
+then samples the request thread's stack every REQUEST_PROFILE_INTERVAL
+seconds, and the counts are saved as a folded-stacks file with a
+RequestProfile row (URL name, timing and query stats) listed in the admin.
+
+Other requests only pay for the checks in ProfilingMiddleware: a lookup in
+the query string and one in the headers.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.db import connection
+
+from .metrics import QueryTimer
+from .models import RequestProfile
+
+QUERY_FLAG = '_profile'
+HEADER = 'HTTP_X_PROFILE_TOKEN'
+TOKEN_SALT = 'comm_polls.profiling'
+
+
+def make_token():
+    return signing.dumps('profile', salt=TOKEN_SALT)
+
+
+def token_is_valid(token, max_age):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=max_age) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', code.co_filename)
+    return f"{module}:{code.co_name}".replace(';', ':')
+
+
+class SamplingProfiler:
+    """Counts the stacks of one thread, sampled from a helper thread."""
+
+    def __init__(self, thread_id, interval, max_seconds):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def save_profile(request, response, profiler, elapsed, queries):
+    match = request.resolver_match
+    profile = RequestProfile(
+        user=request.user if request.user.is_authenticated else None,
+        method=request.method,
+        path=request.get_full_path()[:2000],
+        url_name=match.view_name if match else '',
+        status_code=response.status_code,
+        duration_ms=elapsed * 1000,
+        query_count=queries.count,
+        query_ms=queries.seconds * 1000,
+        samples=profiler.samples,
+    )
+    name = f"{(profile.url_name or 'unmatched').replace(':', '-')}.folded"
+    profile.folded.save(name, ContentFile(profiler.folded().encode()), save=False)
+    profile.save()
+    return profile
+
+
+def profile_request(get_response, request):
+    """Run the rest of the stack under the profiler and store the result."""
+    queries = QueryTimer()
+    profiler = SamplingProfiler(
+        threading.get_ident(),
+        getattr(settings, 'REQUEST_PROFILE_INTERVAL', 0.002),
+        getattr(settings, 'REQUEST_PROFILE_MAX_SECONDS', 30),
+    )
+    start = time.perf_counter()
+    with profiler, connection.execute_wrapper(queries):
+        response = get_response(request)
+    elapsed = time.perf_counter() - start
+    profile = save_profile(request, response, profiler, elapsed, queries)
+    response['X-Profile-Id'] = str(profile.pk)
+    return response
@@ -0,0 +1,81 @@
+"""
+Deletion of polls without loading their ballots.
+
+poll.delete() makes Django's collector fetch every related Vote and Choice
+to emulate ON DELETE CASCADE, which stalls the worker on large polls.
+Instead a poll is hidden at once (deleted_at is set, so the default manager
+stops returning it) and its rows are removed afterwards in bounded chunks,
+either on a background thread once the hiding transaction commits or by
+the purge_deleted_polls command.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from .compression import forget_page
+from .models import Choice, Poll, Vote
+from .pollcache import forget_polls
+from .tallies import forget_tallies
+
+logger = logging.getLogger(__name__)
+
+
+def hide_polls(polls):
+    """Hide the polls immediately and schedule the purge of their rows."""
+    poll_ids = [poll.pk for poll in polls]
+    Poll.all_objects.filter(pk__in=poll_ids).update(deleted_at=timezone.now())
+    forget_polls(poll_ids)
+    forget_tallies(poll_ids)
+    for poll_id in poll_ids:
+        forget_page(reverse('comm_polls:poll_results_api', args=[poll_id]))
+    transaction.on_commit(lambda: schedule_purge(poll_ids))
+
+
+def schedule_purge(poll_ids):
+    if getattr(settings, 'POLL_PURGE_IN_BACKGROUND', True):
+        threading.Thread(target=_purge_in_background, args=(poll_ids,), daemon=True).start()
+    else:
+        purge_polls(poll_ids)
+
+
+def _purge_in_background(poll_ids):
+    try:
+        purge_polls(poll_ids)
+    except Exception:
+        # purge_deleted_polls picks up whatever is left over.
+        logger.exception("Background purge of polls %s failed", poll_ids)
+    finally:
+        close_old_connections()
+
+
+def _delete_in_chunks(queryset, chunk_size):
+    """Delete rows by primary key, at most chunk_size per statement."""
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        # Vote has no dependents or delete signals, so this is a single
+        # DELETE ... WHERE id IN (...) without fetching the rows.
+        deleted += queryset.model.objects.filter(pk__in=ids).delete()[0]
+
+
+def purge_polls(poll_ids, chunk_size=None):
+    """Remove hidden polls, their votes and their choices, chunk by chunk."""
+    chunk_size = chunk_size or getattr(settings, 'POLL_PURGE_CHUNK_SIZE', 5000)
+    deleted = 0
+    for poll_id in Poll.all_objects.filter(pk__in=poll_ids, deleted_at__isnull=False).values_list('pk', flat=True):
+        deleted += _delete_in_chunks(Vote.objects.filter(poll_id=poll_id), chunk_size)
+        deleted += _delete_in_chunks(Choice.objects.filter(poll_id=poll_id), chunk_size)
+        deleted += Poll.all_objects.filter(pk=poll_id).delete()[0]
+    return deleted
+
+
+def purge_deleted_polls(chunk_size=None):
+    """Sweep every hidden poll, e.g. after a worker died mid-purge."""
+    poll_ids = list(Poll.all_objects.filter(deleted_at__isnull=False).values_list('pk', flat=True))
+    return poll_ids, purge_polls(poll_ids, chunk_size)
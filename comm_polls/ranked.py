@@ -0,0 +1,197 @@
+"""
+Ranked-choice polls and their instant-runoff tally.
+
+A ranked ballot stores the voter's choice ids in order of preference in
+Vote.ranking, packed like the archives (little-endian int64); Vote.choice
+holds the first preference, so counters, bitmaps and the one-vote-per-poll
+constraint work as for single-choice polls.
+
+The tally loads every ranking of a poll into one (ballots x depth) matrix
+of candidate indexes, padded with -1, and runs the elimination rounds on
+whole arrays: each ballot's current top candidate is kept in a vector,
+a round's counts are one bincount, and after an elimination only the
+ballots whose top candidate was eliminated look for their next active
+preference. A poll with 1M ballots and 20 candidates tallies in seconds.
+
+Results are cached for RANKED_RESULTS_LIVE_TIMEOUT seconds while the poll
+is open and RANKED_RESULTS_TIMEOUT seconds once it has ended. Saving the
+poll drops the entry (the bulk ballot API takes no ranked ballots); a vote
+changed in the admin shows after the timeout, as a Vote delete receiver
+would keep Django from deleting votes in bulk. On a miss one request
+tallies under a cache.add() lock and the others wait for its result
+rather than tallying the same ballots at once.
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .archive import pack
+from .models import Vote
+
+
+def results_key(poll_id):
+    return f'ranked_results:{poll_id}'
+
+
+def parse_ranking(choice_ids, data):
+    """
+    Choice ids in order of preference from rank_<choice id> form fields.
+    Unranked choices are left out; ranks must be distinct positive numbers.
+    """
+    ranks = {}
+    for choice_id in choice_ids:
+        value = data.get(f'rank_{choice_id}', '').strip()
+        if value:
+            rank = int(value)
+            if rank < 1:
+                raise ValueError('Ranks start at 1.')
+            ranks[choice_id] = rank
+    if not ranks:
+        raise ValueError('No choice was ranked.')
+    if len(set(ranks.values())) != len(ranks):
+        raise ValueError('Two choices have the same rank.')
+    return sorted(ranks, key=ranks.get)
+
+
+def ballot_matrix(rankings, candidates):
+    """
+    (ballots x depth) int32 matrix of indexes into the sorted `candidates`
+    id array from packed rankings, padded with -1. Unknown ids become -1.
+    """
+    rankings = list(rankings)
+    lengths = np.fromiter((len(ranking) // 8 for ranking in rankings), dtype=np.int64, count=len(rankings))
+    depth = int(lengths.max()) if len(lengths) else 0
+    matrix = np.full((len(rankings), max(depth, 1)), -1, dtype=np.int32)
+    if not depth:
+        return matrix
+    flat = np.frombuffer(b''.join(rankings), dtype='<i8')
+    positions = np.minimum(np.searchsorted(candidates, flat), len(candidates) - 1)
+    indexes = np.where(candidates[positions] == flat, positions, -1)
+    rows = np.repeat(np.arange(len(rankings)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    columns = np.arange(len(flat)) - np.repeat(starts, lengths)
+    matrix[rows, columns] = indexes
+    return matrix
+
+
+def instant_runoff(matrix, candidate_count):
+    """
+    Tally a ballot matrix. Returns {'rounds': [...], 'winner': index or None};
+    each round has 'counts' (one per candidate, None once eliminated),
+    'exhausted' (ballots with no active preference left) and 'eliminated'.
+
+    Ties for last place go to the candidate with fewer first preferences,
+    then to the one listed first.
+    """
+    # The extra slot is always inactive, so -1 padding never counts.
+    active = np.ones(candidate_count + 1, dtype=bool)
+    active[candidate_count] = False
+    top = np.full(len(matrix), -1, dtype=np.int64)
+
+    def advance(rows):
+        ranked = matrix[rows]
+        usable = active[ranked]
+        first = usable.argmax(axis=1)
+        top[rows] = np.where(usable.any(axis=1), ranked[np.arange(len(rows)), first], -1)
+
+    advance(np.arange(len(matrix)))
+    first_preferences = None
+    rounds = []
+    winner = None
+    while True:
+        live = top >= 0
+        counts = np.bincount(top[live], minlength=candidate_count)
+        if first_preferences is None:
+            first_preferences = counts
+        remaining = np.flatnonzero(active[:candidate_count])
+        round_ = {
+            'counts': [int(counts[i]) if active[i] else None for i in range(candidate_count)],
+            'exhausted': int(len(matrix) - live.sum()),
+            'eliminated': None,
+        }
+        rounds.append(round_)
+        continuing = int(live.sum())
+        if not continuing or not len(remaining):
+            break
+        leader = remaining[counts[remaining].argmax()]
+        if counts[leader] * 2 > continuing or len(remaining) == 1:
+            winner = int(leader)
+            break
+        order = np.lexsort((remaining, first_preferences[remaining], counts[remaining]))
+        lowest = int(remaining[order[0]])
+        round_['eliminated'] = lowest
+        active[lowest] = False
+        advance(np.flatnonzero(top == lowest))
+    return {'rounds': rounds, 'winner': winner}
+
+
+def tally_poll(poll):
+    """Instant-runoff result of a poll, with choice ids in place of indexes."""
+    candidates = np.array(sorted(poll.choices.values_list('id', flat=True)), dtype=np.int64)
+    ballots = Vote.objects.filter(poll=poll).values_list('ranking', 'choice_id').order_by().iterator(chunk_size=10000)
+    # A ballot without a ranking counts as a ranking of its single choice.
+    matrix = ballot_matrix((bytes(ranking) if ranking else pack([choice_id]) for ranking, choice_id in ballots), candidates)
+    result = instant_runoff(matrix, len(candidates))
+    ids = candidates.tolist()
+    return {
+        'ballots': len(matrix),
+        'winner': None if result['winner'] is None else ids[result['winner']],
+        'rounds': [
+            {
+                'counts': {ids[i]: count for i, count in enumerate(round_['counts']) if count is not None},
+                'exhausted': round_['exhausted'],
+                'eliminated': None if round_['eliminated'] is None else ids[round_['eliminated']],
+            }
+            for round_ in result['rounds']
+        ],
+    }
+
+
+def ranked_results(poll):
+    """
+    tally_poll() through the cache. While another request holds the tally
+    lock, wait up to RANKED_RESULTS_WAIT seconds for its result before
+    tallying here as well.
+    """
+    key = results_key(poll.pk)
+    result = cache.get(key)
+    if result is not None:
+        return result
+    wait = getattr(settings, 'RANKED_RESULTS_WAIT', 10)
+    locked = cache.add(f'{key}:tallying', True, wait)
+    if not locked:
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            result = cache.get(key)
+            if result is not None:
+                return result
+    try:
+        result = tally_poll(poll)
+        if poll.has_ended:
+            timeout = getattr(settings, 'RANKED_RESULTS_TIMEOUT', 3600)
+        else:
+            timeout = getattr(settings, 'RANKED_RESULTS_LIVE_TIMEOUT', 30)
+        cache.set(key, result, timeout)
+    finally:
+        if locked:
+            cache.delete(f'{key}:tallying')
+    return result
+
+
+def forget_ranked_results(poll_ids):
+    cache.delete_many([results_key(poll_id) for poll_id in poll_ids])
+
+
+def round_table(result, choices):
+    """Rows of the results page: one per choice, with its count in every round."""
+    return [
+        {
+            'name': choice.name,
+            'counts': [round_['counts'].get(choice.id) for round_ in result['rounds']],
+            'winner': choice.id == result['winner'],
+        }
+        for choice in sorted(choices, key=lambda choice: -(result['rounds'][0]['counts'].get(choice.id) or 0))
+    ] if result['rounds'] else []
@@ -0,0 +1,191 @@
+"""
+Token-bucket rate limiting for views, configured per URL name.
+
+RATE_LIMITS maps URL names to "<count>/<s|m|h|d>": a bucket of <count>
+tokens that refills evenly over the period, so short bursts are allowed up
+to <count> requests. Buckets are kept per signed-in user (the id is read
+from the session, without loading the User) or per client IP, in a
+fixed-size table in one memory-mapped file (RATELIMIT_STORE, in /dev/shm
+by default) shared by every worker on the host. A key hashes to a set of
+SLOT_WAYS slots and takes the slot holding it, else the one idle longest,
+so a lookup touches a few dozen bytes however many clients there are. A
+bucket that is pushed out was usually full already; otherwise its client
+starts over with a full bucket. Each read-modify-write of a set runs under
+an flock on one of a fixed set of lock files, so concurrent workers cannot
+both spend the last token.
+
+Limited requests get a 429 with Retry-After before the view, or any
+decorator below this one, runs.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+LOCK_STRIPES = 64
+SLOT_WAYS = 4
+# Key hash (0: empty), tokens, time of the last request.
+SLOT = struct.Struct('<Qdd')
+
+_lock_files = {}
+_tables = {}
+_thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+_lock_files_lock = threading.Lock()
+
+
+def parse_rate(rate):
+    """'20/m' -> (capacity 20, 20/60 tokens per second)."""
+    count, _, period = rate.partition('/')
+    try:
+        capacity = int(count)
+        seconds = PERIODS[period]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate {rate!r}; expected e.g. '20/m'.")
+    return capacity, capacity / seconds
+
+
+def client_key(request):
+    user_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+    if user_id:
+        return f'user:{user_id}'
+    header = getattr(settings, 'RATELIMIT_IP_HEADER', None)
+    address = (header and request.META.get(header)) or request.META.get('REMOTE_ADDR', '')
+    return f'ip:{address}'
+
+
+def _lock_file(stripe):
+    directory = os.fspath(settings.RATELIMIT_LOCK_DIR)
+    with _lock_files_lock:
+        if (directory, stripe) not in _lock_files:
+            os.makedirs(directory, exist_ok=True)
+            _lock_files[directory, stripe] = open(os.path.join(directory, f'{stripe}.lock'), 'a')
+        return _lock_files[directory, stripe]
+
+
+class BucketTable:
+    """SLOT entries in a shared memory-mapped file, in sets of SLOT_WAYS."""
+
+    def __init__(self, path, slots):
+        self.sets = max(1, slots // SLOT_WAYS)
+        size = self.sets * SLOT_WAYS * SLOT.size
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Only ever grown: shrinking would fault other processes' maps.
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def read(self, index):
+        return SLOT.unpack_from(self.map, index * SLOT.size)
+
+    def write(self, index, digest, tokens, stamp):
+        SLOT.pack_into(self.map, index * SLOT.size, digest, tokens, stamp)
+
+    def clear(self):
+        self.map[:] = bytes(len(self.map))
+
+
+def _table():
+    path = os.fspath(settings.RATELIMIT_STORE)
+    slots = getattr(settings, 'RATELIMIT_SLOTS', 65536)
+    with _lock_files_lock:
+        if (path, slots) not in _tables:
+            _tables[path, slots] = BucketTable(path, slots)
+        return _tables[path, slots]
+
+
+def clear_buckets():
+    """Empty every bucket (tests, or after changing RATE_LIMITS)."""
+    _table().clear()
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+
+@contextmanager
+def _locked(stripe):
+    # flock excludes other processes; the thread lock excludes the other
+    # threads of this one, which share the same open lock file.
+    with _thread_locks[stripe]:
+        lock_file = _lock_file(stripe)
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def take_token(key, rate):
+    """Spend one token from the bucket. Returns 0 if allowed, else seconds to wait."""
+    capacity, per_second = parse_rate(rate)
+    table = _table()
+    digest = _key_hash(key)
+    first = digest % table.sets * SLOT_WAYS
+    with _locked(digest % table.sets % LOCK_STRIPES):
+        now = time.time()
+        slot, tokens = None, capacity
+        idlest, idle_since = first, math.inf
+        for index in range(first, first + SLOT_WAYS):
+            stored, stored_tokens, stamp = table.read(index)
+            if stored == digest:
+                slot, tokens = index, min(capacity, stored_tokens + (now - stamp) * per_second)
+                break
+            if stamp < idle_since:
+                idlest, idle_since = index, stamp
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0
+        else:
+            wait = math.ceil((1 - tokens) / per_second)
+        table.write(idlest if slot is None else slot, digest, tokens, now)
+    return wait
+
+
+def too_many_requests(request, wait, json):
+    message = 'Too many requests. Please slow down and try again shortly.'
+    if json:
+        response = JsonResponse({'error': message, 'retry_after': wait}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain')
+    response['Retry-After'] = str(wait)
+    return response
+
+
+def ratelimit(methods=None, json=False):
+    """
+    Limit a view by its URL name's entry in RATE_LIMITS. Only requests with
+    one of `methods` count (all methods if None); `json` picks the 429 body.
+    Put it above login_required and friends so it runs first.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            match = request.resolver_match
+            rate = match and settings.RATE_LIMITS.get(match.view_name)
+            if rate and getattr(settings, 'RATELIMIT_ENABLED', True) and (
+                methods is None or request.method in methods
+            ):
+                wait = take_token(f'{match.view_name}:{client_key(request)}', rate)
+                if wait:
+                    metrics.inc('commpolls_rate_limited_total', view=match.view_name)
+                    return too_many_requests(request, wait, json)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
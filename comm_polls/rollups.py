@@ -0,0 +1,169 @@
+"""
+Vote velocity rollups.
+
+VoteRollup keeps each poll's vote counts per minute, hour and day, so "how
+fast are votes coming in" reads a few hundred bucket rows instead of
+scanning Vote.voted_at. fold_vote_rollups, run every minute or so by the
+fold_vote_rollups command, recounts the minute buckets touched since the
+stored watermark with one grouped query on Vote, writes them as absolute
+counts and re-sums the hours and days they fall in from the finer level.
+Writing counts rather than increments makes a fold safe to repeat; the
+window starts VOTE_ROLLUP_GRACE_SECONDS before the watermark to take in
+votes whose transaction committed after an earlier fold had passed their
+voted_at.
+
+vote_series() adds the votes newer than the watermark for the one poll, so
+the chart stays current between folds. It reads at most SERIES_TAIL of
+them: before the first fold, or when folds stop, the chart shows recent
+votes only instead of scanning every ballot of the poll on each load. Minute buckets are pruned after
+VOTE_ROLLUP_MINUTE_DAYS; hour and day buckets stay with the poll. Ballots
+are archived long after their poll ends, well after they were folded, so
+archive_votes does not change the rollups. Ballots replayed through the
+bulk API keep the time they were cast, which can lie behind the window of
+every later fold; recount_late_votes() rewrites their buckets.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+from .counters import chunked
+from .models import Vote, VoteRollup, Watermark
+
+ROLLUP_WATERMARK = 'vote_rollups'
+MINUTE, HOUR, DAY = VoteRollup.MINUTE, VoteRollup.HOUR, VoteRollup.DAY
+TRUNCATE = {MINUTE: TruncMinute, HOUR: TruncHour, DAY: TruncDay}
+STEP = {MINUTE: timedelta(minutes=1), HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+# How far back vote_series() reaches at each resolution; None for the whole poll.
+SERIES_WINDOWS = {MINUTE: timedelta(hours=3), HOUR: timedelta(days=7), DAY: None}
+# How far back vote_series() counts votes the folds have not reached.
+SERIES_TAIL = timedelta(hours=1)
+
+
+def bucket_start(moment, resolution):
+    moment = moment.astimezone(dt_timezone.utc).replace(second=0, microsecond=0)
+    if resolution in (HOUR, DAY):
+        moment = moment.replace(minute=0)
+    if resolution == DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _bucketed(queryset, field, resolution):
+    """(poll_id, bucket start) pairs of `queryset`, ready for an aggregate."""
+    return (
+        queryset.annotate(bucket_at=TRUNCATE[resolution](field, tzinfo=dt_timezone.utc))
+        .values('poll_id', 'bucket_at')
+        .order_by()
+    )
+
+
+def _write(resolution, rows):
+    """Store [(poll_id, bucket, count)], replacing existing counts."""
+    VoteRollup.objects.bulk_create(
+        [VoteRollup(poll_id=poll_id, resolution=resolution, bucket=bucket, count=count)
+         for poll_id, bucket, count in rows],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['poll', 'resolution', 'bucket'],
+        update_fields=['count'],
+    )
+
+
+def fold_vote_rollups(full=False, chunk_size=1000):
+    """
+    Bring the rollups up to the newest vote: incrementally from the stored
+    watermark, or from every Vote row when `full` is set or no fold ran yet.
+    Returns a summary dict.
+    """
+    watermark = Watermark.objects.filter(name=ROLLUP_WATERMARK).first()
+    # Fixed up front: later votes are left to vote_series() and the next fold.
+    until = Vote.objects.aggregate(latest=Max('voted_at'))['latest']
+    summary = {'since': None, 'until': until, 'polls': 0, 'buckets': 0, 'pruned': 0}
+
+    if until is not None:
+        votes = Vote.objects.filter(voted_at__lte=until)
+        if watermark and not full:
+            grace = timedelta(seconds=getattr(settings, 'VOTE_ROLLUP_GRACE_SECONDS', 120))
+            summary['since'] = bucket_start(watermark.value - grace, MINUTE)
+            votes = votes.filter(voted_at__gte=summary['since'])
+
+        minutes = _bucketed(votes, 'voted_at', MINUTE).annotate(total=Count('id'))
+        touched = set()
+        for chunk in chunked(minutes.values_list('poll_id', 'bucket_at', 'total').iterator(), chunk_size):
+            _write(MINUTE, chunk)
+            touched.update(poll_id for poll_id, _, _ in chunk)
+            summary['buckets'] += len(chunk)
+        summary['polls'] = len(touched)
+
+        for finer, coarser in ((MINUTE, HOUR), (HOUR, DAY)):
+            rollups = VoteRollup.objects.filter(resolution=finer)
+            if summary['since']:
+                rollups = rollups.filter(bucket__gte=bucket_start(summary['since'], coarser))
+            for poll_ids in chunked(sorted(touched), chunk_size):
+                sums = _bucketed(rollups.filter(poll_id__in=poll_ids), 'bucket', coarser).annotate(total=Sum('count'))
+                _write(coarser, list(sums.values_list('poll_id', 'bucket_at', 'total')))
+
+        Watermark.objects.update_or_create(name=ROLLUP_WATERMARK, defaults={'value': until})
+
+    keep = timedelta(days=getattr(settings, 'VOTE_ROLLUP_MINUTE_DAYS', 7))
+    # VoteRollup has no dependents or delete signals: a single DELETE.
+    summary['pruned'] = VoteRollup.objects.filter(resolution=MINUTE, bucket__lt=timezone.now() - keep).delete()[0]
+    return summary
+
+
+def recount_late_votes(stamps):
+    """
+    Recount, from Vote, the buckets of newly stored votes that the next
+    incremental fold would not read. `stamps` are (poll_id, voted_at) pairs.
+    """
+    watermark = Watermark.objects.filter(name=ROLLUP_WATERMARK).values_list('value', flat=True).first()
+    if watermark is None:
+        return  # the first fold reads every vote
+    grace = timedelta(seconds=getattr(settings, 'VOTE_ROLLUP_GRACE_SECONDS', 120))
+    since = bucket_start(watermark - grace, MINUTE)
+    late = [(poll_id, voted_at) for poll_id, voted_at in stamps if voted_at < since]
+    if not late:
+        return
+    for resolution in (MINUTE, HOUR, DAY):
+        touched = {(poll_id, bucket_start(voted_at, resolution)) for poll_id, voted_at in late}
+        buckets = [bucket for _, bucket in touched]
+        votes = Vote.objects.filter(
+            poll_id__in={poll_id for poll_id, _ in touched},
+            voted_at__gte=min(buckets), voted_at__lt=max(buckets) + STEP[resolution],
+        )
+        counts = _bucketed(votes, 'voted_at', resolution).annotate(total=Count('id'))
+        _write(resolution, [row for row in counts.values_list('poll_id', 'bucket_at', 'total') if row[:2] in touched])
+
+
+def vote_series(poll, resolution):
+    """
+    [(bucket start, votes)] of the poll at `resolution` over its
+    SERIES_WINDOWS entry, oldest first, with empty buckets as zeros.
+    """
+    now = timezone.now()
+    last = bucket_start(min(now, poll.end_date), resolution)
+    first = bucket_start(poll.start_date, resolution)
+    if SERIES_WINDOWS[resolution] is not None:
+        first = max(first, bucket_start(now - SERIES_WINDOWS[resolution], resolution))
+    if first > last:
+        return []
+
+    rollups = VoteRollup.objects.filter(poll=poll, resolution=resolution, bucket__gte=first)
+    counts = dict(rollups.values_list('bucket', 'count'))
+
+    watermark = Watermark.objects.filter(name=ROLLUP_WATERMARK).values_list('value', flat=True).first()
+    tail = Vote.objects.filter(poll=poll, voted_at__gte=max(first, now - SERIES_TAIL))
+    if watermark is not None:
+        tail = tail.filter(voted_at__gt=watermark)
+    for bucket, total in _bucketed(tail, 'voted_at', resolution).annotate(total=Count('id')).values_list('bucket_at', 'total'):
+        counts[bucket] = counts.get(bucket, 0) + total
+
+    series = []
+    bucket = first
+    while bucket <= last:
+        series.append((bucket, counts.get(bucket, 0)))
+        bucket += STEP[resolution]
+    return series
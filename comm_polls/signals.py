@@ -0,0 +1,106 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from . import bitmaps
+from .backends import forget_users
+from .opening import forget_choice_lists
+from .avatars import forget_avatar_urls, schedule_offload, schedule_remote_delete, uses_remote_storage
+from .compression import forget_page
+from .pollcache import forget_polls
+from .ranked import forget_ranked_results
+from .tallies import forget_tallies
+from .models import Choice, Poll, Profile
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Poll)
+def reset_poll_bitmap(sender, instance, created, **kwargs):
+    """A new poll must never inherit a cached bitmap left under a reused id."""
+    if created:
+        bitmaps.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def reset_cached_poll(sender, instance, **kwargs):
+    forget_polls([instance.pk])
+    forget_ranked_results([instance.pk])
+    forget_tallies([instance.pk])
+    # Reopening an ended poll makes its counts live again.
+    forget_page(reverse('comm_polls:poll_results_api', args=[instance.pk]))
+
+
+# No post_delete receiver for Choice: it would stop purge.py's chunked
+# fast deletes. The admin drops the list when it removes choices.
+@receiver(post_save, sender=Poll)
+@receiver(post_save, sender=Choice)
+def reset_choice_list(sender, instance, **kwargs):
+    """The cached vote form shows choice names; rebuild it after any edit."""
+    forget_choice_lists([instance.pk if sender is Poll else instance.poll_id])
+
+
+# --- Cached request users (see comm_polls/backends.py) ---
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_saved_user(sender, instance, **kwargs):
+    # Covers admin edits, last_login updates and password changes.
+    forget_users([instance.pk])
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def forget_profile_user(sender, instance, **kwargs):
+    forget_users([instance.user_id])
+    forget_avatar_urls([instance.user_id])
+
+
+@receiver(pre_save, sender=Profile)
+def note_new_avatar(sender, instance, raw=False, **kwargs):
+    """A newly assigned file is written to the local storage first, whatever the mode."""
+    if raw:
+        return
+    instance._new_avatar = bool(instance.avatar) and not instance.avatar._committed
+    instance._replaced_remote_avatar = None
+    if instance._new_avatar or not instance.avatar:
+        # Read from the row: the offload may have finished after this
+        # instance was loaded.
+        if instance.pk:
+            remote = Profile.objects.filter(pk=instance.pk, avatar_remote=True)
+            previous = remote.values_list('avatar', flat=True).first()
+            if previous and previous != instance.avatar.name:
+                instance._replaced_remote_avatar = previous
+        instance.avatar_remote = False
+
+
+@receiver(post_save, sender=Profile)
+def upload_new_avatar(sender, instance, raw=False, **kwargs):
+    if not raw and getattr(instance, '_new_avatar', False) and uses_remote_storage():
+        profile_id, name = instance.pk, instance.avatar.name
+        transaction.on_commit(lambda: schedule_offload(profile_id, name))
+    previous = getattr(instance, '_replaced_remote_avatar', None)
+    if not raw and previous:
+        transaction.on_commit(lambda: schedule_remote_delete(previous))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_regrouped_users(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        forget_users([instance.pk])
+    elif action == 'pre_clear':
+        forget_users(instance.user_set.values_list('pk', flat=True))
+    else:
+        forget_users(pk_set)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        forget_users([user.pk])
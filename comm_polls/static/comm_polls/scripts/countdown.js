@@ -18,6 +18,9 @@ window.initCountdown = function initCountdown() {
     const startTimeStr = container.dataset.startTime;
     const serverTimeStr = container.dataset.serverTime;
     const voteUrl = container.dataset.voteUrl;
+    // Everyone reaches zero in the same second; each viewer waits a random
+    // extra delay so the vote page is not hit by all of them at once.
+    const jitterMs = Math.random() * (Number(container.dataset.jitterMs) || 0);
 
     if (!startTimeStr || !serverTimeStr) {
         console.error('[Countdown] Missing startTime or serverTime.');
@@ -46,13 +49,17 @@ window.initCountdown = function initCountdown() {
         if (distance <= 0) {
             clearInterval(window.currentCountdownInterval);
             window.currentCountdownInterval = null;
-            console.log('[Countdown] Countdown finished — navigating.');
+            [daysEl, hoursEl, minutesEl, secondsEl].forEach(el => { el.textContent = '00'; });
+            console.log(`[Countdown] Countdown finished — navigating in ${Math.round(jitterMs)} ms.`);
 
-            if (window.spaNavigate) {
-                window.spaNavigate(voteUrl);
-            } else {
-                window.location.href = voteUrl;
-            }
+            setTimeout(() => {
+                if (!document.body.contains(container)) return; // navigated away meanwhile
+                if (window.spaNavigate) {
+                    window.spaNavigate(voteUrl);
+                } else {
+                    window.location.href = voteUrl;
+                }
+            }, jitterMs);
             return;
         }
 
@@ -10,8 +10,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
             if (username.length > 2) {
                 fetch(`${validationUrl}?username=${username}`)
-                    .then(response => response.json())
+                    .then(response => response.ok ? response.json() : null) // 429: skip this check
                     .then(data => {
+                        if (!data) return;
                         if (data.is_taken) {
                             validationMessage.textContent = 'Username is already taken.';
                             validationMessage.className = 'validation-message taken';
@@ -39,8 +40,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
             if (emailRegex.test(email)) {
                 fetch(`${emailValidationUrl}?email=${email}`)
-                    .then(response => response.json())
+                    .then(response => response.ok ? response.json() : null) // 429: skip this check
                     .then(data => {
+                        if (!data) return;
                         if (data.is_taken) {
                             emailValidationMessage.textContent = 'This email is already registered.';
                             emailValidationMessage.className = 'validation-message taken';
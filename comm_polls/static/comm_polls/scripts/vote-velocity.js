@@ -0,0 +1,65 @@
+// Bar chart of a poll's votes per minute, hour or day on the manage poll
+// page, read from the rollup endpoint and refreshed every 30 seconds.
+(function voteVelocity() {
+    const section = document.querySelector('.vote-velocity');
+    if (!section) return;
+
+    const canvas = section.querySelector('.velocity-chart');
+    const summary = section.querySelector('.velocity-summary');
+    const buttons = section.querySelectorAll('button[data-resolution]');
+    let resolution = 'minute';
+
+    const draw = (buckets) => {
+        const ctx = canvas.getContext('2d');
+        const style = getComputedStyle(document.body);
+        const padding = 24;
+        const width = canvas.width - padding * 2;
+        const height = canvas.height - padding * 2;
+        const max = Math.max(1, ...buckets.map(([, count]) => count));
+        const barWidth = width / Math.max(1, buckets.length);
+
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.fillStyle = style.getPropertyValue('--primary-end').trim() || '#2575fc';
+        buckets.forEach(([, count], index) => {
+            const barHeight = (count / max) * height;
+            ctx.fillRect(padding + index * barWidth, padding + height - barHeight, Math.max(1, barWidth - 1), barHeight);
+        });
+
+        ctx.fillStyle = style.getPropertyValue('--text-muted').trim() || '#6c757d';
+        ctx.font = '12px sans-serif';
+        ctx.fillText(`${max}`, 2, padding);
+        if (buckets.length) {
+            ctx.fillText(new Date(buckets[0][0]).toLocaleString(), padding, canvas.height - 6);
+            const last = new Date(buckets[buckets.length - 1][0]).toLocaleString();
+            ctx.fillText(last, canvas.width - padding - ctx.measureText(last).width, canvas.height - 6);
+        }
+
+        const total = buckets.reduce((sum, [, count]) => sum + count, 0);
+        const latest = buckets.length ? buckets[buckets.length - 1][1] : 0;
+        summary.textContent = `${total} votes shown, ${latest} in the latest ${resolution}, peak ${max} per ${resolution}.`;
+    };
+
+    const load = () => {
+        if (!document.body.contains(section)) {
+            clearInterval(window.voteVelocityInterval); // navigated away
+            return;
+        }
+        fetch(`${section.dataset.url}?resolution=${resolution}`, { headers: { 'Accept': 'application/json' } })
+            .then(response => (response.ok ? response.json() : null))
+            .then(data => {
+                if (data) draw(data.buckets);
+            })
+            .catch(() => {});
+    };
+
+    buttons.forEach(button => {
+        button.addEventListener('click', () => {
+            resolution = button.dataset.resolution;
+            load();
+        });
+    });
+
+    clearInterval(window.voteVelocityInterval);
+    window.voteVelocityInterval = setInterval(load, 30000);
+    load();
+})();
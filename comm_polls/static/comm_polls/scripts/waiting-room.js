@@ -0,0 +1,19 @@
+// Retries the page that sent us to the waiting room, after the server's
+// Retry-After plus up to a second of jitter so queued visitors spread out.
+(function retryFromWaitingRoom() {
+    const room = document.querySelector('.waiting-room');
+    if (!room) return;
+
+    const retryUrl = room.dataset.retryUrl;
+    const delayMs = (Number(room.dataset.retryAfter) || 1) * 1000 + Math.random() * 1000;
+
+    clearTimeout(window.waitingRoomTimeout);
+    window.waitingRoomTimeout = setTimeout(() => {
+        if (!document.body.contains(room)) return; // navigated away meanwhile
+        if (window.spaNavigate) {
+            window.spaNavigate(retryUrl, false);
+        } else {
+            window.location.href = retryUrl;
+        }
+    }, delayMs);
+})();
@@ -0,0 +1,155 @@
+"""
+Concurrent vote stress harness.
+
+Fires real HTTP vote submissions at a running server from a thread or
+process pool, then checks that the denormalized counters still agree with
+the ballots that were stored. Model imports stay inside the functions so
+process-pool workers only need the standard library.
+"""
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as responses instead of following them."""
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def prepare_stress_poll(voters, choices=4, prefix='stress'):
+    """
+    Create a poll, its choices and `voters` logged-in users.
+
+    Returns (poll, jobs) where each job is a picklable tuple of
+    (session_key, csrf_token, choice_id) ready to be fired at the server.
+    """
+    from django.conf import settings
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.utils import timezone
+    from django.utils.crypto import get_random_string
+    from .models import Choice, Poll, Profile
+
+    run_id = get_random_string(6).lower()
+    password = make_password(None)
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}-{run_id}-{i}', password=password)
+        for i in range(voters)
+    ])
+    if not users or users[0].pk is None:
+        users = list(User.objects.filter(username__startswith=f'{prefix}-{run_id}-'))
+    Profile.objects.bulk_create([Profile(user=user) for user in users])
+
+    now = timezone.now()
+    poll = Poll.objects.create(
+        name=f'Stress poll {run_id}',
+        created_by=users[0],
+        start_date=now - timedelta(minutes=1),
+        end_date=now + timedelta(days=1),
+    )
+    choice_ids = [
+        choice.pk for choice in Choice.objects.bulk_create([
+            Choice(poll=poll, name=f'Option {i + 1}') for i in range(choices)
+        ])
+    ]
+    if None in choice_ids:
+        choice_ids = list(poll.choices.values_list('id', flat=True))
+
+    backend = settings.AUTHENTICATION_BACKENDS[0]
+    jobs = []
+    for i, user in enumerate(users):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = backend
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        jobs.append((session.session_key, get_random_string(32), choice_ids[i % len(choice_ids)]))
+    return poll, jobs
+
+
+def cast_vote(job):
+    """POST a single vote. Returns the HTTP status code (0 on connection errors)."""
+    url, session_key, csrf_token, choice_id = job
+    request = urllib.request.Request(
+        url,
+        data=urllib.parse.urlencode({'choice': choice_id}).encode(),
+        headers={
+            'Cookie': f'sessionid={session_key}; csrftoken={csrf_token}',
+            'X-CSRFToken': csrf_token,
+        },
+    )
+    try:
+        with _opener.open(request, timeout=30) as response:
+            return response.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+    except OSError:
+        return 0
+
+
+def fire_votes(base_url, poll_id, jobs, workers=16, mode='thread', repeat=1):
+    """
+    Submit every job `repeat` times concurrently.
+
+    Repeating a voter's submission is what exercises the double-vote race.
+    Returns (status_counts, elapsed_seconds).
+    """
+    url = f"{base_url.rstrip('/')}/polls/{poll_id}/vote/"
+    payload = [(url, *job) for job in jobs] * repeat
+    executor_class = ProcessPoolExecutor if mode == 'process' else ThreadPoolExecutor
+    chunksize = max(1, len(payload) // (workers * 8)) if mode == 'process' else 1
+
+    status_counts = {}
+    started = time.perf_counter()
+    with executor_class(max_workers=workers) as executor:
+        for status in executor.map(cast_vote, payload, chunksize=chunksize):
+            status_counts[status] = status_counts.get(status, 0) + 1
+    return status_counts, time.perf_counter() - started
+
+
+def check_vote_counters(polls=None):
+    """
+    Compare Choice.votes_count with the stored Vote rows.
+
+    Returns a dict with the counter total, the ballot total, the polls whose
+    counters drifted and any (poll, voter) pair holding more than one vote.
+    """
+    from django.db.models import Count, F, Sum
+    from .models import Choice, Vote
+
+    choices = Choice.objects.all()
+    votes = Vote.objects.all()
+    if polls is not None:
+        choices = choices.filter(poll__in=polls)
+        votes = votes.filter(poll__in=polls)
+
+    counted = choices.aggregate(total=Sum('votes_count'))['total'] or 0
+    stored = votes.count()
+    drifted = list(
+        choices.annotate(actual=Count('choice_votes'))
+        .exclude(votes_count=F('actual'))
+        .values_list('poll_id', flat=True)
+        .distinct()
+    )
+    duplicates = list(
+        votes.values('poll_id', 'voter_id')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .values_list('poll_id', 'voter_id')
+    )
+    return {
+        'counted': counted,
+        'stored': stored,
+        'drifted_polls': sorted(drifted),
+        'duplicates': duplicates,
+        'ok': counted == stored and not drifted and not duplicates,
+    }
@@ -0,0 +1,38 @@
+import unittest
+from django.db import connection
+from django.test import LiveServerTestCase, override_settings
+from .models import Vote
+from .stress import check_vote_counters, fire_votes, prepare_stress_poll
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConcurrentVoteTests(LiveServerTestCase):
+    """Hammer the vote view from many clients at once and check the counters."""
+
+    voters = 60
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise unittest.SkipTest(
+                "In-memory SQLite shares one connection across server threads; set SQLITE_TEST_NAME."
+            )
+        super().setUpClass()
+
+    def assertCountersConsistent(self, poll):
+        report = check_vote_counters(polls=[poll])
+        self.assertTrue(report['ok'], report)
+        self.assertEqual(report['stored'], self.voters)
+        self.assertEqual(Vote.objects.filter(poll=poll).values('voter').distinct().count(), self.voters)
+
+    def test_thread_pool_votes_keep_counters_consistent(self):
+        poll, jobs = prepare_stress_poll(self.voters)
+        statuses, elapsed = fire_votes(self.live_server_url, poll.id, jobs, workers=8, mode='thread', repeat=2)
+        self.assertEqual(statuses, {302: self.voters * 2})
+        self.assertCountersConsistent(poll)
+
+    def test_process_pool_votes_keep_counters_consistent(self):
+        poll, jobs = prepare_stress_poll(self.voters)
+        statuses, elapsed = fire_votes(self.live_server_url, poll.id, jobs, workers=4, mode='process', repeat=2)
+        self.assertEqual(statuses, {302: self.voters * 2})
+        self.assertCountersConsistent(poll)
@@ -0,0 +1,165 @@
+"""
+Synthetic data at production scale, for reproducing problems locally.
+
+generate() writes users, polls and choices with bulk_create and votes with
+plain multi-row INSERTs, so no signals fire and nothing is saved row by
+row. Everything is drawn from
+one random.Random(seed) in a fixed order, so a seed always yields the same
+users, polls, choices and ballots (timestamps are placed relative to the
+time of the run):
+
+* one user in a hundred joins the Managers group and owns the polls;
+* polls have mostly 2-4 choices, occasionally up to 10, and windows from
+  an hour to a month: most have ended, some are open, a few are scheduled;
+* poll popularity follows a Zipf law with exponent `zipf`, so a handful of
+  polls take most of the votes; choices within a poll are skewed too;
+* every poll's voters are a sample without replacement, which keeps the
+  (poll, voter) constraint, and votes fall inside the poll's window.
+
+Each batch of votes is committed together with its Choice.votes_count
+increments, so counters stay consistent even if a run is interrupted.
+"""
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import bitmaps
+from .backends import MANAGERS_GROUP
+from .counters import apply_counter_deltas, chunked
+from .dumps import keeping_timestamps
+from .models import Choice, Poll, Profile, Vote
+from .opening import forget_choice_lists
+from .pollcache import forget_polls
+
+CHOICE_COUNTS = (2, 3, 4, 5, 6, 7, 8, 9, 10)
+CHOICE_COUNT_WEIGHTS = (40, 25, 15, 8, 4, 3, 2, 2, 1)
+
+
+def _ids(model, **filters):
+    # bulk_create inserts in order, so ascending ids follow creation order.
+    return list(model.objects.filter(**filters).order_by('id').values_list('id', flat=True))
+
+
+def _insert_votes(rows):
+    """
+    INSERT (poll_id, choice_id, voter_id, voted_at) tuples as multi-row
+    statements. Building Vote instances and compiling them through
+    bulk_create costs several times more than the inserts themselves.
+    """
+    quote = connection.ops.quote_name
+    columns = ('poll_id', 'choice_id', 'voter_id', 'voted_at')
+    fields = [Vote._meta.get_field(column) for column in columns]
+    per_statement = min(1000, connection.ops.bulk_batch_size(fields, rows) or len(rows))
+    adapt = connection.ops.adapt_datetimefield_value
+    prefix = f"INSERT INTO {quote(Vote._meta.db_table)} ({', '.join(quote(column) for column in columns)}) VALUES "
+    with connection.cursor() as cursor:
+        for batch in chunked(rows, per_statement):
+            params = []
+            for poll_id, choice_id, voter_id, voted_at in batch:
+                params += (poll_id, choice_id, voter_id, adapt(voted_at))
+            cursor.execute(prefix + ', '.join(['(%s, %s, %s, %s)'] * len(batch)), params)
+
+
+def _window(rng, now):
+    """(start, end) of a poll: 70% ended, 20% open, 10% scheduled."""
+    duration = timedelta(hours=min(24 * 30, rng.lognormvariate(3.5, 1.2)) + 1)
+    kind = rng.random()
+    if kind < 0.7:
+        end = now - timedelta(days=rng.uniform(0, 365))
+        return end - duration, end
+    if kind < 0.9:
+        start = now - duration * rng.uniform(0.05, 0.95)
+        return start, start + duration
+    start = now + timedelta(hours=rng.uniform(1, 24 * 14))
+    return start, start + duration
+
+
+def generate(users, polls, votes, seed=0, zipf=1.1, prefix='load', password=None,
+             chunk_size=10000, progress=None):
+    """Create the data set; returns a summary dict with the rows created."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    if User.objects.filter(username__startswith=f'{prefix}-').exists():
+        raise ValueError(f"Users named {prefix}-* already exist; pick another prefix.")
+
+    hashed = make_password(password)
+    for batch in chunked(range(users), chunk_size):
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password=hashed,
+                 date_joined=now - timedelta(days=rng.uniform(0, 730)))
+            for i in batch
+        ])
+    user_ids = _ids(User, username__startswith=f'{prefix}-')
+    for batch in chunked(user_ids, chunk_size):
+        Profile.objects.bulk_create([Profile(user_id=user_id) for user_id in batch])
+    managers = user_ids[:max(1, users // 100)]
+    group = Group.objects.get_or_create(name=MANAGERS_GROUP)[0]
+    User.groups.through.objects.bulk_create([User.groups.through(user_id=user_id, group=group) for user_id in managers])
+
+    windows = [_window(rng, now) for _ in range(polls)]
+    with keeping_timestamps([Poll]):
+        created = Poll.objects.bulk_create([
+            Poll(name=f'{prefix.title()} poll {i}', description='Generated by generate_load_data.',
+                 created_by_id=rng.choice(managers), created_at=start - timedelta(days=rng.uniform(0, 7)),
+                 start_date=start, end_date=end)
+            for i, (start, end) in enumerate(windows)
+        ], batch_size=chunk_size)
+        # Id ranges rather than IN lists, which grow with the data set.
+        poll_ids = _ids(Poll, name__startswith=f'{prefix.title()} poll ',
+                        created_by_id__gte=managers[0], created_by_id__lte=managers[-1])
+        counts = [rng.choices(CHOICE_COUNTS, CHOICE_COUNT_WEIGHTS)[0] for _ in poll_ids]
+        Choice.objects.bulk_create([
+            Choice(poll_id=poll_id, name=f'Option {n + 1}')
+            for poll_id, count in zip(poll_ids, counts) for n in range(count)
+        ], batch_size=chunk_size)
+        choice_ids = {poll_id: [] for poll_id in poll_ids}
+        if poll_ids:
+            choices = Choice.objects.filter(poll_id__gte=poll_ids[0], poll_id__lte=poll_ids[-1]).order_by('id')
+            for choice_id, poll_id in choices.values_list('id', 'poll_id'):
+                if poll_id in choice_ids:
+                    choice_ids[poll_id].append(choice_id)
+
+        # Zipf popularity over the polls that have started, in a seeded order.
+        started = [i for i, (start, _) in enumerate(windows) if start < now]
+        rng.shuffle(started)
+        weights = [1 / (rank + 1) ** zipf for rank in range(len(started))]
+        total_weight = sum(weights) or 1
+        planned = {i: min(users, round(votes * weight / total_weight)) for i, weight in zip(started, weights)}
+
+        pending, deltas, stored = [], Counter(), 0
+
+        def flush():
+            nonlocal pending, deltas, stored
+            with transaction.atomic():
+                _insert_votes(pending)
+                for batch in chunked(deltas.items(), 1000):
+                    apply_counter_deltas(dict(batch))
+            stored += len(pending)
+            if progress:
+                progress(stored)
+            pending, deltas = [], Counter()
+
+        for i in sorted(planned):
+            poll_id, (start, end) = poll_ids[i], windows[i]
+            options = choice_ids[poll_id]
+            preference = [rng.expovariate(1) ** 2 for _ in options]
+            span = (min(end, now) - start).total_seconds()
+            voters = rng.sample(user_ids, planned[i])
+            for voter_id, choice_id in zip(voters, rng.choices(options, preference, k=len(voters))):
+                pending.append((poll_id, choice_id, voter_id, start + timedelta(seconds=rng.random() * span)))
+                deltas[choice_id] += 1
+                if len(pending) >= chunk_size:
+                    flush()
+        if pending:
+            flush()
+
+    # bulk_create skips post_save, so clear what the signals would have.
+    bitmaps.invalidate(poll_ids)
+    forget_choice_lists(poll_ids)
+    forget_polls(poll_ids)
+    return {'users': len(user_ids), 'polls': len(created), 'choices': sum(counts), 'votes': stored}
@@ -0,0 +1,46 @@
+"""
+Vote counts of many polls at once, for dashboards.
+
+poll_tallies() takes each poll's [[choice id, votes], ...] from the cache
+and loads the others with one query on Choice joined to the visible polls.
+Entries live for POLL_TALLY_TIMEOUT seconds: the counters move with every
+vote, so they are not dropped on each one, and a dashboard sees counts at
+most that old. Hiding or deleting a poll drops its entry; unknown or hidden
+ids are not remembered.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .models import Choice
+
+
+def tally_key(poll_id):
+    return f'poll_tally:{poll_id}'
+
+
+def poll_tallies(poll_ids):
+    """{poll id: [[choice id, votes], ...]} of the visible polls among `poll_ids`."""
+    keys = {tally_key(poll_id): poll_id for poll_id in poll_ids}
+    tallies = {keys[key]: tally for key, tally in cache.get_many(keys).items()}
+    missing = [poll_id for poll_id in poll_ids if poll_id not in tallies]
+    if tallies:
+        metrics.inc('commpolls_cache_requests_total', len(tallies), cache='poll_tally', result='hit')
+    if missing:
+        metrics.inc('commpolls_cache_requests_total', len(missing), cache='poll_tally', result='miss')
+        rows = (
+            Choice.objects.filter(poll_id__in=missing, poll__deleted_at__isnull=True)
+            .order_by('poll_id', 'id')
+            .values_list('poll_id', 'id', 'votes_count')
+        )
+        loaded = {}
+        for poll_id, choice_id, votes in rows:
+            loaded.setdefault(poll_id, []).append([choice_id, votes])
+        cache.set_many({tally_key(poll_id): tally for poll_id, tally in loaded.items()},
+                       getattr(settings, 'POLL_TALLY_TIMEOUT', 5))
+        tallies.update(loaded)
+    return tallies
+
+
+def forget_tallies(poll_ids):
+    cache.delete_many([tally_key(poll_id) for poll_id in poll_ids])
@@ -0,0 +1,26 @@
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class CommPollsTestRunner(DiscoverRunner):
+    """
+    DiscoverRunner that gives each test run its own, empty rate-limit store,
+    so buckets left in /dev/shm by an earlier run or a local server do not
+    throttle the tests.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._ratelimit_dir = tempfile.TemporaryDirectory()
+        self._ratelimit_settings = override_settings(
+            RATELIMIT_STORE=f'{self._ratelimit_dir.name}/buckets.slots',
+            RATELIMIT_LOCK_DIR=f'{self._ratelimit_dir.name}/locks',
+        )
+        self._ratelimit_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._ratelimit_settings.disable()
+        self._ratelimit_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,15 +1,57 @@
-from django.test import TestCase, override_settings, RequestFactory
+from django.test import SimpleTestCase, TestCase, override_settings, RequestFactory
 from django.contrib.auth.models import User, AnonymousUser, Group
 import unittest
+from unittest import mock
+import importlib.util
+import runpy
+import subprocess
+import gzip
+import hashlib
+import numpy as np
+import brotli
+from django.conf import settings
 from django.urls import reverse
-from .models import Profile, Poll, Choice, Vote, ManagerRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from .models import Profile, Poll, Choice, Vote, ManagerRequest, Watermark, RequestProfile, VoteRollup, PollVoteArchive
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+import csv
+import os
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from PIL import Image
 from django.core.exceptions import ValidationError
 from .context_processors import server_time, user_roles
 from django.db.utils import IntegrityError
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+import json
 from .validators import NumberValidator, UppercaseValidator
+from . import bulk
+from .archive import archivable_polls, archive_polls, pack, poll_ballots
+from .bitmaps import VoterBitmap, bitmap_stats, has_voted
+from .backends import user_cache_key
+from .hashers import HashingBusy, get_pool
+from .profiling import make_token
+from .opening import admission_slots, choice_list_key, get_gate
+from .pollcache import poll_key
+from .compression import body_key, compress_response, negotiate, page_key
+from . import avatars
+from .avatars import url_key
+from django.core.files.storage import default_storage
+from .purge import hide_polls
+from .ratelimit import SLOT_WAYS, clear_buckets, parse_rate, take_token
+from .rollups import bucket_start, fold_vote_rollups, vote_series
+from .dumps import PROGRESS
+from .ranked import ballot_matrix, instant_runoff, parse_ranking, ranked_results, results_key
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from .admin import EstimatedCountPaginator
 from .forms import SignUpForm, UserUpdateForm, PollForm, ChoiceForm, ChoiceFormSet
 
 # Minimal 1x1 transparent PNG for ImageField tests
@@ -575,3 +617,1641 @@ class AdditionalViewTests(TestCase):
         self.assertEqual(self.user.username, 'updateduser1')
         self.assertEqual(self.user.email, 'updated1@example.com')
 
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ReconcileVotesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Drifting Poll", created_by=self.user,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="Choice 1")
+        self.other_poll = Poll.objects.create(
+            name="Other Poll", created_by=self.user,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.other_choice = Choice.objects.create(poll=self.other_poll, name="Choice A")
+        Vote.objects.create(poll=self.poll, choice=self.choice, voter=self.user)
+
+    def test_dry_run_reports_without_fixing(self):
+        out = StringIO()
+        call_command('reconcile_votes', '--dry-run', stdout=out)
+        self.assertIn('stored 0, actual 1', out.getvalue())
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.votes_count, 0)
+        self.assertFalse(Watermark.objects.exists())
+
+    def test_full_run_fixes_drift_and_stores_watermark(self):
+        Choice.objects.filter(pk=self.other_choice.pk).update(votes_count=5)
+        call_command('reconcile_votes', stdout=StringIO())
+        self.choice.refresh_from_db()
+        self.other_choice.refresh_from_db()
+        self.assertEqual(self.choice.votes_count, 1)
+        self.assertEqual(self.other_choice.votes_count, 0)
+        self.assertEqual(Watermark.objects.get(name='reconcile_votes').value, Vote.objects.get().voted_at)
+
+    def test_incremental_only_checks_polls_with_new_votes(self):
+        # Well before the watermark and its grace window.
+        Vote.objects.filter(poll=self.poll).update(voted_at=timezone.now() - timedelta(hours=1))
+        Vote.objects.create(poll=self.other_poll, choice=self.other_choice, voter=self.user)
+        call_command('reconcile_votes', stdout=StringIO())
+        Choice.objects.filter(pk=self.choice.pk).update(votes_count=7)
+        other_voter = User.objects.create_user(username='late', password='password123')
+        Vote.objects.create(poll=self.other_poll, choice=self.other_choice, voter=other_voter)
+
+        call_command('reconcile_votes', '--incremental', stdout=StringIO())
+        self.choice.refresh_from_db()
+        self.other_choice.refresh_from_db()
+        self.assertEqual(self.other_choice.votes_count, 2)
+        self.assertEqual(self.choice.votes_count, 7)  # no new votes, not re-checked
+
+    def test_incremental_rereads_the_grace_window(self):
+        call_command('reconcile_votes', stdout=StringIO())
+        watermark = Watermark.objects.get().value
+        # Committed after the run, but stamped before its watermark.
+        late_voter = User.objects.create_user(username='late', password='password123')
+        Vote.objects.create(poll=self.other_poll, choice=self.other_choice, voter=late_voter)
+        Vote.objects.filter(voter=late_voter).update(voted_at=watermark - timedelta(seconds=30))
+
+        call_command('reconcile_votes', '--incremental', stdout=StringIO())
+        self.other_choice.refresh_from_db()
+        self.assertEqual(self.other_choice.votes_count, 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class VoteArchiveTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='password123')
+        self.other = User.objects.create_user(username='other', password='password123')
+        now = timezone.now()
+        self.old_poll = Poll.objects.create(
+            name="Old Poll", created_by=self.user,
+            start_date=now - timedelta(days=200), end_date=now - timedelta(days=100)
+        )
+        self.old_choice1 = Choice.objects.create(poll=self.old_poll, name="Old A", votes_count=1)
+        self.old_choice2 = Choice.objects.create(poll=self.old_poll, name="Old B", votes_count=1)
+        Vote.objects.create(poll=self.old_poll, choice=self.old_choice1, voter=self.user)
+        Vote.objects.create(poll=self.old_poll, choice=self.old_choice2, voter=self.other)
+
+        self.recent_poll = Poll.objects.create(
+            name="Recent Poll", created_by=self.user,
+            start_date=now - timedelta(days=3), end_date=now - timedelta(days=1)
+        )
+        self.recent_choice = Choice.objects.create(poll=self.recent_poll, name="Recent A", votes_count=1)
+        Vote.objects.create(poll=self.recent_poll, choice=self.recent_choice, voter=self.user)
+
+    def test_archive_moves_only_old_polls(self):
+        call_command('archive_votes', '--days', '30', stdout=StringIO())
+        self.assertFalse(Vote.objects.filter(poll=self.old_poll).exists())
+        self.assertTrue(Vote.objects.filter(poll=self.recent_poll).exists())
+        self.assertEqual(self.old_poll.total_votes, 2)
+        self.assertEqual(
+            sorted((voter, choice) for voter, choice, _ in poll_ballots(self.old_poll)),
+            sorted([(self.user.id, self.old_choice1.id), (self.other.id, self.old_choice2.id)]),
+        )
+
+    def test_archived_votes_are_read_transparently(self):
+        call_command('archive_votes', '--days', '30', stdout=StringIO())
+        self.client.login(username='voter', password='password123')
+
+        response = self.client.get(reverse('comm_polls:votes'))
+        self.assertContains(response, "Old Poll")
+        self.assertContains(response, "Recent Poll")
+
+        response = self.client.get(reverse('comm_polls:results', args=[self.old_poll.id]))
+        self.assertEqual(response.context['user_vote'].choice, self.old_choice1)
+
+    def test_home_marks_archived_polls_as_voted(self):
+        call_command('archive_votes', '--days', '30', stdout=StringIO())
+        self.client.login(username='voter', password='password123')
+        response = self.client.get(reverse('comm_polls:home'))
+        self.assertIn(self.old_poll.id, response.context['voted_poll_ids'])
+        self.assertIn(self.recent_poll.id, response.context['voted_poll_ids'])
+
+    def test_reconcile_skips_archived_polls(self):
+        call_command('archive_votes', '--days', '30', stdout=StringIO())
+        call_command('reconcile_votes', stdout=StringIO())
+        self.old_choice1.refresh_from_db()
+        self.assertEqual(self.old_choice1.votes_count, 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class VoterBitmapTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Bitmap Poll", created_by=self.user,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="Choice 1")
+
+    def test_bitmap_membership_and_container_upgrade(self):
+        ids = list(range(0, 20000, 3)) + [70000, 2 ** 40]
+        bitmap = VoterBitmap(ids)
+        self.assertEqual(len(bitmap), len(ids))
+        self.assertTrue(all(member in bitmap for member in ids))
+        self.assertNotIn(1, bitmap)
+        self.assertNotIn(70001, bitmap)
+        # The first container holds more than 4096 ids and switches to a bitmap.
+        self.assertIsInstance(bitmap.containers[0], bytearray)
+        bitmap.add(3)
+        self.assertEqual(len(bitmap), len(ids))
+
+    def test_vote_updates_bitmap_and_checks_skip_the_database(self):
+        self.assertFalse(has_voted(self.poll.id, self.user.id))  # builds the bitmap
+        self.client.login(username='voter', password='password123')
+        self.client.post(reverse('comm_polls:vote', args=[self.poll.id]), {'choice': self.choice.id})
+        with self.assertNumQueries(0):
+            self.assertTrue(has_voted(self.poll.id, self.user.id))
+        self.assertEqual(bitmap_stats([self.poll.id]), [(self.poll.id, 1, 2)])
+
+    def test_results_page_does_not_trust_a_stale_bitmap(self):
+        self.assertFalse(has_voted(self.poll.id, self.user.id))  # cached without the vote below
+        Vote.objects.create(poll=self.poll, choice=self.choice, voter=self.user)
+        self.assertFalse(has_voted(self.poll.id, self.user.id))
+        self.client.login(username='voter', password='password123')
+        response = self.client.get(reverse('comm_polls:results', args=[self.poll.id]))
+        self.assertEqual(response.context['user_vote'].choice, self.choice)
+
+    def test_one_worker_rebuilds_a_missing_bitmap(self):
+        Vote.objects.create(poll=self.poll, choice=self.choice, voter=self.user)
+        cache.add(f'voter_bitmap:{self.poll.id}:building', True, 60)
+        # Another worker holds the lock: answer from the database, build nothing.
+        with self.assertNumQueries(1):
+            self.assertTrue(has_voted(self.poll.id, self.user.id))
+        self.assertEqual(bitmap_stats([self.poll.id]), [])
+        cache.delete(f'voter_bitmap:{self.poll.id}:building')
+        self.assertTrue(has_voted(self.poll.id, self.user.id))
+        self.assertEqual(bitmap_stats([self.poll.id]), [(self.poll.id, 1, 2)])
+
+    @override_settings(VOTER_BITMAP_MAX_BYTES=0)
+    def test_over_budget_bitmaps_fall_back_to_the_database(self):
+        Vote.objects.create(poll=self.poll, choice=self.choice, voter=self.user)
+        self.assertTrue(has_voted(self.poll.id, self.user.id))
+        self.assertEqual(bitmap_stats([self.poll.id]), [(self.poll.id, None, None)])
+        with self.assertNumQueries(1):
+            self.assertTrue(has_voted(self.poll.id, self.user.id))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BulkVotesApiTests(TestCase):
+
+    def setUp(self):
+        self.manager = User.objects.create_user(username='manager', password='password123')
+        manager_group, _ = Group.objects.get_or_create(name='Managers')
+        self.manager.groups.add(manager_group)
+        self.voters = [User.objects.create_user(username=f'kiosk{i}', password='password123') for i in range(4)]
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Kiosk Poll", created_by=self.manager,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.choice1 = Choice.objects.create(poll=self.poll, name="A")
+        self.choice2 = Choice.objects.create(poll=self.poll, name="B")
+        self.other_poll = Poll.objects.create(
+            name="Other", created_by=self.manager,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.other_choice = Choice.objects.create(poll=self.other_poll, name="X")
+        self.url = reverse('comm_polls:bulk_votes_api')
+
+    def post(self, ballots):
+        return self.client.post(self.url, json.dumps({'ballots': ballots}), content_type='application/json')
+
+    def ballot(self, voter, choice=None, **extra):
+        return {'poll': self.poll.id, 'choice': (choice or self.choice1).id, 'voter': voter.id, **extra}
+
+    def test_batch_reports_status_per_ballot_and_updates_counters(self):
+        Vote.objects.create(poll=self.poll, choice=self.choice1, voter=self.voters[3])
+        self.client.login(username='manager', password='password123')
+        response = self.post([
+            self.ballot(self.voters[0]),
+            self.ballot(self.voters[1], self.choice2),
+            self.ballot(self.voters[0], self.choice2),  # same voter again in the batch
+            self.ballot(self.voters[3]),  # already voted
+            self.ballot(self.voters[2], self.other_choice),
+            self.ballot(self.voters[2], cast_at=(timezone.now() - timedelta(days=2)).isoformat()),
+            {'poll': 'x'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [result['status'] for result in data['results']],
+            ['accepted', 'accepted', 'duplicate', 'duplicate', 'rejected', 'rejected', 'rejected'],
+        )
+        self.assertEqual((data['accepted'], data['duplicate'], data['rejected']), (2, 2, 3))
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((self.choice1.votes_count, self.choice2.votes_count), (1, 1))
+        self.assertEqual(Vote.objects.filter(poll=self.poll).count(), 3)
+
+    def test_ballots_lost_to_a_concurrent_vote_are_duplicates(self):
+        insert = bulk._insert_ballots
+
+        def vote_first(rows):
+            # voters[1] votes on the site after the duplicate check.
+            Vote.objects.create(poll=self.poll, choice=self.choice2, voter=self.voters[1])
+            return insert(rows)
+
+        self.client.login(username='manager', password='password123')
+        with mock.patch.object(bulk, '_insert_ballots', vote_first):
+            data = self.post([self.ballot(self.voters[0]), self.ballot(self.voters[1])]).json()
+        self.assertEqual([result['status'] for result in data['results']], ['accepted', 'duplicate'])
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes_count, 1)
+        self.assertEqual(Vote.objects.get(poll=self.poll, voter=self.voters[1]).choice, self.choice2)
+
+    def test_cast_at_is_stored_and_folded_into_rollups(self):
+        Watermark.objects.create(name='vote_rollups', value=timezone.now())
+        cast_at = (timezone.now() - timedelta(hours=3)).replace(microsecond=0)
+        self.client.login(username='manager', password='password123')
+        self.post([self.ballot(self.voters[0], cast_at=cast_at.isoformat())])
+        self.assertEqual(Vote.objects.get(poll=self.poll, voter=self.voters[0]).voted_at, cast_at)
+        rollup = VoteRollup.objects.get(poll=self.poll, resolution=VoteRollup.HOUR)
+        self.assertEqual((rollup.bucket, rollup.count), (bucket_start(cast_at, VoteRollup.HOUR), 1))
+
+    def test_ranked_polls_take_no_ballots(self):
+        self.poll.kind = Poll.RANKED
+        self.poll.save()
+        self.client.login(username='manager', password='password123')
+        data = self.post([self.ballot(self.voters[0])]).json()
+        self.assertEqual(data['results'], [{'status': 'rejected', 'error': 'Ranked polls need a ranking.'}])
+        self.assertFalse(Vote.objects.filter(poll=self.poll).exists())
+
+    def test_archived_polls_take_no_ballots(self):
+        self.poll.end_date = timezone.now() - timedelta(hours=1)
+        self.poll.save()
+        PollVoteArchive.objects.create(poll=self.poll, vote_count=0, voters=b'', choices=b'', voted_at=b'')
+        self.client.login(username='manager', password='password123')
+        cast_at = (timezone.now() - timedelta(hours=2)).isoformat()
+        data = self.post([self.ballot(self.voters[0], cast_at=cast_at)]).json()
+        self.assertEqual(data['results'], [{'status': 'rejected', 'error': 'The votes of this poll have been archived.'}])
+        self.assertFalse(Vote.objects.filter(poll=self.poll).exists())
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        self.client.login(username='manager', password='password123')
+        User.objects.bulk_create([User(username=f'bulk{i}') for i in range(40)])
+        voters = list(User.objects.filter(username__startswith='bulk'))
+        self.post([])  # load the request user into the auth cache
+        with CaptureQueriesContext(connection) as small:
+            self.post([self.ballot(voter) for voter in voters[:5]])
+        with CaptureQueriesContext(connection) as large:
+            self.post([self.ballot(voter) for voter in voters[5:]])
+        self.assertEqual(len(small), len(large))
+
+    def test_requires_manager_and_bounded_batches(self):
+        self.client.login(username='kiosk0', password='password123')
+        self.assertEqual(self.post([]).status_code, 403)
+        self.client.login(username='manager', password='password123')
+        with self.settings(BULK_VOTES_MAX_BATCH=1):
+            self.assertEqual(self.post([self.ballot(self.voters[0])] * 2).status_code, 400)
+        response = self.client.post(self.url, 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BulkPollCreationTests(TestCase):
+
+    def setUp(self):
+        self.manager = User.objects.create_user(username='manager', password='password123')
+        manager_group, _ = Group.objects.get_or_create(name='Managers')
+        self.manager.groups.add(manager_group)
+        self.start = (timezone.now() + timedelta(days=1)).isoformat()
+        self.end = (timezone.now() + timedelta(days=2)).isoformat()
+
+    def item(self, name, choices=('Yes', 'No'), **extra):
+        return {'name': name, 'start_date': self.start, 'end_date': self.end, 'choices': list(choices), **extra}
+
+    def test_api_creates_valid_polls_and_reports_invalid_ones(self):
+        self.client.login(username='manager', password='password123')
+        response = self.client.post(reverse('comm_polls:bulk_polls_api'), json.dumps({'polls': [
+            self.item('Budget'),
+            self.item('Lonely', choices=['Only one', '  ']),
+            self.item('', choices=['A', 'B']),
+            self.item('Venue', choices=['Hall', 'Park', 'Online']),
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['created'], data['invalid']), (2, 2))
+        self.assertEqual(data['results'][1]['errors']['choices'], ['You must provide at least two choices with a name.'])
+        self.assertIn('name', data['results'][2]['errors'])
+        venue = Poll.objects.get(id=data['results'][3]['id'])
+        self.assertEqual(venue.created_by, self.manager)
+        self.assertEqual(list(venue.choices.values_list('name', flat=True)), ['Hall', 'Park', 'Online'])
+
+    def test_api_is_manager_only(self):
+        User.objects.create_user(username='regular', password='password123')
+        self.client.login(username='regular', password='password123')
+        response = self.client.post(reverse('comm_polls:bulk_polls_api'), json.dumps({'polls': []}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_import_command_streams_file_and_reports_line_errors(self):
+        lines = [json.dumps(self.item(f'Imported {i}')) for i in range(5)]
+        lines.insert(2, '{broken')
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as handle:
+            handle.write('\n'.join(lines))
+        self.addCleanup(os.remove, handle.name)
+
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('import_polls', handle.name, owner='manager', batch_size=2, stdout=StringIO(), stderr=err)
+        self.assertIn('line 3: __all__: Invalid JSON', err.getvalue())
+        self.assertEqual(Poll.objects.filter(name__startswith='Imported').count(), 5)
+        self.assertEqual(Choice.objects.filter(poll__name__startswith='Imported').count(), 10)
+
+
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    POLL_PURGE_IN_BACKGROUND=False,
+)
+class PollDeletionTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_superuser(username='owner', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Doomed Poll", created_by=self.owner,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="A")
+        for i in range(3):
+            voter = User.objects.create_user(username=f'doomed{i}', password='password123')
+            Vote.objects.create(poll=self.poll, choice=self.choice, voter=voter)
+        self.client.login(username='owner', password='password123')
+
+    def test_delete_view_hides_poll_then_purges_in_chunks(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('comm_polls:delete_poll', args=[self.poll.id]))
+        self.assertRedirects(response, reverse('comm_polls:polls'))
+        self.assertFalse(Poll.objects.filter(id=self.poll.id).exists())
+        self.assertTrue(Poll.all_objects.filter(id=self.poll.id, deleted_at__isnull=False).exists())
+        self.assertEqual(Vote.objects.filter(poll_id=self.poll.id).count(), 3)
+        self.assertEqual(
+            self.client.get(reverse('comm_polls:vote', args=[self.poll.id])).status_code, 404
+        )
+
+        with self.settings(POLL_PURGE_CHUNK_SIZE=2):
+            for callback in callbacks:
+                callback()
+        self.assertFalse(Poll.all_objects.filter(id=self.poll.id).exists())
+        self.assertFalse(Vote.objects.filter(poll_id=self.poll.id).exists())
+        self.assertFalse(Choice.objects.filter(poll_id=self.poll.id).exists())
+
+    def test_admin_delete_hides_without_collecting_votes(self):
+        url = reverse('admin:comm_polls_poll_delete', args=[self.poll.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'doomed0 voted on')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'post': 'yes'})
+        self.assertFalse(Poll.all_objects.filter(id=self.poll.id).exists())
+        self.assertFalse(Vote.objects.exists())
+
+    def test_purge_command_sweeps_leftovers(self):
+        Poll.objects.filter(id=self.poll.id).update(deleted_at=timezone.now())
+        out = StringIO()
+        call_command('purge_deleted_polls', chunk_size=1, stdout=out)
+        self.assertIn('Purged 1 polls (5 rows)', out.getvalue())
+        self.assertFalse(Vote.objects.exists())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminScalingTests(TestCase):
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(username='admin', password='password123')
+        now = timezone.now()
+        self.polls = []
+        for i in range(2):
+            poll = Poll.objects.create(
+                name=f"Admin Poll {i}", created_by=self.admin_user,
+                start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+            )
+            Choice.objects.create(poll=poll, name=f"Choice {i}")
+            self.polls.append(poll)
+        self.client.login(username='admin', password='password123')
+        self.url = reverse('admin:comm_polls_vote_changelist')
+
+    def add_votes(self, count, start=0):
+        for i in range(start, start + count):
+            voter = User.objects.create_user(username=f'admin-voter{i}')
+            poll = self.polls[i % 2]
+            Vote.objects.create(poll=poll, choice=poll.choices.first(), voter=voter)
+
+    def test_vote_changelist_query_count_does_not_grow_with_rows(self):
+        self.add_votes(2)
+        self.client.get(self.url)  # load the request user into the auth cache
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.add_votes(20, start=2)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(len(few), len(many))
+        # Only the paginator counts; the extra "full result" count is disabled.
+        self.assertEqual(sum('COUNT(' in query['sql'] for query in many), 1)
+
+    def test_input_filters_narrow_the_changelist(self):
+        self.add_votes(4)
+        response = self.client.get(self.url, {'poll': self.polls[0].id})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        response = self.client.get(self.url, {'voter': 'admin-voter1'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get(reverse('admin:comm_polls_choice_changelist'), {'poll': 'Admin Poll 1'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get(reverse('admin:comm_polls_poll_changelist'), {'creator': 'admin'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertContains(response, 'name="creator"')
+
+    def test_estimated_paginator_is_exact_outside_postgresql(self):
+        self.add_votes(3)
+        paginator = EstimatedCountPaginator(Vote.objects.order_by('pk'), 100)
+        self.assertEqual(paginator.count, 3)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ProfileQueryCountTests(TestCase):
+    """Profile rows are written once and loaded together with the user."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', password='password123', email='m@example.com')
+
+    def profile_queries(self, queries):
+        """Statements that read or write the profile table on their own (joins excluded)."""
+        targets = ('FROM "comm_polls_profile"', 'INTO "comm_polls_profile"', 'UPDATE "comm_polls_profile"')
+        return [q['sql'].split()[0] for q in queries if any(t in q['sql'] for t in targets)]
+
+    def test_signup_writes_profile_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('comm_polls:signup'), {
+                'username': 'fresh', 'email': 'fresh@example.com',
+                'password1': 'ComplexPass123', 'password2': 'ComplexPass123',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.profile_queries(queries), ['INSERT'])
+        self.assertTrue(Profile.objects.filter(user__username='fresh').exists())
+
+    def test_login_does_not_touch_the_profile(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'username': 'member', 'password': 'password123'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.profile_queries(queries), [])
+
+    def test_account_settings_loads_profile_with_user(self):
+        self.client.login(username='member', password='password123')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('comm_polls:account_settings'))
+        self.assertContains(response, 'Default Avatar')
+        self.assertEqual(self.profile_queries(queries), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('comm_polls:account_settings'), {'username': 'member', 'email': 'new@example.com'})
+        self.assertEqual(self.profile_queries(queries), [])
+
+    def test_avatar_upload_writes_profile(self):
+        self.client.login(username='member', password='password123')
+        image = BytesIO()
+        Image.new('RGB', (1, 1)).save(image, 'PNG')
+        avatar = SimpleUploadedFile('a.png', image.getvalue(), content_type='image/png')
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.client.post(reverse('comm_polls:account_settings'),
+                             {'username': 'member', 'email': 'm@example.com', 'avatar': avatar})
+            self.user.profile.refresh_from_db()
+            self.assertTrue(self.user.profile.avatar.name.startswith('avatars/'))
+
+
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+)
+@override_settings(CACHE_IS_SHARED=True)
+class AuthCacheTests(TestCase):
+    """Sessions and request users come from the cache and are dropped on change."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='member', password='Password123', email='m@example.com')
+        self.client.login(username='member', password='Password123')
+        self.url = reverse('comm_polls:account_settings')
+
+    def test_warm_page_view_runs_no_auth_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_admin_edit_is_seen_on_next_request(self):
+        self.client.get(self.url)
+        User.objects.filter(pk=self.user.pk).update(email='stale@example.com')
+        self.assertEqual(self.client.get(self.url).context['user'].email, 'm@example.com')
+        user = User.objects.get(pk=self.user.pk)
+        user.email = 'admin@example.com'
+        user.save()
+        self.assertEqual(self.client.get(self.url).context['user'].email, 'admin@example.com')
+
+    def test_group_change_updates_roles(self):
+        self.assertEqual(self.client.get(reverse('comm_polls:create_poll')).status_code, 302)
+        group, _ = Group.objects.get_or_create(name='Managers')
+        group.user_set.add(self.user)
+        self.assertEqual(self.client.get(reverse('comm_polls:create_poll')).status_code, 200)
+        self.user.groups.clear()
+        self.assertEqual(self.client.get(reverse('comm_polls:create_poll')).status_code, 302)
+
+    def test_password_change_logs_out_other_sessions(self):
+        other = self.client_class()
+        other.login(username='member', password='Password123')
+        other.get(self.url)
+        response = self.client.post(reverse('comm_polls:password_change'), {
+            'old_password': 'Password123', 'new_password1': 'NewPassword456', 'new_password2': 'NewPassword456',
+        })
+        self.assertRedirects(response, reverse('comm_polls:password_change_done'))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(other.get(self.url).status_code, 302)
+
+    @override_settings(CACHE_IS_SHARED=False)
+    def test_per_process_cache_keeps_no_users(self):
+        self.client.get(self.url)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        User.objects.filter(pk=self.user.pk).update(email='admin@example.com')
+        self.assertEqual(self.client.get(self.url).context['user'].email, 'admin@example.com')
+
+    def test_sessions_of_the_plain_model_backend_stay_logged_in(self):
+        other = self.client_class()
+        other.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(other.get(self.url).context['user'], self.user)
+        self.assertEqual(other.session['_auth_user_backend'], 'django.contrib.auth.backends.ModelBackend')
+
+    def test_logout_forgets_session_and_user(self):
+        self.client.get(self.url)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+        self.client.post(reverse('logout'))
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_QUEUE=0, PASSWORD_HASHING_TIMEOUT=0.1,
+)
+class PasswordHashingTests(TestCase):
+    """Hashing runs in a bounded pool and old hashes are upgraded on login."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', password='Password123')
+
+    def hold_pool(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with get_pool().slot():
+                held.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait(5)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+
+    def test_full_pool_answers_503(self):
+        self.hold_pool()
+        response = self.client.post(reverse('login'), {'username': 'member', 'password': 'Password123'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_default_pool_turns_hashes_away_before_every_thread_is_taken(self):
+        threads = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))['threads']
+        entered, release = threading.Semaphore(0), threading.Event()
+        outcomes = []
+
+        def login():
+            try:
+                with get_pool().slot():
+                    entered.release()
+                    release.wait(5)
+                outcomes.append('hashed')
+            except HashingBusy:
+                outcomes.append('busy')
+                entered.release()
+
+        with self.settings(WEB_THREADS=threads, WEB_PROCESSES=4, CPU_COUNT=4,
+                           PASSWORD_HASHING_WORKERS=None, PASSWORD_HASHING_QUEUE=None, PASSWORD_HASHING_TIMEOUT=5):
+            workers = [threading.Thread(target=login) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            # One hashes, the queue takes all but one of the other threads.
+            entered.acquire(timeout=5)
+            entered.acquire(timeout=5)
+            self.assertEqual(outcomes, ['busy'])
+            release.set()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(sorted(outcomes), ['busy'] + ['hashed'] * (threads - 1))
+
+    @override_settings(PASSWORD_HASHERS=[
+        'comm_polls.hashers.BoundedPBKDF2PasswordHasher',
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_legacy_hash_is_upgraded_on_login(self):
+        User.objects.filter(pk=self.user.pk).update(password=make_password('Password123', hasher='md5'))
+        response = self.client.post(reverse('login'), {'username': 'member', 'password': 'Password123'})
+        self.assertEqual(response.status_code, 302)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+    @unittest.skipUnless(importlib.util.find_spec('argon2'), 'argon2-cffi is not installed')
+    @override_settings(PASSWORD_HASHERS=[
+        'comm_polls.hashers.BoundedArgon2PasswordHasher',
+        'comm_polls.hashers.BoundedPBKDF2PasswordHasher',
+    ])
+    def test_pbkdf2_hash_is_upgraded_to_argon2(self):
+        self.client.post(reverse('login'), {'username': 'member', 'password': 'Password123'})
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$'))
+
+    def test_bench_logins_reports_rates(self):
+        out = StringIO()
+        call_command('bench_logins', hasher=['bounded-pbkdf2'], threads=1, seconds=0, stdout=out)
+        self.assertIn('bounded-pbkdf2: 1 logins', out.getvalue())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class MetricsEndpointTests(TestCase):
+    """/metrics adds up the files of all workers and is limited to scrapers and staff."""
+
+    def setUp(self):
+        self.metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.metrics_dir.cleanup)
+        overrides = self.settings(METRICS_DIR=self.metrics_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username='voter', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Metrics Poll", created_by=self.user,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="Choice 1")
+
+    def test_reports_latency_votes_queries_and_active_polls(self):
+        self.client.login(username='voter', password='password123')
+        self.client.post(reverse('comm_polls:vote', args=[self.poll.id]), {'choice': self.choice.id})
+        self.client.post(reverse('comm_polls:vote', args=[self.poll.id]), {'choice': self.choice.id})
+        response = self.client.get(reverse('comm_polls:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE commpolls_http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'commpolls_http_request_duration_seconds_bucket{method="POST",view="comm_polls:vote",le="+Inf"}', body
+        )
+        self.assertIn('commpolls_votes_total{result="accepted",source="web"}', body)
+        self.assertIn('commpolls_votes_total{result="duplicate",source="web"}', body)
+        self.assertIn('commpolls_db_queries_total{view="comm_polls:vote"}', body)
+        self.assertIn('commpolls_cache_hit_ratio{cache="voter_bitmap"}', body)
+        self.assertIn('commpolls_active_polls 1\n', body)
+
+    def test_sums_the_files_of_other_workers(self):
+        worker = {'counters': [['commpolls_votes_total', {'result': 'accepted', 'source': 'kiosk'}, 5]],
+                  'histograms': []}
+        for pid in (1, 2):
+            with open(os.path.join(self.metrics_dir.name, f'{pid}.json'), 'w') as fh:
+                json.dump(worker, fh)
+        body = self.client.get(reverse('comm_polls:metrics')).content.decode()
+        self.assertIn('commpolls_votes_total{result="accepted",source="kiosk"} 10\n', body)
+
+    def test_files_of_exited_workers_are_folded_once(self):
+        worker = {'counters': [['commpolls_votes_total', {'result': 'accepted', 'source': 'kiosk'}, 5]],
+                  'histograms': []}
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        for pid in (exited.pid, os.getppid()):
+            with open(os.path.join(self.metrics_dir.name, f'{pid}.json'), 'w') as fh:
+                json.dump(worker, fh)
+        for _ in range(2):
+            body = self.client.get(reverse('comm_polls:metrics')).content.decode()
+            self.assertIn('commpolls_votes_total{result="accepted",source="kiosk"} 10\n', body)
+        self.assertNotIn(f'{exited.pid}.json', os.listdir(self.metrics_dir.name))
+        self.assertIn('retired.json', os.listdir(self.metrics_dir.name))
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.0/8'])
+    def test_limited_to_allowed_addresses_and_staff(self):
+        url = reverse('comm_polls:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.1.2.3').status_code, 200)
+        # Relayed by nginx, whose address is on the allowed network as well.
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='10.1.2.3', HTTP_X_REAL_IP='203.0.113.9').status_code, 403)
+        User.objects.create_user(username='staff', password='password123', is_staff=True)
+        self.client.login(username='staff', password='password123')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    REQUEST_PROFILE_INTERVAL=0.0005,
+)
+class RequestProfilingTests(TestCase):
+    """Only staff or a signed header can profile a request; profiles land in the admin."""
+
+    def setUp(self):
+        self.profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profile_dir.cleanup)
+        overrides = self.settings(REQUEST_PROFILE_DIR=self.profile_dir.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.staff = User.objects.create_superuser(username='staff', password='password123', email='s@example.com')
+        User.objects.create_user(username='member', password='password123')
+        self.url = reverse('comm_polls:home')
+
+    def test_staff_flag_profiles_the_request(self):
+        self.client.login(username='staff', password='password123')
+        response = self.client.get(self.url, {'_profile': '1'})
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual((profile.url_name, profile.method, profile.status_code), ('comm_polls:home', 'GET', 200))
+        self.assertEqual(profile.user, self.staff)
+        self.assertGreater(profile.query_count, 0)
+        with profile.folded.open('r') as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines), profile.samples)
+
+    def test_flag_is_ignored_for_other_users(self):
+        self.client.get(self.url, {'_profile': '1'})
+        self.client.login(username='member', password='password123')
+        response = self.client.get(self.url, {'_profile': '1'})
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_signed_header_profiles_without_a_session(self):
+        self.client.get(self.url, HTTP_X_PROFILE_TOKEN='forged')
+        self.assertFalse(RequestProfile.objects.exists())
+        response = self.client.get(self.url, HTTP_X_PROFILE_TOKEN=make_token())
+        self.assertTrue(RequestProfile.objects.filter(pk=response['X-Profile-Id'], user=None).exists())
+
+    def test_admin_lists_and_serves_profiles(self):
+        self.client.login(username='staff', password='password123')
+        profile_id = self.client.get(self.url, {'_profile': '1'})['X-Profile-Id']
+        response = self.client.get(reverse('admin:comm_polls_requestprofile_changelist'))
+        self.assertContains(response, 'comm_polls:home')
+        self.assertContains(self.client.get(reverse('admin:comm_polls_requestprofile_change', args=[profile_id])),
+                            'Hottest stacks')
+        response = self.client.get(reverse('admin:comm_polls_requestprofile_folded', args=[profile_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        response.close()
+
+
+    def test_hottest_stacks_skip_malformed_lines(self):
+        self.client.login(username='staff', password='password123')
+        profile = RequestProfile.objects.get(pk=self.client.get(self.url, {'_profile': '1'})['X-Profile-Id'])
+        with profile.folded.open('w') as fh:
+            fh.write('\nmain;handle;render 7\nno-count\nmain;query twelve\n')
+        response = self.client.get(reverse('admin:comm_polls_requestprofile_change', args=[profile.pk]))
+        self.assertContains(response, '     7  render &lt;- handle &lt;- main')
+        self.assertNotContains(response, 'twelve')
+
+class StartupToolsTests(SimpleTestCase):
+    """The import audit and the start-up benchmark run against real subprocesses."""
+
+    def test_audit_imports_reports_packages_and_modules(self):
+        out = StringIO()
+        call_command('audit_imports', limit=3, stdout=out)
+        self.assertIn('modules imported in', out.getvalue())
+        self.assertRegex(out.getvalue(), r'\ndjango +\d+\.\d')
+
+    def test_bench_startup_times_the_first_response(self):
+        out = StringIO()
+        call_command('bench_startup', server='runserver', runs=1, timeout=30, stdout=out)
+        self.assertRegex(out.getvalue(), r'run 1: first response \(\d{3}\) after \d+ ms')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PollOpeningTests(TestCase):
+    """Cached vote forms, warming before the start and queued admission at opening time."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Opening Poll", created_by=self.user,
+            start_date=now - timedelta(minutes=1), end_date=now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="Choice 1")
+        self.client.login(username='voter', password='password123')
+        self.url = reverse('comm_polls:vote', args=[self.poll.id])
+
+    def hold_gate(self):
+        gate = get_gate()
+        self.assertTrue(gate.acquire(0))
+        return gate
+
+    def test_vote_page_uses_cached_choice_list_until_choices_change(self):
+        self.assertContains(self.client.get(self.url), 'Choice 1')
+        self.assertIn('Choice 1', cache.get(choice_list_key(self.poll.id)))
+        self.choice.name = 'Renamed'
+        self.choice.save()
+        self.assertIsNone(cache.get(choice_list_key(self.poll.id)))
+        self.assertContains(self.client.get(self.url), 'Renamed')
+
+    def test_countdown_warms_polls_about_to_open(self):
+        self.poll.start_date = timezone.now() + timedelta(seconds=60)
+        self.poll.save()
+        response = self.client.get(reverse('comm_polls:poll_countdown', args=[self.poll.id]))
+        self.assertContains(response, 'data-jitter-ms="3000"')
+        self.assertIsNotNone(cache.get(choice_list_key(self.poll.id)))
+
+    def test_warm_opening_polls_command(self):
+        self.poll.start_date = timezone.now() + timedelta(seconds=120)
+        self.poll.save()
+        out = StringIO()
+        call_command('warm_opening_polls', within=300, stdout=out)
+        self.assertIn('Warmed 1 polls.', out.getvalue())
+        self.assertIsNotNone(cache.get(choice_list_key(self.poll.id)))
+
+    @override_settings(VOTE_ADMISSION_SLOTS=None)
+    def test_default_gate_is_narrower_than_the_worker_threads(self):
+        threads = runpy.run_path(str(settings.BASE_DIR / 'gunicorn.conf.py'))['threads']
+        with self.settings(WEB_THREADS=threads):
+            self.assertEqual(get_gate().slots, threads - 1)
+        with self.settings(WEB_THREADS=1):
+            self.assertEqual(admission_slots(), 1)
+
+    @override_settings(VOTE_ADMISSION_SLOTS=1, VOTE_ADMISSION_WAIT=0.05)
+    def test_full_gate_sends_pages_to_waiting_room_but_accepts_ballots(self):
+        gate = self.hold_gate()
+        self.addCleanup(gate.release)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertTemplateUsed(response, 'comm_polls/waiting_room.html')
+        self.assertIn(response['Retry-After'], [str(n) for n in range(1, 6)])
+        self.assertContains(response, f'data-retry-url="{self.url}"', status_code=503)
+
+        self.client.post(self.url, {'choice': self.choice.id})
+        self.assertTrue(Vote.objects.filter(poll=self.poll, voter=self.user).exists())
+
+    @override_settings(VOTE_ADMISSION_SLOTS=1, VOTE_ADMISSION_WAIT=5)
+    def test_queued_page_is_served_once_a_slot_frees(self):
+        gate = self.hold_gate()
+        threading.Timer(0.1, gate.release).start()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RateLimitTests(TestCase):
+    """Token buckets on writes and AJAX validators, per user or client IP."""
+
+    def setUp(self):
+        clear_buckets()
+        self.user = User.objects.create_user(username='voter', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Limited Poll", created_by=self.user,
+            start_date=now - timedelta(minutes=1), end_date=now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="Choice 1")
+        self.vote_url = reverse('comm_polls:vote', args=[self.poll.id])
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('20/m'), (20, 20 / 60))
+        for bad in ('20', 'x/m', '20/w'):
+            with self.assertRaises(ValueError):
+                parse_rate(bad)
+
+    @override_settings(RATELIMIT_SLOTS=SLOT_WAYS)
+    def test_full_table_pushes_out_the_idlest_bucket(self):
+        clear_buckets()
+        for client in range(SLOT_WAYS):
+            self.assertEqual(take_token(f'client{client}', '1/h'), 0)
+        self.assertGreater(take_token('client1', '1/h'), 0)
+        # client0 is the idlest: the newcomer takes its slot, and client0
+        # starts over with a full bucket.
+        self.assertEqual(take_token('newcomer', '1/h'), 0)
+        self.assertGreater(take_token('newcomer', '1/h'), 0)
+        self.assertGreater(take_token('client1', '1/h'), 0)
+        self.assertEqual(take_token('client0', '1/h'), 0)
+
+    @override_settings(RATE_LIMITS={'comm_polls:validate_username': '2/m'})
+    def test_validator_burst_gets_json_429_without_queries(self):
+        url = reverse('comm_polls:validate_username') + '?username=someone'
+        for _ in range(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['retry_after'], 30)
+        self.assertEqual(response['Retry-After'], '30')
+
+    @override_settings(RATE_LIMITS={'comm_polls:vote': '1/m'})
+    def test_only_ballots_count_and_users_have_their_own_bucket(self):
+        self.client.login(username='voter', password='password123')
+        for _ in range(3):
+            self.assertEqual(self.client.get(self.vote_url).status_code, 200)
+        self.client.post(self.vote_url, {'choice': self.choice.id})
+        response = self.client.post(self.vote_url, {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+
+        other = User.objects.create_user(username='other', password='password123')
+        self.client.force_login(other)
+        self.client.post(self.vote_url, {'choice': self.choice.id})
+        self.assertTrue(Vote.objects.filter(poll=self.poll, voter=other).exists())
+
+    @override_settings(RATE_LIMITS={'comm_polls:signup': '1/h'}, RATELIMIT_IP_HEADER='HTTP_X_REAL_IP')
+    def test_anonymous_clients_are_keyed_by_forwarded_address(self):
+        url = reverse('comm_polls:signup')
+        self.assertEqual(self.client.post(url, {}, HTTP_X_REAL_IP='10.0.0.1').status_code, 200)
+        self.assertEqual(self.client.post(url, {}, HTTP_X_REAL_IP='10.0.0.1').status_code, 429)
+        self.assertEqual(self.client.post(url, {}, HTTP_X_REAL_IP='10.0.0.2').status_code, 200)
+
+    @override_settings(RATE_LIMITS={'comm_polls:validate_email': '1/m'}, RATELIMIT_ENABLED=False)
+    def test_can_be_switched_off(self):
+        url = reverse('comm_polls:validate_email') + '?email=a@example.com'
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PollCacheTests(TestCase):
+    """Poll pages read the poll row through the cache and see every change."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Cached Poll", created_by=self.user,
+            start_date=now - timedelta(minutes=1), end_date=now + timedelta(days=1)
+        )
+        Choice.objects.create(poll=self.poll, name="Choice 1")
+        self.client.login(username='owner', password='password123')
+
+    def poll_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in ctx.captured_queries if 'FROM "comm_polls_poll"' in q['sql']]
+
+    def test_second_hit_does_not_query_the_poll(self):
+        url = reverse('comm_polls:results', args=[self.poll.id])
+        self.assertEqual(len(self.poll_queries(url)[1]), 1)
+        response, queries = self.poll_queries(url)
+        self.assertContains(response, 'Cached Poll')
+        self.assertEqual(queries, [])
+
+    def test_per_process_cache_keeps_polls_only_briefly(self):
+        url = reverse('comm_polls:results', args=[self.poll.id])
+        with self.settings(CACHE_IS_SHARED=False, POLL_CACHE_LOCAL_TIMEOUT=0, POLL_CACHE_TIMEOUT=300):
+            self.poll_queries(url)
+            self.assertEqual(len(self.poll_queries(url)[1]), 1)
+        with self.settings(CACHE_IS_SHARED=True, POLL_CACHE_LOCAL_TIMEOUT=0, POLL_CACHE_TIMEOUT=300):
+            self.poll_queries(url)
+            self.assertEqual(self.poll_queries(url)[1], [])
+
+    def test_closing_the_poll_is_seen_at_once(self):
+        vote_url = reverse('comm_polls:vote', args=[self.poll.id])
+        self.assertEqual(self.client.get(vote_url).status_code, 200)
+        self.client.post(reverse('comm_polls:manage_poll', args=[self.poll.id]), {'close_poll': '1'})
+        self.assertRedirects(self.client.get(vote_url), reverse('comm_polls:results', args=[self.poll.id]))
+
+    def test_hidden_and_foreign_polls_404(self):
+        manage_url = reverse('comm_polls:manage_poll', args=[self.poll.id])
+        self.assertEqual(self.client.get(manage_url).status_code, 200)
+        other = User.objects.create_user(username='other', password='password123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(manage_url).status_code, 404)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('comm_polls:delete_poll', args=[self.poll.id]))
+        self.assertIsNone(cache.get(poll_key(self.poll.id)))
+        self.assertEqual(self.client.get(reverse('comm_polls:poll_results_api', args=[self.poll.id])).status_code, 404)
+
+
+class ResultsBatchApiTests(TestCase):
+    """Dashboards fetch the counts of many polls in one request."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='password123')
+        now = timezone.now()
+        self.polls = []
+        for i in range(3):
+            poll = Poll.objects.create(
+                name=f"Poll {i}", created_by=self.user,
+                start_date=now - timedelta(hours=1), end_date=now + timedelta(days=1)
+            )
+            Choice.objects.create(poll=poll, name="Yes", votes_count=i)
+            Choice.objects.create(poll=poll, name="No", votes_count=10)
+            self.polls.append(poll)
+        self.url = reverse('comm_polls:poll_results_batch_api')
+
+    def get(self, ids, **headers):
+        return self.client.get(self.url, {'ids': ','.join(str(i) for i in ids)}, **headers)
+
+    def test_all_tallies_in_one_query(self):
+        ids = [poll.id for poll in self.polls] + [999999]
+        with self.assertNumQueries(1):
+            response = self.get(ids)
+        data = response.json()
+        self.assertEqual(data['missing'], [999999])
+        first = self.polls[2]
+        self.assertEqual(data['polls'][str(first.id)], [[c.id, c.votes_count] for c in first.choices.order_by('id')])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(ids[:-1]).json(), {'polls': data['polls'], 'missing': []})
+
+    def test_etag_answers_304_until_counts_change(self):
+        ids = [poll.id for poll in self.polls]
+        etag = self.get(ids)['ETag']
+        self.assertEqual(self.get(ids, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        cache.clear()
+        Choice.objects.filter(poll=self.polls[0]).update(votes_count=F('votes_count') + 1)
+        response = self.get(ids, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_hidden_polls_are_missing(self):
+        self.get([self.polls[0].id])
+        hide_polls([self.polls[0]])
+        self.assertEqual(self.get([self.polls[0].id]).json(), {'polls': {}, 'missing': [self.polls[0].id]})
+
+    @override_settings(RESULTS_BATCH_MAX_POLLS=2)
+    def test_bad_or_too_many_ids(self):
+        self.assertEqual(self.get([poll.id for poll in self.polls]).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+
+@override_settings(COMPRESSION_MIN_BYTES=100)
+class CompressionTests(TestCase):
+    """Responses are compressed per Accept-Encoding and compressed bodies are reused."""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.body = json.dumps({str(i): i * 7 for i in range(200)}).encode()
+
+    def json_response(self, body=None):
+        return HttpResponse(body or self.body, content_type='application/json')
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate, br'), 'br')
+        self.assertEqual(negotiate('br;q=0, gzip'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=1.0, br;q=0.5'), 'gzip')
+        self.assertEqual(negotiate('*'), 'br')
+        self.assertIsNone(negotiate('identity'))
+        self.assertIsNone(negotiate(''))
+
+    def test_compresses_and_reuses_the_body(self):
+        request = self.factory.get('/api/')
+        response = compress_response(request, self.json_response(), 'br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(brotli.decompress(response.content), self.body)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertIsNotNone(cache.get(body_key('br', hashlib.blake2b(self.body, digest_size=16).hexdigest())))
+
+        gzipped = compress_response(request, self.json_response(), 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.content), self.body)
+
+    def test_leaves_small_private_and_encoded_responses(self):
+        request = self.factory.get('/api/')
+        self.assertNotIn('Content-Encoding', compress_response(request, self.json_response(b'{}'), 'br'))
+        self.assertNotIn('Content-Encoding', compress_response(request, self.json_response(), None))
+        private = self.json_response()
+        private['Cache-Control'] = 'private'
+        self.assertEqual(compress_response(request, private, 'gzip')['Content-Encoding'], 'gzip')
+        self.assertEqual(cache.get(body_key('gzip', hashlib.blake2b(self.body, digest_size=16).hexdigest())), None)
+        image = HttpResponse(b'x' * 1000, content_type='image/png')
+        self.assertNotIn('Content-Encoding', compress_response(request, image, 'br'))
+
+    def test_personal_pages_are_padded_gzip_never_brotli(self):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING='br, gzip')
+        lengths = set()
+        for _ in range(10):
+            page = HttpResponse(self.body, content_type='text/html')
+            page['Vary'] = 'Cookie'
+            response = compress_response(request, page, 'br')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.content), self.body)
+            lengths.add(len(response.content))
+        self.assertGreater(len(lengths), 1)
+        self.assertIsNone(cache.get(body_key('gzip', hashlib.blake2b(self.body, digest_size=16).hexdigest())))
+
+        brotli_only = self.factory.get('/', HTTP_ACCEPT_ENCODING='br')
+        page = HttpResponse(self.body, content_type='text/html')
+        page['Cache-Control'] = 'private'
+        self.assertNotIn('Content-Encoding', compress_response(brotli_only, page, 'br'))
+
+        stream = StreamingHttpResponse(iter([self.body[:500], self.body[500:]]), content_type='text/csv')
+        stream['Cache-Control'] = 'private'
+        response = compress_response(request, stream, 'br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
+
+    def test_streaming_responses_stay_streaming(self):
+        chunks = [b'line %d\n' % i * 20 for i in range(50)]
+        for encoding, decompress in (('gzip', gzip.decompress), ('br', brotli.decompress)):
+            response = compress_response(
+                self.factory.get('/'), StreamingHttpResponse(iter(chunks), content_type='text/csv'), encoding
+            )
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertFalse(response.has_header('Content-Length'))
+            self.assertEqual(decompress(b''.join(response.streaming_content)), b''.join(chunks))
+
+    def ended_poll_url(self):
+        user = User.objects.create_user(username='owner', password='password123')
+        now = timezone.now()
+        poll = Poll.objects.create(
+            name="Ended", created_by=user, start_date=now - timedelta(days=2), end_date=now - timedelta(days=1)
+        )
+        for i in range(40):
+            Choice.objects.create(poll=poll, name=f"Choice {i}", votes_count=i)
+        return poll, reverse('comm_polls:poll_results_api', args=[poll.id])
+
+    @override_settings(CACHE_IS_SHARED=True)
+    def test_ended_poll_results_are_served_by_url(self):
+        poll, url = self.ended_poll_url()
+        now = timezone.now()
+        first = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+        self.assertIn('public', first['Cache-Control'])
+        with self.assertNumQueries(0):
+            second = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            plain = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(json.loads(brotli.decompress(second.content)), json.loads(plain.content))
+        self.assertEqual(plain['Content-Type'], 'application/json')
+
+        poll.end_date = now + timedelta(days=1)
+        poll.save()
+        self.assertNotIn('public', self.client.get(url).get('Cache-Control', ''))
+
+    @override_settings(CACHE_IS_SHARED=False)
+    def test_per_process_cache_remembers_no_pages(self):
+        poll, url = self.ended_poll_url()
+        self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+        self.assertIsNone(cache.get(page_key(url)))
+        Choice.objects.filter(poll=poll).update(votes_count=0)
+        self.assertEqual(set(self.client.get(url).json().values()), {0})
+
+
+@override_settings(
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+    AVATAR_STORAGE='remote',
+    AVATAR_UPLOAD_IN_BACKGROUND=False,
+)
+class AvatarStorageTests(TestCase):
+    """Avatars move to the remote storage after the upload; a local directory stands in for the bucket."""
+
+    def setUp(self):
+        cache.clear()
+        media_root, bucket = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.addCleanup(bucket.cleanup)
+        self.bucket = bucket.name
+        remote = override_settings(MEDIA_ROOT=media_root.name, AVATAR_REMOTE_STORAGE={
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': bucket.name, 'base_url': 'https://avatars.example.com/'},
+        })
+        remote.enable()
+        self.addCleanup(remote.disable)
+        self.user = User.objects.create_user(username='member', password='password123')
+        self.client.login(username='member', password='password123')
+
+    def image(self, name='a.png'):
+        image = BytesIO()
+        Image.new('RGB', (1, 1)).save(image, 'PNG')
+        return SimpleUploadedFile(name, image.getvalue(), content_type='image/png')
+
+    def upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('comm_polls:account_settings'),
+                             {'username': 'member', 'email': 'm@example.com', 'avatar': self.image()})
+        return Profile.objects.get(user=self.user)
+
+    def test_upload_moves_to_remote_storage(self):
+        profile = self.upload()
+        self.assertTrue(profile.avatar_remote)
+        self.assertTrue(os.path.exists(os.path.join(self.bucket, profile.avatar.name)))
+        self.assertFalse(default_storage.exists(profile.avatar.name))
+
+        response = self.client.get(reverse('comm_polls:home'))
+        self.assertContains(response, f'src="https://avatars.example.com/{profile.avatar.name}"')
+        self.assertEqual(cache.get(url_key(self.user.id)), f'https://avatars.example.com/{profile.avatar.name}')
+
+    def test_new_upload_is_local_until_moved(self):
+        profile = self.upload()
+        profile.avatar = self.image('b.png')
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            profile.save()
+        self.assertFalse(Profile.objects.get(pk=profile.pk).avatar_remote)
+        self.assertIsNone(cache.get(url_key(self.user.id)))
+        self.assertTrue(profile.avatar_url.startswith('/media/avatars/'))
+        self.assertEqual(len(callbacks), 2)  # the upload, and deleting the replaced object
+
+    def test_replacing_a_remote_avatar_deletes_the_old_object(self):
+        old = self.upload().avatar.name
+        profile = self.upload()
+        self.assertTrue(profile.avatar_remote)
+        self.assertNotEqual(profile.avatar.name, old)
+        self.assertFalse(os.path.exists(os.path.join(self.bucket, old)))
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.avatar = None
+            profile.save()
+        self.assertEqual(os.listdir(os.path.join(self.bucket, 'avatars')), [])
+
+    def test_failed_background_upload_is_retried(self):
+        with mock.patch.object(avatars, 'offload_avatar', side_effect=[OSError('bucket down'), True]) as offload, \
+                mock.patch.object(avatars.time, 'sleep'), self.assertLogs('comm_polls.avatars', 'ERROR'):
+            avatars._offload_in_background(1, 'avatars/a.png')
+        self.assertEqual(offload.call_count, 2)
+
+    @override_settings(AVATAR_STORAGE='local')
+    def test_migrate_avatars_moves_existing_files(self):
+        profile = self.upload()
+        self.assertFalse(profile.avatar_remote)
+        with self.assertRaises(CommandError):
+            call_command('migrate_avatars', stdout=StringIO())
+
+        with self.settings(AVATAR_STORAGE='remote'):
+            out = StringIO()
+            call_command('migrate_avatars', stdout=out)
+            self.assertIn('Moved 1 avatars', out.getvalue())
+            profile.refresh_from_db()
+            self.assertTrue(profile.avatar_remote)
+            self.assertTrue(profile.avatar_url.startswith('https://avatars.example.com/avatars/'))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RankedVotingTests(TestCase):
+    """Ranked polls store each ballot's ranking and are decided by instant runoff."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='password123')
+        now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Ranked Poll", created_by=self.owner, kind=Poll.RANKED,
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(days=1)
+        )
+        self.a, self.b, self.c = [Choice.objects.create(poll=self.poll, name=name) for name in 'ABC']
+
+    def cast(self, *rankings):
+        for number, ranking in enumerate(rankings):
+            voter = User.objects.create_user(username=f'voter{Vote.objects.count()}-{number}', password='x')
+            Vote.objects.create(poll=self.poll, choice=ranking[0], voter=voter, ranking=pack([c.id for c in ranking]))
+
+    def test_engine_transfers_eliminated_ballots(self):
+        candidates = np.array([10, 20, 30], dtype=np.int64)
+        rankings = [pack([10, 20])] * 3 + [pack([20, 30])] * 2 + [pack([30, 20])] * 2 + [pack([99])]
+        result = instant_runoff(ballot_matrix(rankings, candidates), 3)
+        self.assertEqual([r['counts'] for r in result['rounds']], [[3, 2, 2], [3, None, 4]])
+        # B and C tie on first preferences; the one listed first goes.
+        self.assertEqual(result['rounds'][0]['eliminated'], 1)
+        self.assertEqual(result['rounds'][1]['exhausted'], 1)  # the unknown choice
+        self.assertEqual(result['winner'], 2)
+
+    def test_parse_ranking(self):
+        self.assertEqual(parse_ranking([1, 2, 3], {'rank_1': '2', 'rank_3': '1', 'rank_2': ''}), [3, 1])
+        for data in ({}, {'rank_1': '1', 'rank_2': '1'}, {'rank_1': '0'}, {'rank_1': 'first'}):
+            with self.assertRaises(ValueError):
+                parse_ranking([1, 2, 3], data)
+
+    def test_vote_stores_the_ranking(self):
+        voter = User.objects.create_user(username='voter', password='password123')
+        self.client.force_login(voter)
+        url = reverse('comm_polls:vote', args=[self.poll.id])
+        self.assertContains(self.client.get(url), f'name="rank_{self.b.id}"')
+
+        response = self.client.post(url, {f'rank_{self.a.id}': '1', f'rank_{self.b.id}': '1'})
+        self.assertContains(response, 'without repeating a number')
+        self.client.post(url, {f'rank_{self.c.id}': '1', f'rank_{self.a.id}': '2'})
+        vote = Vote.objects.get(poll=self.poll, voter=voter)
+        self.assertEqual(vote.choice, self.c)
+        self.assertEqual(np.frombuffer(bytes(vote.ranking), dtype='<i8').tolist(), [self.c.id, self.a.id])
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.votes_count, 1)
+
+    def test_results_show_rounds_and_stay_cached_after_the_end(self):
+        self.cast(*[(self.a, self.b)] * 3, *[(self.b, self.c)] * 2, *[(self.c, self.b)] * 2)
+        self.poll.end_date = timezone.now() - timedelta(minutes=1)
+        self.poll.save()
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('comm_polls:results', args=[self.poll.id]))
+        self.assertContains(response, 'Round 2')
+        self.assertEqual(response.context['runoff']['winner'], self.c.id)
+        self.assertEqual(response.context['runoff_rows'][0]['counts'], [3, 3])
+        self.assertIsNotNone(cache.get(results_key(self.poll.id)))
+
+        self.poll.end_date = timezone.now() + timedelta(days=1)
+        self.poll.save()
+        self.assertIsNone(cache.get(results_key(self.poll.id)))
+
+    @override_settings(RANKED_RESULTS_TIMEOUT=0)
+    def test_an_ended_polls_tally_expires(self):
+        self.cast((self.a, self.b))
+        self.poll.end_date = timezone.now() - timedelta(minutes=1)
+        self.poll.save()
+        self.assertEqual(ranked_results(self.poll)['ballots'], 1)
+        self.cast((self.b, self.a))  # e.g. a vote restored in the admin
+        self.assertEqual(ranked_results(self.poll)['ballots'], 2)
+
+    @override_settings(RANKED_RESULTS_WAIT=5)
+    def test_concurrent_misses_wait_for_one_tally(self):
+        self.cast((self.a, self.b))
+        cache.add(f'{results_key(self.poll.id)}:tallying', True, 5)
+        tallied = {'ballots': 99}
+        threading.Timer(0.2, cache.set, (results_key(self.poll.id), tallied)).start()
+        with self.assertNumQueries(0):
+            self.assertEqual(ranked_results(self.poll), tallied)
+
+    def test_ranked_polls_are_not_archived(self):
+        self.poll.end_date = timezone.now() - timedelta(days=60)
+        self.poll.save()
+        self.assertNotIn(self.poll, archivable_polls(30))
+
+    def test_engine_handles_a_large_poll(self):
+        rng = np.random.default_rng(0)
+        count, candidates = 200000, 20
+        order = np.argsort(rng.random((count, candidates)) ** 2 * np.arange(1, candidates + 1), axis=1)
+        depth = rng.integers(1, candidates + 1, count)
+        rankings = [order[i, :depth[i]].astype('<i8').tobytes() for i in range(count)]
+        matrix = ballot_matrix(rankings, np.arange(candidates, dtype=np.int64))
+        result = instant_runoff(matrix, candidates)
+        self.assertIsNotNone(result['winner'])
+        final = result['rounds'][-1]
+        self.assertEqual(sum(c for c in final['counts'] if c) + final['exhausted'], count)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class VoteRollupTests(TestCase):
+    """Per-minute, hour and day vote counts folded from Vote and served to the manage page."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='password123')
+        self.now = timezone.now()
+        self.poll = Poll.objects.create(
+            name="Busy Poll", created_by=self.owner,
+            start_date=self.now - timedelta(days=2), end_date=self.now + timedelta(days=1)
+        )
+        self.choice = Choice.objects.create(poll=self.poll, name="Choice 1")
+        self.voters = 0
+
+    def cast(self, count, ago):
+        for _ in range(count):
+            self.voters += 1
+            voter = User.objects.create_user(username=f'voter{self.voters}', password='password123')
+            vote = Vote.objects.create(poll=self.poll, choice=self.choice, voter=voter)
+            Vote.objects.filter(pk=vote.pk).update(voted_at=self.now - ago)
+
+    def rollup(self, resolution, ago):
+        row = VoteRollup.objects.filter(
+            poll=self.poll, resolution=resolution, bucket=bucket_start(self.now - ago, resolution)
+        ).first()
+        return row.count if row else 0
+
+    def test_fold_counts_minutes_hours_and_days(self):
+        self.cast(3, timedelta(minutes=1))
+        self.cast(2, timedelta(days=1))
+        summary = fold_vote_rollups()
+        self.assertEqual(summary['polls'], 1)
+        self.assertEqual(self.rollup('minute', timedelta(minutes=1)), 3)
+        self.assertEqual(self.rollup('hour', timedelta(days=1)), 2)
+        self.assertEqual(
+            sum(VoteRollup.objects.filter(poll=self.poll, resolution='day').values_list('count', flat=True)), 5
+        )
+
+    def test_incremental_fold_is_repeatable_and_picks_up_new_votes(self):
+        self.cast(2, timedelta(seconds=30))
+        fold_vote_rollups()
+        fold_vote_rollups()
+        self.assertEqual(self.rollup('minute', timedelta(seconds=30)), 2)
+        self.cast(1, timedelta(seconds=30))
+        summary = fold_vote_rollups()
+        self.assertIsNotNone(summary['since'])
+        self.assertEqual(self.rollup('minute', timedelta(seconds=30)), 3)
+
+    def test_series_includes_votes_not_folded_yet(self):
+        self.cast(2, timedelta(minutes=5))
+        fold_vote_rollups()
+        Watermark.objects.filter(name='vote_rollups').update(value=self.now - timedelta(minutes=3))
+        self.cast(4, timedelta(minutes=2))
+        series = dict(vote_series(self.poll, 'minute'))
+        self.assertEqual(len(series), 181)
+        self.assertEqual(series[bucket_start(self.now - timedelta(minutes=5), 'minute')], 2)
+        self.assertEqual(series[bucket_start(self.now - timedelta(minutes=2), 'minute')], 4)
+
+    def test_series_counts_unfolded_votes_of_the_last_hour_only(self):
+        self.cast(2, timedelta(days=1))
+        self.cast(3, timedelta(minutes=10))
+        series = vote_series(self.poll, 'day')
+        self.assertEqual(sum(count for _, count in series), 3)
+        fold_vote_rollups()
+        self.assertEqual(sum(count for _, count in vote_series(self.poll, 'day')), 5)
+
+    def test_old_minute_buckets_are_pruned(self):
+        self.cast(1, timedelta(days=9))
+        self.poll.start_date = self.now - timedelta(days=10)
+        self.poll.save()
+        fold_vote_rollups()
+        self.assertEqual(self.rollup('minute', timedelta(days=9)), 0)
+        self.assertEqual(self.rollup('hour', timedelta(days=9)), 1)
+
+    def test_velocity_endpoint(self):
+        self.cast(2, timedelta(hours=2))
+        call_command('fold_vote_rollups', stdout=StringIO())
+        url = reverse('comm_polls:poll_velocity_api', args=[self.poll.id])
+        self.client.login(username='owner', password='password123')
+
+        response = self.client.get(url, {'resolution': 'hour'})
+        data = response.json()
+        self.assertEqual(data['resolution'], 'hour')
+        self.assertEqual(sum(count for _, count in data['buckets']), 2)
+        self.assertEqual(self.client.get(url, {'resolution': 'week'}).status_code, 400)
+        self.assertContains(self.client.get(reverse('comm_polls:manage_poll', args=[self.poll.id])), 'vote-velocity.js')
+
+        self.client.force_login(User.objects.get(username='voter1'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec('numpy') and importlib.util.find_spec('scipy'), 'numpy/scipy are not installed'
+)
+class PollAnalyticsTests(TestCase):
+    """Columnar cross-poll statistics, loaded in voter chunks."""
+
+    def setUp(self):
+        now = timezone.now()
+        self.users = [User.objects.create_user(username=f'user{i}', password='password123') for i in range(10)]
+        self.polls, self.choices = [], []
+        for name in ('First', 'Second'):
+            poll = Poll.objects.create(name=name, created_by=self.users[0],
+                                       start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+            self.polls.append(poll)
+            self.choices.append([Choice.objects.create(poll=poll, name=f'{name} {n}') for n in 'AB'])
+        # First: 7 vs 3. Second: users 0-3, split 2/2.
+        for i, user in enumerate(self.users):
+            Vote.objects.create(poll=self.polls[0], choice=self.choices[0][i >= 7], voter=user)
+        for i, user in enumerate(self.users[:4]):
+            Vote.objects.create(poll=self.polls[1], choice=self.choices[1][i % 2], voter=user)
+
+    def test_statistics_match_across_chunk_sizes(self):
+        from .analytics import build_report
+
+        for chunk_size in (1, 3, 1000):
+            report = build_report(chunk_size=chunk_size)
+            self.assertEqual(report.poll_votes.tolist(), [10, 4])
+            self.assertEqual(report.choice_votes.tolist(), [7, 3, 2, 2])
+            self.assertEqual(report.voters, 10)
+            self.assertEqual(report.overlap.toarray().tolist(), [[0, 4], [0, 0]])
+
+        self.assertEqual(report.turnout().tolist(), [1.0, 0.4])
+        winner, margin = report.winners()
+        self.assertEqual(winner[0], 0)
+        self.assertAlmostEqual(margin[0], 0.4)
+        self.assertAlmostEqual(margin[1], 0.0)
+        low, high = report.wilson_intervals()
+        self.assertAlmostEqual(low[0], 0.3968, places=4)
+        self.assertAlmostEqual(high[0], 0.8922, places=4)
+        self.assertEqual(report.top_overlaps(10), [(0, 1, 4, 0.4)])
+
+    def test_command_writes_report_with_archived_ballots(self):
+        poll = self.polls[1]
+        poll.end_date = timezone.now() - timedelta(days=100)
+        poll.save()
+        call_command('archive_votes', days=90, stdout=StringIO())
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        out = StringIO()
+        call_command('poll_analytics', output=directory.name, chunk_size=2, stdout=out)
+        self.assertIn('10 live and 4 archived ballots', out.getvalue())
+        with open(os.path.join(directory.name, 'polls.csv')) as handle:
+            rows = list(csv.DictReader(handle))
+        self.assertEqual([row['votes'] for row in rows], ['10', '4'])
+        self.assertEqual(rows[0]['leading_choice_id'], str(self.choices[0][0].id))
+        with open(os.path.join(directory.name, 'choices.csv')) as handle:
+            self.assertEqual(len(list(csv.DictReader(handle))), 4)
+
+
+class DatasetDumpTests(TestCase):
+    """dump_dataset and restore_dataset round trips, including a resumed restore."""
+
+    def setUp(self):
+        now = timezone.now()
+        self.manager = User.objects.create_user(username='manager', password='password123', email='m@example.com')
+        self.manager.groups.add(Group.objects.get_or_create(name='Managers')[0])
+        self.voters = [User.objects.create_user(username=f'voter{i}', password='password123') for i in range(3)]
+        self.poll = Poll.objects.create(name="Live", created_by=self.manager,
+                                        start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+        self.old_poll = Poll.objects.create(name="Old", created_by=self.manager,
+                                            start_date=now - timedelta(days=200), end_date=now - timedelta(days=100))
+        for poll in (self.poll, self.old_poll):
+            choice = Choice.objects.create(poll=poll, name="Yes", votes_count=3)
+            Choice.objects.create(poll=poll, name="No")
+            for voter in self.voters:
+                Vote.objects.create(poll=poll, choice=choice, voter=voter)
+        archive_polls([self.old_poll.id])
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def snapshot(self):
+        return {
+            'users': list(User.objects.order_by('id').values_list('id', 'username', 'password', 'date_joined')),
+            'groups': list(User.objects.filter(groups__name='Managers').values_list('username', flat=True)),
+            'profiles': list(Profile.objects.order_by('id').values_list('id', 'user_id')),
+            'polls': list(Poll.all_objects.order_by('id').values_list('id', 'name', 'created_at')),
+            'votes': list(Vote.objects.order_by('id').values_list('id', 'poll_id', 'choice_id', 'voter_id', 'voted_at')),
+            'archives': [bytes(row) for row in PollVoteArchive.objects.values_list('voters', flat=True)],
+        }
+
+    def wipe(self):
+        Poll.all_objects.all().delete()
+        User.objects.all().delete()
+
+    def test_round_trip_keeps_every_row_and_timestamp(self):
+        before = self.snapshot()
+        call_command('dump_dataset', self.directory, chunk_size=2, stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'votes-00001.jsonl.gz')))
+        self.wipe()
+
+        out = StringIO()
+        call_command('restore_dataset', self.directory, batch_size=2, stdout=out, stderr=StringIO())
+        self.assertIn('found 0 counter mismatches', out.getvalue())
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, PROGRESS)))
+        self.assertTrue(self.client.login(username='voter1', password='password123'))
+
+    def test_restore_refuses_a_populated_database(self):
+        call_command('dump_dataset', self.directory, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'Restore needs empty tables'):
+            call_command('restore_dataset', self.directory, stdout=StringIO())
+
+    def test_interrupted_restore_resumes(self):
+        before = self.snapshot()
+        call_command('dump_dataset', self.directory, chunk_size=2, stdout=StringIO())
+        self.wipe()
+        call_command('restore_dataset', self.directory, stdout=StringIO(), stderr=StringIO())
+        # As if the run had stopped after the users, with part of the votes committed.
+        with open(os.path.join(self.directory, PROGRESS), 'w') as handle:
+            json.dump({'files': ['users-00000.jsonl.gz', 'users-00001.jsonl.gz']}, handle)
+        Vote.objects.filter(pk=before['votes'][-1][0]).delete()
+
+        call_command('restore_dataset', self.directory, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_counter_drift_is_reported_and_fixed(self):
+        Choice.objects.filter(poll=self.poll, name='Yes').update(votes_count=1)
+        call_command('dump_dataset', self.directory, stdout=StringIO())
+        self.wipe()
+        err = StringIO()
+        call_command('restore_dataset', self.directory, fix_counters=True, stdout=StringIO(), stderr=err)
+        self.assertIn('votes_count 1, votes 3', err.getvalue())
+        self.assertEqual(Choice.objects.get(poll=self.poll, name='Yes').votes_count, 3)
+
+
+class GenerateLoadDataTests(TestCase):
+    """Seeded synthetic data: unique ballots, consistent counters, repeatable output."""
+
+    def shape(self, prefix):
+        """The generated votes with ids replaced by positions, comparable between runs."""
+        users = {pk: i for i, pk in enumerate(
+            User.objects.filter(username__startswith=f'{prefix}-').order_by('id').values_list('id', flat=True))}
+        polls = Poll.objects.filter(created_by__username__startswith=f'{prefix}-').order_by('id')
+        shape = []
+        for n, poll in enumerate(polls):
+            choices = {pk: i for i, pk in enumerate(poll.choices.order_by('id').values_list('id', flat=True))}
+            for choice_id, voter_id, voted_at in poll.poll_votes.order_by('id').values_list('choice_id', 'voter_id', 'voted_at'):
+                self.assertTrue(poll.start_date <= voted_at <= poll.end_date)
+                shape.append((n, choices[choice_id], users[voter_id]))
+        return shape
+
+    def test_generates_consistent_repeatable_data(self):
+        from .stress import check_vote_counters
+
+        out = StringIO()
+        call_command('generate_load_data', users=60, polls=12, votes=300, seed=5, prefix='a', chunk_size=7, stdout=out)
+        self.assertIn('Created 60 users, 12 polls', out.getvalue())
+        self.assertTrue(check_vote_counters()['ok'])
+        self.assertEqual(Profile.objects.filter(user__username__startswith='a-').count(), 60)
+        self.assertTrue(User.objects.get(username='a-0').groups.filter(name='Managers').exists())
+        self.assertFalse(Vote.objects.filter(poll__start_date__gt=timezone.now()).exists())
+        first = self.shape('a')
+        self.assertGreater(len(first), 100)
+
+        call_command('generate_load_data', users=60, polls=12, votes=300, seed=5, prefix='b', stdout=StringIO())
+        self.assertEqual(self.shape('b'), first)
+        self.assertTrue(check_vote_counters()['ok'])
+
+    def test_refuses_an_existing_prefix(self):
+        User.objects.create_user(username='load-0')
+        with self.assertRaisesMessage(CommandError, 'already exist'):
+            call_command('generate_load_data', users=5, polls=1, votes=5, stdout=StringIO())
@@ -20,7 +20,12 @@ urlpatterns = [
     path('polls/<int:poll_id>/vote/', views.vote, name='vote'),
     path('polls/<int:poll_id>/results/', views.results, name='results'),
     path('polls/<int:poll_id>/countdown/', views.poll_countdown, name='poll_countdown'),
+    path('api/polls/results/', views.poll_results_batch_api, name='poll_results_batch_api'),
     path('api/polls/<int:poll_id>/results/', views.poll_results_api, name='poll_results_api'),
+    path('api/polls/<int:poll_id>/velocity/', views.poll_velocity_api, name='poll_velocity_api'),
+    path('api/votes/bulk/', views.bulk_votes_api, name='bulk_votes_api'),
+    path('api/polls/bulk/', views.bulk_polls_api, name='bulk_polls_api'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
     path(
         'password_change/',
         auth_views.PasswordChangeView.as_view(
@@ -1,13 +1,33 @@
-from django.http import JsonResponse
+import hashlib
+import ipaddress
+import json
+from collections import Counter
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, models as auth_models
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import F, prefetch_related_objects
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET, require_POST
 from .forms import SignUpForm, UserUpdateForm, PollForm, ChoiceFormSet
-from .models import Poll, Choice, Vote, ManagerRequest
+from .models import Poll, Choice, Vote, ManagerRequest, VoteRollup
+from .backends import MANAGERS_GROUP, is_manager
+from .archive import archived_choice_ids, archived_votes, pack
+from . import bitmaps, metrics
+from .pollcache import get_poll_or_404
+from .purge import hide_polls
+from .opening import admission_controlled, get_choice_list, opens_soon, warm_poll
+from .ratelimit import ratelimit
+from .rollups import SERIES_WINDOWS, vote_series
+from .ranked import parse_ranking, ranked_results, round_table
+from .tallies import poll_tallies
+from .bulk import ACCEPTED, CREATED, DUPLICATE, REJECTED, create_polls, submit_ballots
 
 def home(request):
     """Home page showing all polls with filtering."""
@@ -33,29 +53,23 @@ def home(request):
             polls = polls.filter(start_date__gt=now)
 
     voted_poll_ids = []
-    if request.user.is_authenticated and voted_status:
-        voted_poll_ids = request.user.user_votes.values_list('poll_id', flat=True)
+    if request.user.is_authenticated:
+        voted_poll_ids = list(request.user.user_votes.values_list('poll_id', flat=True))
+        voted_poll_ids += list(archived_choice_ids(request.user))
         if voted_status == 'voted':
             polls = polls.filter(id__in=voted_poll_ids)
         elif voted_status == 'not_voted':
             polls = polls.exclude(id__in=voted_poll_ids)
 
-    if request.user.is_authenticated and not voted_poll_ids:
-        voted_poll_ids = list(request.user.user_votes.values_list('poll_id', flat=True))
-
     # Sorting logic
     if sort_by in ['end_date', 'start_date', 'name', '-created_at']:
         polls = polls.order_by(sort_by)
 
-    is_manager = False
-    if request.user.is_authenticated:
-        is_manager = request.user.is_superuser or request.user.groups.filter(name='Managers').exists()
-
     context = {
         'polls': polls,
         'filters': request.GET,
         'voted_poll_ids': voted_poll_ids,
-        'is_manager': is_manager,
+        'is_manager': is_manager(request.user),
     }
     return render(request, "comm_polls/home.html", context)
 
@@ -70,19 +84,23 @@ def polls_list(request):
 @login_required
 def my_votes(request):
     """Show polls the user has voted on."""
-    user_votes = Vote.objects.filter(voter=request.user).select_related(
+    user_votes = list(Vote.objects.filter(voter=request.user, poll__deleted_at__isnull=True).select_related(
         'poll', 'choice'
     ).prefetch_related(
         'poll__choices'  # Efficiently prefetch all choices for the polls
-    )
+    ))
+    archived = archived_votes(request.user)
+    if archived:
+        prefetch_related_objects([vote.poll for vote in archived], 'choices')
+        user_votes += archived
     return render(request, "comm_polls/my_votes.html", {"user_votes": user_votes})
 
 
+@ratelimit(methods=('POST',))
 @login_required
 def create_poll(request):
     # Check if user is a manager (in 'Managers' group or superuser)
-    is_manager = request.user.is_superuser or request.user.groups.filter(name='Managers').exists()
-    if not is_manager:
+    if not is_manager(request.user):
         return redirect('comm_polls:request_manager')
 
     if request.method == 'POST':
@@ -111,8 +129,7 @@ def create_poll(request):
 
 @login_required
 def request_manager_status(request):
-    is_manager = request.user.is_superuser or request.user.groups.filter(name='Managers').exists()
-    if is_manager:
+    if is_manager(request.user):
         # Managers should just go to the create poll page
         return redirect('comm_polls:create_poll')
 
@@ -141,7 +158,7 @@ def manage_requests(request):
         manager_request = get_object_or_404(ManagerRequest, id=request_id)
 
         if action == 'approve':
-            manager_group, created = auth_models.Group.objects.get_or_create(name='Managers')
+            manager_group, created = auth_models.Group.objects.get_or_create(name=MANAGERS_GROUP)
             manager_request.user.groups.add(manager_group)
             manager_request.status = 'approved'
             messages.success(request, f"User {manager_request.user.username} has been promoted to Manager.")
@@ -157,12 +174,13 @@ def manage_requests(request):
 
 @login_required
 def manage_poll(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id, created_by=request.user)
+    poll = get_poll_or_404(poll_id, created_by=request.user)
 
     if request.method == 'POST':
         if 'close_poll' in request.POST:
             poll.end_date = timezone.now()
-            poll.save()
+            # Only end_date: the rest of a cached poll may be a little old.
+            poll.save(update_fields=['end_date'])
             messages.success(request, 'Poll has been closed.')
             return redirect('comm_polls:manage_poll', poll_id=poll.id)
 
@@ -171,49 +189,83 @@ def manage_poll(request, poll_id):
 
 @login_required
 def delete_poll(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id, created_by=request.user)
+    poll = get_poll_or_404(poll_id, created_by=request.user)
     if request.method == 'POST':
-        poll.delete()
+        hide_polls([poll])
         messages.success(request, 'Poll deleted successfully.')
         return redirect('comm_polls:polls')
     return render(request, 'comm_polls/delete_poll.html', {'poll': poll})
 
 
+def _count_vote(request, result):
+    # GETs of the vote page go through the same checks; only submissions count.
+    if request.method == 'POST':
+        metrics.inc('commpolls_votes_total', result=result, source='web')
+
+
+@ratelimit(methods=('POST',))
 @login_required
+@admission_controlled
 def vote(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id)
+    poll = get_poll_or_404(poll_id)
 
     if not poll.has_started:
+        _count_vote(request, REJECTED)
         return redirect('comm_polls:poll_countdown', poll_id=poll.id)
 
     if poll.has_ended:
+        _count_vote(request, REJECTED)
         messages.warning(request, 'This poll has already ended.')
         return redirect('comm_polls:results', poll_id=poll.id)
 
-    if poll.poll_votes.filter(voter=request.user).exists():
+    if bitmaps.has_voted(poll.id, request.user.id):
+        _count_vote(request, DUPLICATE)
         messages.warning(request, 'You have already voted on this poll.')
         return redirect('comm_polls:results', poll_id=poll.id)
 
     if request.method == 'POST':
         try:
-            selected_choice_id = request.POST['choice']
-            selected_choice = poll.choices.get(id=selected_choice_id)
-        except (KeyError, Choice.DoesNotExist):
+            if poll.is_ranked:
+                ranking = parse_ranking(poll.choices.values_list('id', flat=True), request.POST)
+                selected_choice = poll.choices.get(id=ranking[0])
+            else:
+                ranking = None
+                selected_choice_id = request.POST['choice']
+                selected_choice = poll.choices.get(id=selected_choice_id)
+        except (KeyError, ValueError, Choice.DoesNotExist):
+            _count_vote(request, REJECTED)
             return render(request, 'comm_polls/vote.html', {
                 'poll': poll,
-                'error_message': "You didn't select a choice.",
+                'choice_list': get_choice_list(poll),
+                'error_message': (
+                    "Number the choices you support, 1 for your first preference, without repeating a number."
+                    if poll.is_ranked else "You didn't select a choice."
+                ),
             })
         else:
-            with transaction.atomic():
-                Vote.objects.create(poll=poll, choice=selected_choice, voter=request.user)
-                selected_choice.votes_count += 1
-                selected_choice.save()
+            # The exists() check above is only a fast path; concurrent submissions
+            # are settled by the (poll, voter) unique constraint, and the counter
+            # is incremented in SQL so parallel votes cannot overwrite each other.
+            try:
+                with transaction.atomic():
+                    Vote.objects.create(
+                        poll=poll, choice=selected_choice, voter=request.user,
+                        ranking=pack(ranking) if ranking else None,
+                    )
+                    Choice.objects.filter(pk=selected_choice.pk).update(votes_count=F('votes_count') + 1)
+            except IntegrityError:
+                _count_vote(request, DUPLICATE)
+                messages.warning(request, 'You have already voted on this poll.')
+                return redirect('comm_polls:results', poll_id=poll.id)
+            bitmaps.record_vote(poll.id, request.user.id)
+            _count_vote(request, ACCEPTED)
 
             messages.success(request, 'Your vote has been recorded!')
             return redirect('comm_polls:results', poll_id=poll.id)
     
     context = {
         "poll": poll,
+        "choice_list": get_choice_list(poll),
         "server_now": timezone.now().isoformat(),
     }
     return render(request, "comm_polls/vote.html", context)
@@ -221,43 +273,182 @@ def vote(request, poll_id):
 
 @login_required
 def results(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id)
+    poll = get_poll_or_404(poll_id)
     choices = poll.choices.order_by('-votes_count')
 
     # Get the user's vote for this poll, if it exists
     user_vote = None
     if request.user.is_authenticated:
-        try:
-            user_vote = Vote.objects.get(poll=poll, voter=request.user)
-        except Vote.DoesNotExist:
-            user_vote = None
+        # Not bitmaps.has_voted(): its "no" may be stale, and a "yes" needs this row anyway.
+        user_vote = Vote.objects.filter(poll=poll, voter=request.user).select_related('choice').first()
+        if user_vote is None and poll.has_ended:
+            user_vote = next(iter(archived_votes(request.user, poll_ids=[poll.id])), None)
 
     context = {
         "poll": poll,
         "choices": choices,
         "user_vote": user_vote,
     }
+    if poll.is_ranked:
+        runoff = ranked_results(poll)
+        context["runoff"] = runoff
+        context["runoff_rows"] = round_table(runoff, choices)
     return render(request, "comm_polls/results.html", context)
 
 
 @login_required
 def poll_countdown(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id)
+    poll = get_poll_or_404(poll_id)
     if poll.has_started:
         return redirect('comm_polls:vote', poll_id=poll.id)
+    if opens_soon(poll):
+        warm_poll(poll)
     return render(request, "comm_polls/poll_countdown.html", {
         "poll": poll,
         "server_now": timezone.now().isoformat(), # Pass the pre-formatted time string
+        "jitter_ms": settings.POLL_OPENING_JITTER_MS,
     })
 
 
 def poll_results_api(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id)
+    poll = get_poll_or_404(poll_id)
     choices = poll.choices.all()
     results = {choice.id: choice.votes_count for choice in choices}
-    return JsonResponse(results)
+    response = JsonResponse(results)
+    if poll.has_ended:
+        # Final counts: shared caches, and CompressionMiddleware, may keep them.
+        patch_cache_control(response, public=True, max_age=settings.ENDED_POLL_RESULTS_MAX_AGE)
+    return response
+
+
+@require_GET
+def poll_results_batch_api(request):
+    """
+    Vote counts of several polls in one response, for dashboards:
+    ?ids=1,2,3 gives {"polls": {"1": [[choice id, votes], ...]}, "missing": [...]}.
+    Sends an ETag and answers 304 while the counts are unchanged.
+    """
+    try:
+        poll_ids = list(dict.fromkeys(int(value) for value in request.GET.get('ids', '').split(',') if value.strip()))
+    except ValueError:
+        poll_ids = None
+    if not poll_ids:
+        return JsonResponse({'error': 'Expected ids as a comma-separated list of poll ids.'}, status=400)
+    if len(poll_ids) > settings.RESULTS_BATCH_MAX_POLLS:
+        return JsonResponse(
+            {'error': f'At most {settings.RESULTS_BATCH_MAX_POLLS} polls per request.'}, status=400
+        )
+
+    tallies = poll_tallies(poll_ids)
+    body = json.dumps({
+        'polls': {str(poll_id): tallies[poll_id] for poll_id in poll_ids if poll_id in tallies},
+        'missing': [poll_id for poll_id in poll_ids if poll_id not in tallies],
+    }, separators=(',', ':'))
+    etag = quote_etag(hashlib.md5(body.encode(), usedforsecurity=False).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Let clients keep the body but check back every time.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@login_required
+def poll_velocity_api(request, poll_id):
+    """Votes per minute, hour or day of a poll, from the rollups (poll owner only)."""
+    poll = get_poll_or_404(poll_id, created_by=request.user)
+    resolution = request.GET.get('resolution', VoteRollup.MINUTE)
+    if resolution not in SERIES_WINDOWS:
+        return JsonResponse({'error': f'resolution must be one of: {", ".join(SERIES_WINDOWS)}.'}, status=400)
+    return JsonResponse({
+        'resolution': resolution,
+        'buckets': [[bucket.isoformat(), count] for bucket, count in vote_series(poll, resolution)],
+    })
+
+
+@require_POST
+def bulk_votes_api(request):
+    """Store a JSON batch of ballots collected offline by kiosks (managers only)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    if not is_manager(request.user):
+        return JsonResponse({'error': 'Only managers can submit ballots in bulk.'}, status=403)
+
+    try:
+        ballots = json.loads(request.body)['ballots']
+    except (ValueError, KeyError, TypeError):
+        ballots = None
+    if not isinstance(ballots, list):
+        return JsonResponse({'error': 'Expected a JSON object with a "ballots" list.'}, status=400)
+    if len(ballots) > settings.BULK_VOTES_MAX_BATCH:
+        return JsonResponse(
+            {'error': f'At most {settings.BULK_VOTES_MAX_BATCH} ballots per request.'}, status=400
+        )
+
+    results = submit_ballots(ballots)
+    counts = Counter(result['status'] for result in results)
+    for status, count in counts.items():
+        metrics.inc('commpolls_votes_total', count, result=status, source='bulk')
+    return JsonResponse({
+        'accepted': counts[ACCEPTED],
+        'duplicate': counts[DUPLICATE],
+        'rejected': counts[REJECTED],
+        'results': results,
+    })
+
+
+@require_POST
+def bulk_polls_api(request):
+    """Create a JSON batch of polls with their choices in one transaction (managers only)."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    if not is_manager(request.user):
+        return JsonResponse({'error': 'Only managers can create polls.'}, status=403)
+
+    try:
+        items = json.loads(request.body)['polls']
+    except (ValueError, KeyError, TypeError):
+        items = None
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'Expected a JSON object with a "polls" list.'}, status=400)
+    if len(items) > settings.BULK_POLLS_MAX_BATCH:
+        return JsonResponse(
+            {'error': f'At most {settings.BULK_POLLS_MAX_BATCH} polls per request.'}, status=400
+        )
+
+    results = create_polls(items, request.user)
+    created = sum(result['status'] == CREATED for result in results)
+    return JsonResponse(
+        {'created': created, 'invalid': len(results) - created, 'results': results},
+        status=201 if created else 400,
+    )
+
+
+
+def _metrics_client_allowed(request):
+    # Requests relayed by nginx come from an address on the internal network
+    # too; only direct scrapes of web:8000 count.
+    if 'HTTP_X_REAL_IP' in request.META:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def prometheus_metrics(request):
+    """Metrics of all workers in the Prometheus text format, for scrapers and staff."""
+    if not (_metrics_client_allowed(request) or request.user.is_staff):
+        return HttpResponse(status=403)
+    now = timezone.now()
+    active = Poll.objects.filter(start_date__lte=now, end_date__gte=now).count()
+    body = metrics.render([('commpolls_active_polls', {}, active)])
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
+@ratelimit(json=True)
 def validate_username(request):
     """Check if a username is already taken."""
     username = request.GET.get('username', None)
@@ -267,6 +458,7 @@ def validate_username(request):
     return JsonResponse(data)
 
 
+@ratelimit(json=True)
 def validate_email(request):
     """Check if an email is already taken."""
     email = request.GET.get('email', None)
@@ -276,13 +468,14 @@ def validate_email(request):
     return JsonResponse(data)
 
 
+@ratelimit(methods=('POST',))
 def signup(request):
     """Sign-up view for new users."""
     if request.method == "POST":
         form = SignUpForm(request.POST, request.FILES)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            login(request, user, backend='comm_polls.backends.ProfileModelBackend')
             return redirect("comm_polls:home")
     else:
         form = SignUpForm()
@@ -8,6 +8,7 @@ Now updated to load sensitive settings from a .env file.
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # ---------------------------------------------------------------------
@@ -44,14 +45,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "comm_polls.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  # Add WhiteNoise middleware
+    # After WhiteNoise, which serves its own precompressed files; before the
+    # session so public pages are answered from the cache without one.
+    "comm_polls.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "comm_polls.middleware.ProfilingMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "comm_polls.middleware.HashingBusyMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -100,9 +107,92 @@ else:
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            # Concurrent live-server tests need a file-backed test database;
+            # leave unset for the default in-memory one.
+            "TEST": {"NAME": os.getenv("SQLITE_TEST_NAME")},
         }
     }
 
+# ---------------------------------------------------------------------
+# Cache and sessions
+# ---------------------------------------------------------------------
+# Sessions and the per-user auth cache are invalidated through the cache,
+# so every worker must share it: set REDIS_URL in production. Without it
+# each process gets its own local memory cache and sessions stay in the
+# database only.
+REDIS_URL = os.getenv("REDIS_URL")
+# Whether every worker sees the same default cache. Entries that a write
+# must drop everywhere at once (request users, pages by URL) are only
+# cached when it does.
+CACHE_IS_SHARED = bool(REDIS_URL)
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+    SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+    SESSION_ENGINE = "django.contrib.sessions.backends.db"
+
+
+# ---------------------------------------------------------------------
+# Authentication
+# ---------------------------------------------------------------------
+# ModelBackend stays listed so sessions logged in before ProfileModelBackend
+# still resolve their user; new logins go through the first backend.
+AUTHENTICATION_BACKENDS = [
+    "comm_polls.backends.ProfileModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+# How long the request user, profile and roles are served from the cache.
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", 60))
+
+# ---------------------------------------------------------------------
+# Web server processes
+# ---------------------------------------------------------------------
+# The same environment variables and defaults as gunicorn.conf.py, so
+# per-process limits (hashing pool, vote admission) can be sized from the
+# threads each worker process runs.
+try:
+    CPU_COUNT = len(os.sched_getaffinity(0))
+except AttributeError:  # not available on macOS
+    CPU_COUNT = os.cpu_count() or 1
+WEB_PROCESSES = int(os.getenv("WEB_CONCURRENCY", CPU_COUNT))
+WEB_THREADS = int(os.getenv("GUNICORN_THREADS", 4))
+
+# ---------------------------------------------------------------------
+# Password hashing (see comm_polls/hashers.py)
+# ---------------------------------------------------------------------
+# New passwords use the first hasher; hashes made by the others still
+# verify and are upgraded on the next login. PASSWORD_HASHER=argon2
+# switches to the memory-hard Argon2id (needs argon2-cffi).
+PASSWORD_HASHERS = [
+    "comm_polls.hashers.BoundedPBKDF2PasswordHasher",
+    "comm_polls.hashers.BoundedArgon2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+if os.getenv("PASSWORD_HASHER") == "argon2":
+    PASSWORD_HASHERS[:2] = PASSWORD_HASHERS[1::-1]
+
+# Hashes running at once per process, how many more may wait for a slot,
+# and how long they wait before the request gets a 503. Unset, they are
+# sized per gunicorn process from the settings above (see
+# hashers.pool_size).
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", 0)) or None
+PASSWORD_HASHING_QUEUE = int(os.environ["PASSWORD_HASHING_QUEUE"]) if os.getenv("PASSWORD_HASHING_QUEUE") else None
+PASSWORD_HASHING_TIMEOUT = float(os.getenv("PASSWORD_HASHING_TIMEOUT", 5))
+PASSWORD_HASHING_RETRY_AFTER = int(os.getenv("PASSWORD_HASHING_RETRY_AFTER", 2))
+
 # ---------------------------------------------------------------------
 # Password validation
 # ---------------------------------------------------------------------
@@ -146,6 +236,33 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# "local" serves avatars from MEDIA_ROOT; "remote" moves each upload to
+# AVATAR_REMOTE_STORAGE after the request (see comm_polls/avatars.py).
+AVATAR_STORAGE = os.getenv("AVATAR_STORAGE", "local")
+AVATAR_UPLOAD_IN_BACKGROUND = os.getenv("AVATAR_UPLOAD_IN_BACKGROUND", "True") == "True"
+# Tries per background upload before the file is left for migrate_avatars.
+AVATAR_UPLOAD_ATTEMPTS = int(os.getenv("AVATAR_UPLOAD_ATTEMPTS", 3))
+AVATAR_REMOTE_STORAGE = {
+    "BACKEND": os.getenv("AVATAR_REMOTE_BACKEND", "storages.backends.s3.S3Storage"),
+    "OPTIONS": {
+        "bucket_name": os.getenv("AVATAR_S3_BUCKET", "commpolls-avatars"),
+        "endpoint_url": os.getenv("AVATAR_S3_ENDPOINT_URL") or None,
+        "region_name": os.getenv("AVATAR_S3_REGION") or None,
+        "access_key": os.getenv("AVATAR_S3_ACCESS_KEY_ID") or None,
+        "secret_key": os.getenv("AVATAR_S3_SECRET_ACCESS_KEY") or None,
+        "location": "media",
+        "file_overwrite": False,
+        # Signed URLs unless the bucket is public and AVATAR_S3_SIGNED_URLS=False.
+        "querystring_auth": os.getenv("AVATAR_S3_SIGNED_URLS", "True") == "True",
+        "querystring_expire": int(os.getenv("AVATAR_URL_EXPIRE", 3600)),
+        "custom_domain": os.getenv("AVATAR_S3_CUSTOM_DOMAIN") or None,
+        "url_protocol": os.getenv("AVATAR_S3_URL_PROTOCOL", "https:"),
+        "object_parameters": {"CacheControl": "max-age=86400"},
+    },
+}
+# Keep below AVATAR_URL_EXPIRE so a cached signed URL is still valid when used.
+AVATAR_URL_CACHE_TIMEOUT = int(os.getenv("AVATAR_URL_CACHE_TIMEOUT", 3000))
+
 # ---------------------------------------------------------------------
 # Default primary key field type
 # ---------------------------------------------------------------------
@@ -164,3 +281,130 @@ LOGOUT_REDIRECT_URL = "/"
 EMAIL_BACKEND = os.getenv(
     "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
 )
+
+# ---------------------------------------------------------------------
+# Voter bitmaps ("has this user voted" cache, see comm_polls/bitmaps.py)
+# ---------------------------------------------------------------------
+# Each vote reads and rewrites its poll's whole bitmap, so keep this small.
+VOTER_BITMAP_MAX_BYTES = int(os.getenv("VOTER_BITMAP_MAX_BYTES", 64 * 1024))
+VOTER_BITMAP_TIMEOUT = int(os.getenv("VOTER_BITMAP_TIMEOUT", 300))
+# How long a poll stays marked as over budget, and how long one rebuild may
+# hold the lock that keeps other workers from scanning the same votes.
+VOTER_BITMAP_TOO_LARGE_TIMEOUT = int(os.getenv("VOTER_BITMAP_TOO_LARGE_TIMEOUT", 24 * 3600))
+VOTER_BITMAP_BUILD_LOCK_TIMEOUT = int(os.getenv("VOTER_BITMAP_BUILD_LOCK_TIMEOUT", 60))
+
+# ---------------------------------------------------------------------
+# Bulk APIs
+# ---------------------------------------------------------------------
+BULK_VOTES_MAX_BATCH = int(os.getenv("BULK_VOTES_MAX_BATCH", 5000))
+BULK_POLLS_MAX_BATCH = int(os.getenv("BULK_POLLS_MAX_BATCH", 500))
+RESULTS_BATCH_MAX_POLLS = int(os.getenv("RESULTS_BATCH_MAX_POLLS", 100))
+
+# ---------------------------------------------------------------------
+# Poll deletion (see comm_polls/purge.py)
+# ---------------------------------------------------------------------
+POLL_PURGE_IN_BACKGROUND = os.getenv("POLL_PURGE_IN_BACKGROUND", "True") == "True"
+POLL_PURGE_CHUNK_SIZE = int(os.getenv("POLL_PURGE_CHUNK_SIZE", 5000))
+
+# ---------------------------------------------------------------------
+# Poll cache (see comm_polls/pollcache.py)
+# ---------------------------------------------------------------------
+# Saves and deletions drop the entry, in a shared cache for every worker.
+# A per-process cache (no REDIS_URL) is only cleared in the worker that
+# made the change, so the others keep their copy for the local timeout.
+POLL_CACHE_TIMEOUT = int(os.getenv("POLL_CACHE_TIMEOUT", 300))
+POLL_CACHE_LOCAL_TIMEOUT = int(os.getenv("POLL_CACHE_LOCAL_TIMEOUT", 5))
+# Vote counts behind the batch results API (see comm_polls/tallies.py) are
+# not dropped on each vote; this is how stale a dashboard may be.
+POLL_TALLY_TIMEOUT = int(os.getenv("POLL_TALLY_TIMEOUT", 5))
+
+# ---------------------------------------------------------------------
+# Vote counter reconciliation (see comm_polls/counters.py)
+# ---------------------------------------------------------------------
+# reconcile_votes --incremental re-reads this far behind its watermark.
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", 120))
+
+# ---------------------------------------------------------------------
+# Vote velocity rollups (see comm_polls/rollups.py)
+# ---------------------------------------------------------------------
+# fold_vote_rollups re-reads this far behind its watermark for late commits.
+VOTE_ROLLUP_GRACE_SECONDS = int(os.getenv("VOTE_ROLLUP_GRACE_SECONDS", 120))
+VOTE_ROLLUP_MINUTE_DAYS = int(os.getenv("VOTE_ROLLUP_MINUTE_DAYS", 7))
+
+# ---------------------------------------------------------------------
+# Response compression (see comm_polls/compression.py)
+# ---------------------------------------------------------------------
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 512))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+# Personal responses get up to this many random bytes in the gzip header
+# against BREACH, and are never sent as Brotli.
+COMPRESSION_PADDING_BYTES = int(os.getenv("COMPRESSION_PADDING_BYTES", 100))
+# Larger bodies are compressed on every request rather than cached.
+COMPRESSION_CACHE_MAX_BYTES = int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", 256 * 1024))
+COMPRESSION_CACHE_TIMEOUT = int(os.getenv("COMPRESSION_CACHE_TIMEOUT", 3600))
+# The counts of an ended poll are public and cached by URL this long.
+ENDED_POLL_RESULTS_MAX_AGE = int(os.getenv("ENDED_POLL_RESULTS_MAX_AGE", 300))
+
+# ---------------------------------------------------------------------
+# Ranked-choice polls (see comm_polls/ranked.py)
+# ---------------------------------------------------------------------
+# How long an open and an ended poll's instant-runoff tally is reused, and
+# how long requests wait for a tally another request is computing.
+RANKED_RESULTS_LIVE_TIMEOUT = int(os.getenv("RANKED_RESULTS_LIVE_TIMEOUT", 30))
+RANKED_RESULTS_TIMEOUT = int(os.getenv("RANKED_RESULTS_TIMEOUT", 3600))
+RANKED_RESULTS_WAIT = float(os.getenv("RANKED_RESULTS_WAIT", 10))
+
+# ---------------------------------------------------------------------
+# Metrics (see comm_polls/metrics.py)
+# ---------------------------------------------------------------------
+# Shared by all workers of one host; keep it off the image's read-only layers.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 1))
+# Scrapers allowed to read /metrics without a staff login (IPs or CIDRs).
+METRICS_ALLOWED_IPS = os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+
+# ---------------------------------------------------------------------
+# Request profiling (see comm_polls/profiling.py)
+# ---------------------------------------------------------------------
+REQUEST_PROFILE_DIR = Path(os.getenv("REQUEST_PROFILE_DIR", BASE_DIR / "profiles"))
+REQUEST_PROFILE_INTERVAL = float(os.getenv("REQUEST_PROFILE_INTERVAL", 0.002))
+REQUEST_PROFILE_MAX_SECONDS = float(os.getenv("REQUEST_PROFILE_MAX_SECONDS", 30))
+# Lifetime of X-Profile-Token values made by the profile_token command.
+REQUEST_PROFILE_TOKEN_MAX_AGE = int(os.getenv("REQUEST_PROFILE_TOKEN_MAX_AGE", 3600))
+
+# ---------------------------------------------------------------------
+# Poll openings (see comm_polls/opening.py)
+# ---------------------------------------------------------------------
+POLL_OPENING_JITTER_MS = int(os.getenv("POLL_OPENING_JITTER_MS", 3000))
+POLL_OPENING_WARM_SECONDS = int(os.getenv("POLL_OPENING_WARM_SECONDS", 300))
+# Vote pages rendering at once per process; unset, one less than
+# WEB_THREADS, so a thread is always left for ballots and other pages.
+VOTE_ADMISSION_SLOTS = int(os.getenv("VOTE_ADMISSION_SLOTS", 0)) or None
+VOTE_ADMISSION_WAIT = float(os.getenv("VOTE_ADMISSION_WAIT", 2))
+VOTE_ADMISSION_RETRY_MAX = int(os.getenv("VOTE_ADMISSION_RETRY_MAX", 5))
+
+# ---------------------------------------------------------------------
+# Rate limiting (see comm_polls/ratelimit.py)
+# ---------------------------------------------------------------------
+# Token buckets per URL name: "<requests>/<s|m|h|d>", per user or client IP.
+RATE_LIMITS = {
+    "comm_polls:vote": "20/m",
+    "comm_polls:create_poll": "10/m",
+    "comm_polls:signup": "10/h",
+    "comm_polls:validate_username": "120/m",
+    "comm_polls:validate_email": "120/m",
+}
+RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "True") == "True"
+# Buckets live in a fixed-size table in a memory-backed file shared by the
+# workers of one host; RATELIMIT_SLOTS bounds how many clients are tracked.
+SHARED_MEMORY_DIR = Path("/dev/shm") if os.path.isdir("/dev/shm") else Path(tempfile.gettempdir())
+RATELIMIT_STORE = os.getenv("RATELIMIT_STORE", SHARED_MEMORY_DIR / "commpolls-ratelimit.slots")
+RATELIMIT_SLOTS = int(os.getenv("RATELIMIT_SLOTS", 65536))
+RATELIMIT_LOCK_DIR = os.getenv("RATELIMIT_LOCK_DIR", SHARED_MEMORY_DIR / "commpolls-ratelimit-locks")
+# Behind nginx the client address arrives in X-Real-IP; leave unset when
+# the app is reachable directly, or clients could pick their own bucket.
+RATELIMIT_IP_HEADER = os.getenv("RATELIMIT_IP_HEADER") or None
+
+# Gives every test run a private rate-limit store.
+TEST_RUNNER = "comm_polls.test_runner.CommPollsTestRunner"
@@ -0,0 +1,40 @@
+"""
+Production gunicorn settings: `gunicorn -c gunicorn.conf.py config.wsgi`.
+
+The application is imported once in the master (preload_app) and workers
+are forked from it, so a new container is ready after one Django start-up
+rather than one per worker. Workers are threaded (gthread) and sized from
+the CPUs this container may use; every value can be overridden through
+the environment.
+"""
+import os
+
+
+def _cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        return os.cpu_count() or 1
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", _cpus()))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+preload_app = os.getenv("GUNICORN_PRELOAD", "True") == "True"
+# File watching only for local development; it rules out preloading.
+reload = os.getenv("GUNICORN_RELOAD", "False") == "True"
+if reload:
+    preload_app = False
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 20))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# Recycle workers now and then, staggered so they do not restart together.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 500))
+# Heartbeat files in memory rather than on the container's overlay filesystem.
+worker_tmp_dir = os.getenv("GUNICORN_WORKER_TMP_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"